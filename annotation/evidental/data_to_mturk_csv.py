@@ -2,34 +2,25 @@ import argparse
 import json
 import html
 import os
-import re
+import sys
 
 from typing import *
 
-DATA_PATH = "data/processed/"
-
-
-def replace_string(s):
-    """
-    Make some changes to the input string to make it Turk readable
-    """
-
-    # replace all single quotes by double quotes : except at the start/end of the list
-    # s = re.sub(r'([^\]])\"', r'\1""', s)
-    s = re.sub(r"(?<!\}\])\"", r'""', s)
-
-    # replace single quotes
-    s = re.sub(r"\'\{", r"{", s)
-    s = re.sub(r"\}\'", r"}", s)
-
-    # replace two backslashes with three
-    s = re.sub(r"\\\\", r"\\\\\\", s)
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts"),
+)
+from mturk.hit_batches import (
+    add_batching_args,
+    escape_template,
+    replace_string,
+    write_hit_batches,
+)
+from utils.data_model import Document
+from utils.profiling import add_profiling_args, profiling
+from utils.sharding import Shard, add_shard_args
 
-    # remove spaces before and after span
-    s = re.sub(r"> ", r">", s)
-    s = re.sub(r" <", r"<", s)
-
-    return s
+DATA_PATH = "data/processed/"
 
 
 def create_hit(sentences: List[str], template: Dict[str, Any], hit_id: int) -> str:
@@ -42,45 +33,37 @@ def create_hit(sentences: List[str], template: Dict[str, Any], hit_id: int) -> s
     )
 
 
-def create_csv(split: str, output_csv: str) -> None:
+def doc_to_hits(doc: Document) -> List[Dict[str, Any]]:
+    sentences = [
+        {"text": html.escape(doc.text[start:end])}
+        for (start, end) in doc.sentences
+    ]
+    # one template per HIT. Is this what we want to do?
+    return [
+        {"sentences": sentences, "template": escape_template(template, doc.doc_id)}
+        for template in doc.templates
+    ]
+
+
+def create_csv(
+    split: str,
+    output_csv: str,
+    max_hits_per_batch: Optional[int] = None,
+    max_bytes_per_batch: Optional[int] = None,
+    num_workers: int = 1,
+    shard: Optional[Shard] = None,
+) -> Dict[str, Any]:
     split_path = os.path.join(DATA_PATH, split, split + ".json")
-    with open(split_path) as f:
-        data = json.load(f)
-    rows = []
-    hit_id = 0
-    for doc, doc_data in data.items():
-        sentences = [
-            {"text": html.escape(doc_data["text"][start:end])}
-            for (start, end) in doc_data["sentences"]
-        ]
-        # one template per HIT. Is this what we want to do?
-        for template in doc_data["templates"]:
-            for slot, slot_data in template.items():
-                if not isinstance(slot_data, list):
-                    continue
-                for filler_data in slot_data:
-                    if "strings" in filler_data:
-                        filler_data["strings"] = [
-                            html.escape(s) for s in filler_data["strings"]
-                        ]
-                    if "strings_lhs" in filler_data:
-                        try:
-                            filler_data["strings_lhs"] = [
-                                html.escape(s) for s in filler_data["strings_lhs"]
-                            ]
-                        except AttributeError:
-                            print(
-                                f"WARNING: Invalid LHS value '{filler_data['strings_lhs']}' for slot {slot} in document {doc}. Could not properly HTML escape this value. Continuing."
-                            )
-                    if "strings_rhs" in filler_data:
-                        filler_data["strings_rhs"] = [
-                            html.escape(s) for s in filler_data["strings_rhs"]
-                        ]
-            rows.append(create_hit(sentences, template, hit_id))
-            hit_id += 1
-    with open(output_csv, "w") as f:
-        f.write("var_arrays\n")
-        f.writelines(rows)
+    return write_hit_batches(
+        split_path,
+        output_csv,
+        doc_to_hits,
+        create_hit,
+        max_hits_per_batch,
+        max_bytes_per_batch,
+        num_workers,
+        shard,
+    )
 
 
 if __name__ == "__main__":
@@ -92,5 +75,16 @@ if __name__ == "__main__":
         required=True,
         help="The name of the CSV file to output",
     )
+    add_batching_args(parser)
+    add_shard_args(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
-    create_csv(args.split, args.output_csv)
+    with profiling(args):
+        create_csv(
+            args.split,
+            args.output_csv,
+            args.max_hits_per_batch,
+            args.max_bytes_per_batch,
+            args.num_workers,
+            args.shard,
+        )
@@ -1,39 +1,33 @@
 import argparse
 import json
 import html
+import numpy as np
 import os
-import re
-import spacy
+import sys
 import tokenizations
 
 from typing import *
 
-DATA_PATH = "data/processed/"
-
-nlp = spacy.load("en_core_web_sm")
-
-
-def replace_string(s):
-    """
-    Make some changes to the input string to make it Turk readable
-    """
-
-    # replace all single quotes by double quotes : except at the start/end of the list
-    # s = re.sub(r'([^\]])\"', r'\1""', s)
-    s = re.sub(r"(?<!\}\])\"", r'""', s)
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts"),
+)
+from mturk.hit_batches import (
+    add_batching_args,
+    escape_template,
+    replace_string,
+    write_hit_batches,
+)
+from utils.data_model import Document
+from utils.nlp_service import tokenize
+from utils.profiling import PROFILER, add_profiling_args, profiling
+from utils.sharding import Shard, add_shard_args
+from utils.spans import SpanIndex
 
-    # replace single quotes
-    s = re.sub(r"\'\{", r"{", s)
-    s = re.sub(r"\}\'", r"}", s)
-
-    # replace two backslashes with three
-    s = re.sub(r"\\\\", r"\\\\\\", s)
-
-    # remove spaces before and after span
-    s = re.sub(r"> ", r">", s)
-    s = re.sub(r" <", r"<", s)
-
-    return s
+DATA_PATH = "data/processed/"
+# see utils/nlp_service.py; loaded on first use (in each worker process,
+# unless the service is running) rather than at import time
+TOKENIZER_PIPELINE = "en_core_web_sm"
 
 
 def create_hit(
@@ -62,70 +56,69 @@ def create_hit(
     )
 
 
-def create_csv(split: str, output_csv: str) -> None:
-    split_path = os.path.join(DATA_PATH, split, split + ".json")
-    with open(split_path) as f:
-        data = json.load(f)
-    rows = []
-    hit_id = 0
-    for doc, doc_data in data.items():
-        lowercase_text = doc_data["text"].lower()
-        toks = [t.text for t in nlp(lowercase_text)]
+def doc_to_hits(doc: Document) -> List[Dict[str, Any]]:
+    lowercase_text = doc.text.lower()
+    with PROFILER.section("tokenization"):
+        token_spans = tokenize([lowercase_text], TOKENIZER_PIPELINE)[0]
+        toks = [lowercase_text[start:end] for start, end in token_spans]
+    with PROFILER.section("alignment"):
         tok2char, char2tok = tokenizations.get_alignments(toks, lowercase_text)
-        sentences = []
-        tok_offset = 0
-        for start, end in doc_data["sentences"]:
-            first_tok, last_tok = char2tok[start][0], char2tok[end - 1][0]  # inclusive
-            sentences.append(
-                {
-                    "text": " ".join(
-                        [
-                            html.escape(f"[{tok_offset + i}] {t}")
-                            for (i, t) in enumerate(toks[first_tok : last_tok + 1])
-                        ]
-                    )
-                }
-            )
-            tok_offset = last_tok + 1
-
-        # one template per HIT. Is this what we want to do?
-        for template in doc_data["templates"]:
-            for slot, slot_data in template.items():
-                if not isinstance(slot_data, list):
-                    continue
-                for filler_data in slot_data:
-                    if "strings" in filler_data:
-                        filler_data["strings"] = [
-                            html.escape(s.lower()) for s in filler_data["strings"]
-                        ]
-                    if "strings_lhs" in filler_data:
-                        try:
-                            filler_data["strings_lhs"] = [
-                                html.escape(s.lower())
-                                for s in filler_data["strings_lhs"]
-                            ]
-                        except AttributeError:
-                            print(
-                                f"WARNING: Invalid LHS value '{filler_data['strings_lhs']}' for slot {slot} in document {doc}. Could not properly HTML escape this value. Continuing."
-                            )
-                    if "strings_rhs" in filler_data:
-                        filler_data["strings_rhs"] = [
-                            html.escape(s.lower()) for s in filler_data["strings_rhs"]
-                        ]
-            rows.append(
-                create_hit(
-                    sentences,
-                    [html.escape(t) for t in toks],
-                    template,
-                    hit_id,
-                    tok2char,
-                    char2tok,
+        # the tokens containing the first and last character of each sentence
+        token_index = SpanIndex(token_spans)
+        sentence_spans = np.array(doc.sentences, dtype=np.int64).reshape(-1, 2)
+        first_toks = token_index.find(sentence_spans[:, 0])
+        last_toks = token_index.find(sentence_spans[:, 1] - 1)
+    if np.any(first_toks < 0) or np.any(last_toks < 0):
+        raise ValueError(f"Sentence bounds of {doc.doc_id} fall outside tokens")
+    sentences = []
+    tok_offset = 0
+    # first_tok and last_tok are inclusive
+    for first_tok, last_tok in zip(first_toks.tolist(), last_toks.tolist()):
+        sentences.append(
+            {
+                "text": " ".join(
+                    [
+                        html.escape(f"[{tok_offset + i}] {t}")
+                        for (i, t) in enumerate(toks[first_tok : last_tok + 1])
+                    ]
                 )
-            )
-            hit_id += 1
-    with open(output_csv, "w") as f:
-        f.write("var_arrays\n")
-        f.writelines(rows)
+            }
+        )
+        tok_offset = last_tok + 1
+
+    escaped_toks = [html.escape(t) for t in toks]
+    # one template per HIT. Is this what we want to do?
+    return [
+        {
+            "sentences": sentences,
+            "tokens": escaped_toks,
+            "template": escape_template(template, doc.doc_id, str.lower),
+            "tok2char": tok2char,
+            "char2tok": char2tok,
+        }
+        for template in doc.templates
+    ]
+
+
+def create_csv(
+    split: str,
+    output_csv: str,
+    max_hits_per_batch: Optional[int] = None,
+    max_bytes_per_batch: Optional[int] = None,
+    num_workers: int = 1,
+    shard: Optional[Shard] = None,
+) -> Dict[str, Any]:
+    split_path = os.path.join(DATA_PATH, split, split + ".json")
+    return write_hit_batches(
+        split_path,
+        output_csv,
+        doc_to_hits,
+        create_hit,
+        max_hits_per_batch,
+        max_bytes_per_batch,
+        num_workers,
+        shard,
+    )
 
 
 if __name__ == "__main__":
@@ -137,5 +130,16 @@ if __name__ == "__main__":
         required=True,
         help="The name of the CSV file to output",
     )
+    add_batching_args(parser)
+    add_shard_args(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
-    create_csv(args.split, args.output_csv)
+    with profiling(args):
+        create_csv(
+            args.split,
+            args.output_csv,
+            args.max_hits_per_batch,
+            args.max_bytes_per_batch,
+            args.num_workers,
+            args.shard,
+        )
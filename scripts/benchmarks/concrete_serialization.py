@@ -0,0 +1,226 @@
+"""
+Compares the ways of storing Concrete archives (see
+scripts/utils/concrete_io.py) on the archives in data/concrete and
+predictions/*/concrete. Every input archive is read once, then rewritten
+with each combination of Thrift protocol and container format or
+compression, and read back. For each configuration, the total archive
+size and the write and read-back throughput (best of --repeats runs) are
+reported relative to the archives as they are stored now. Run from the
+project root:
+
+    python scripts/benchmarks/concrete_serialization.py
+    python scripts/benchmarks/concrete_serialization.py --protocols compact --repeats 5
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.concrete_io import (
+    PROTOCOL_FACTORIES,
+    ArchiveOptions,
+    CommunicationArchiveWriter,
+    archive_path,
+    read_communications,
+    serialize_communication,
+)
+
+ARCHIVE_PATTERNS = [
+    "data/concrete/*/*.zip",
+    "predictions/*/concrete/**/*.zip",
+]
+# (name, format, compression, level) of each container configuration
+CONTAINERS = [
+    ("zip-stored", "zip", "stored", None),
+    ("zip-deflated-1", "zip", "deflated", 1),
+    ("zip-deflated-6", "zip", "deflated", 6),
+    ("zip-deflated-9", "zip", "deflated", 9),
+    ("zip-bzip2", "zip", "bzip2", 9),
+    ("zip-lzma", "zip", "lzma", None),
+    ("tar.gz-1", "tar.gz", "stored", 1),
+    ("tar.gz-9", "tar.gz", "stored", 9),
+    ("dir", "dir", "stored", None),
+]
+
+
+def find_archives(patterns: List[str] = ARCHIVE_PATTERNS) -> List[str]:
+    return sorted(
+        {p for pattern in patterns for p in glob.glob(pattern, recursive=True)}
+    )
+
+
+def archive_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def read_archive(path: str) -> Tuple[float, int]:
+    """Returns the time to read and deserialize every Communication in `path`"""
+    start = time.perf_counter()
+    num_comms = sum(1 for _ in read_communications(path, add_references=False))
+    return time.perf_counter() - start, num_comms
+
+
+def benchmark_configuration(
+    comms: Dict[str, List[Tuple[str, Any]]],
+    options: ArchiveOptions,
+    output_dir: str,
+    repeats: int,
+) -> Dict[str, float]:
+    """
+    Writes and reads back each archive in `comms` (a list of (file name,
+    Communication) pairs per input archive) with `options`, returning the
+    total size and the best total write and read times
+    """
+    size = 0
+    write_seconds = read_seconds = 0.0
+    for i, members in enumerate(comms.values()):
+        path = archive_path(os.path.join(output_dir, str(i)), options.format)
+        best_write = best_read = float("inf")
+        for _ in range(repeats):
+            _remove(path)
+            start = time.perf_counter()
+            with CommunicationArchiveWriter(path, options) as writer:
+                for name, comm in members:
+                    writer.write(comm, name)
+            best_write = min(best_write, time.perf_counter() - start)
+            seconds, num_read = read_archive(path)
+            best_read = min(best_read, seconds)
+            assert num_read == len(members), f"read back {num_read} of {len(members)}"
+        size += archive_size(path)
+        write_seconds += best_write
+        read_seconds += best_read
+        _remove(path)
+    return {"bytes": size, "write_seconds": write_seconds, "read_seconds": read_seconds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "archives",
+        nargs="*",
+        help=f"archives to benchmark; by default, all of {' and '.join(ARCHIVE_PATTERNS)}",
+    )
+    parser.add_argument(
+        "--protocols",
+        nargs="+",
+        choices=list(PROTOCOL_FACTORIES),
+        default=list(PROTOCOL_FACTORIES),
+        help="Thrift protocols to compare",
+    )
+    parser.add_argument(
+        "--containers",
+        nargs="+",
+        choices=[name for name, *_ in CONTAINERS],
+        default=[name for name, *_ in CONTAINERS],
+        help="archive formats and compression settings to compare",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="number of times each archive is written and read; the best time is reported",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="also write the results to this JSON file",
+    )
+    args = parser.parse_args()
+
+    archives = args.archives or find_archives()
+    if not archives:
+        sys.exit("No Concrete archives found; run from the project root")
+
+    # the archives as they are stored now serve as the baseline
+    comms = {}
+    current = {"config": "current", "bytes": 0, "read_seconds": 0.0}
+    for path in archives:
+        current["bytes"] += archive_size(path)
+        current["read_seconds"] += min(
+            read_archive(path)[0] for _ in range(args.repeats)
+        )
+        comms[path] = [
+            (name, comm)
+            for comm, name in read_communications(path, add_references=False)
+        ]
+    num_docs = sum(len(members) for members in comms.values())
+    # throughput in MB/s is measured in compact protocol bytes, so that
+    # all configurations are compared on the same amount of data
+    num_bytes = sum(
+        len(serialize_communication(comm))
+        for members in comms.values()
+        for _, comm in members
+    )
+    print(
+        f"Benchmarking {len(archives)} archives with {num_docs} documents "
+        f"({num_bytes / 1e6:.1f} MB serialized)"
+    )
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for protocol in args.protocols:
+            for name, format, compression, level in CONTAINERS:
+                if name not in args.containers:
+                    continue
+                options = ArchiveOptions(format, protocol, compression, level)
+                result = {"config": f"{protocol}/{name}", "options": options._asdict()}
+                result.update(
+                    benchmark_configuration(comms, options, output_dir, args.repeats)
+                )
+                results.append(result)
+
+    print(
+        f"{'config':<24} {'MB':>8} {'ratio':>6} {'write docs/s':>13} {'MB/s':>7} "
+        f"{'read docs/s':>12} {'MB/s':>7}"
+    )
+    for result in [current] + results:
+        result["ratio"] = result["bytes"] / current["bytes"]
+        for op in ["write", "read"]:
+            seconds = result.get(f"{op}_seconds")
+            if seconds is not None:
+                result[f"{op}_docs_per_sec"] = num_docs / seconds
+                result[f"{op}_mb_per_sec"] = num_bytes / seconds / 1e6
+        write = (
+            f"{result['write_docs_per_sec']:13.1f} {result['write_mb_per_sec']:7.1f}"
+            if "write_seconds" in result
+            else f"{'-':>13} {'-':>7}"
+        )
+        print(
+            f"{result['config']:<24} {result['bytes'] / 1e6:8.2f} {result['ratio']:6.2f} "
+            f"{write} {result['read_docs_per_sec']:12.1f} {result['read_mb_per_sec']:7.1f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "archives": archives,
+                    "num_docs": num_docs,
+                    "num_bytes": num_bytes,
+                    "results": [current] + results,
+                },
+                f,
+                indent=2,
+            )
@@ -0,0 +1,431 @@
+"""
+Benchmarks each pipeline stage (proc_texts, proc_keys, preprocess,
+to_concrete, annotate_concrete) on the bundled data and on scaled-up
+corpora, recording wall time, documents per second and peak RSS.
+Scaled corpora are either synthetic (see synthetic_corpus.py) or copies of
+the bundled raw data with fresh document IDs.
+
+Every measurement runs in a fresh subprocess so that peak RSS is
+attributable to a single stage. Results are written to
+scripts/benchmarks/results/<commit>.json and can be compared against a
+saved baseline to flag regressions. Run from the project root, e.g.:
+
+    python scripts/benchmarks/run_benchmarks.py --scales 10 100
+    python scripts/benchmarks/run_benchmarks.py --scales 10 --replicate
+    python scripts/benchmarks/run_benchmarks.py --save-baseline
+    python scripts/benchmarks/run_benchmarks.py --compare
+
+Stages whose dependencies (e.g. allennlp, cement) are not installed are
+recorded as "unavailable" rather than failing the whole run.
+"""
+import argparse
+import contextlib
+import datetime
+import importlib
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from benchmarks.synthetic_corpus import generate_corpus
+
+DATA_DIR = "data"
+RESULTS_DIR = os.path.join(SCRIPTS_DIR, "benchmarks", "results")
+BASELINE_FILE = os.path.join(RESULTS_DIR, "baseline.json")
+SPLITS = ["train", "dev", "test"]
+STAGES = ["proc_texts", "proc_keys", "preprocess", "to_concrete", "annotate_concrete"]
+RESULT_MARKER = "BENCHMARK_RESULT "
+
+# only the bundled corpus comes with SpanFinder archives and IterX predictions
+SPANFINDER_ARCHIVE = "predictions/spanfinder/concrete/lowercase/{split}.zip"
+ITERX_PREDICTIONS = "predictions/iterx/lowercase/jsonlines/{split}.jsonlines"
+
+DOC_ID_RE = re.compile(r"\b(DEV|TST\d+)-(MUC\d)-(\d+)")
+
+
+def _write_json(output: Any, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2)
+
+
+# Stage runners. Each reads the inputs for one split from `input_root` (laid
+# out like data/), writes its outputs under `output_root`, and returns the
+# number of documents it processed.
+
+
+def run_proc_texts(input_root: str, output_root: str, split: str) -> int:
+    from preprocessing.proc_texts import list_texts, process_texts
+
+    output = process_texts(
+        list_texts(os.path.join(input_root, "raw", "splits", split, "docs"))
+    )
+    _write_json(
+        output, os.path.join(output_root, "semiprocessed", split, f"{split}_docs.json")
+    )
+    return len(output)
+
+
+def run_proc_keys(input_root: str, output_root: str, split: str) -> int:
+    from preprocessing.proc_keys import list_keyfiles, process_keyfiles
+
+    output = process_keyfiles(
+        list_keyfiles(os.path.join(input_root, "raw", "splits", split, "keys"))
+    )
+    _write_json(
+        output, os.path.join(output_root, "semiprocessed", split, f"{split}_keys.json")
+    )
+    return len(output)
+
+
+def run_preprocess(input_root: str, output_root: str, split: str) -> int:
+    from preprocessing.preprocess import preprocess
+
+    output, _, _ = preprocess(split, os.path.join(input_root, "semiprocessed"))
+    _write_json(output, os.path.join(output_root, "processed", split, f"{split}.json"))
+    return len(output)
+
+
+def _count_archive_members(path: str) -> int:
+    # only reads the zip's central directory, which is quick next to the
+    # stage itself
+    with zipfile.ZipFile(path) as archive:
+        return sum(not info.is_dir() for info in archive.infolist())
+
+
+def run_to_concrete(input_root: str, output_root: str, split: str) -> int:
+    from preprocessing.processed_to_concrete import to_concrete
+
+    to_concrete(
+        False,
+        [split],
+        os.path.join(input_root, "processed"),
+        os.path.join(output_root, "concrete"),
+    )
+    return _count_archive_members(
+        os.path.join(output_root, "concrete", "uppercase", f"{split}.zip")
+    )
+
+
+def run_annotate_concrete(input_root: str, output_root: str, split: str) -> int:
+    from postprocessing.annotate_concrete_with_iterx_predictions import (
+        annotate_concrete,
+    )
+
+    output_path = os.path.join(output_root, "iterx", f"{split}.zip")
+    annotate_concrete(
+        SPANFINDER_ARCHIVE.format(split=split),
+        output_path,
+        ITERX_PREDICTIONS.format(split=split),
+        "Span Finder",
+    )
+    return _count_archive_members(output_path)
+
+
+STAGE_MODULES = {
+    "proc_texts": "preprocessing.proc_texts",
+    "proc_keys": "preprocessing.proc_keys",
+    "preprocess": "preprocessing.preprocess",
+    "to_concrete": "preprocessing.processed_to_concrete",
+    "annotate_concrete": "postprocessing.annotate_concrete_with_iterx_predictions",
+}
+
+STAGE_RUNNERS = {
+    "proc_texts": run_proc_texts,
+    "proc_keys": run_proc_keys,
+    "preprocess": run_preprocess,
+    "to_concrete": run_to_concrete,
+    "annotate_concrete": run_annotate_concrete,
+}
+
+
+def stage_inputs_exist(stage: str, input_root: str, split: str) -> bool:
+    paths = {
+        "proc_texts": [os.path.join(input_root, "raw", "splits", split, "docs")],
+        "proc_keys": [os.path.join(input_root, "raw", "splits", split, "keys")],
+        "preprocess": [
+            os.path.join(input_root, "semiprocessed", split, f"{split}_docs.json"),
+            os.path.join(input_root, "semiprocessed", split, f"{split}_keys.json"),
+        ],
+        "to_concrete": [os.path.join(input_root, "processed", split, f"{split}.json")],
+        "annotate_concrete": [
+            SPANFINDER_ARCHIVE.format(split=split),
+            ITERX_PREDICTIONS.format(split=split),
+        ],
+    }[stage]
+    return all(os.path.exists(p) for p in paths)
+
+
+def worker(stage: str, input_root: str, output_root: str, split: str) -> None:
+    """Runs a single stage in this process and prints its measurements"""
+    result = {"status": "ok"}
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            # import (and model loading) time is not part of the measurement
+            module = importlib.import_module(STAGE_MODULES[stage])
+            if hasattr(module, "load_resources"):
+                module.load_resources()
+            start = time.perf_counter()
+            num_docs = STAGE_RUNNERS[stage](input_root, output_root, split)
+            result["seconds"] = time.perf_counter() - start
+        result["num_docs"] = num_docs
+        result["docs_per_sec"] = num_docs / result["seconds"]
+    except ImportError as e:
+        result = {"status": "unavailable", "error": str(e)}
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(RESULT_MARKER + json.dumps(result))
+
+
+def run_in_subprocess(
+    stage: str, input_root: str, output_root: str, split: str
+) -> Dict[str, Any]:
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--worker",
+        stage,
+        "--input-root",
+        input_root,
+        "--output-root",
+        output_root,
+        "--split",
+        split,
+    ]
+    proc = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER) :])
+    error = proc.stderr.strip().splitlines()
+    return {"status": "failed", "error": error[-1] if error else ""}
+
+
+def replicate_raw_corpus(output_root: str, factor: int) -> None:
+    """
+    Builds a corpus `factor` times the size of data/raw by concatenating
+    copies of each raw split, giving each copy's documents distinct IDs.
+    """
+    for split in SPLITS:
+        for kind in ["docs", "keys"]:
+            src_dir = os.path.join(DATA_DIR, "raw", "splits", split, kind)
+            dst_dir = os.path.join(output_root, "raw", "splits", split, kind)
+            os.makedirs(dst_dir, exist_ok=True)
+            for name in sorted(os.listdir(src_dir)):
+                with open(os.path.join(src_dir, name)) as f:
+                    text = f.read()
+                for k in range(factor):
+                    with open(os.path.join(dst_dir, f"{name}.r{k}"), "w") as f:
+                        f.write(DOC_ID_RE.sub(rf"\1-\2-{k}\3", text))
+
+
+def prepare_corpus(corpus: str, work_dir: str, seed: int = 0) -> str:
+    """Returns the input root for a corpus, generating it if necessary"""
+    if corpus == "bundled":
+        return DATA_DIR
+    match = re.fullmatch(r"(replicated|synthetic)-x(\d+)", corpus)
+    if not match:
+        raise ValueError(f"Unrecognized corpus {corpus!r}")
+    root = os.path.join(work_dir, corpus)
+    if match.group(1) == "replicated":
+        replicate_raw_corpus(root, int(match.group(2)))
+    else:
+        generate_corpus(root, int(match.group(2)), seed)
+    return root
+
+
+def run_benchmarks(
+    corpora: List[str],
+    stages: List[str],
+    splits: List[str],
+    work_dir: str,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    results = []
+    for corpus in corpora:
+        input_root = prepare_corpus(corpus, work_dir, seed)
+        # generated corpora feed each stage's outputs to the next stage
+        output_root = (
+            os.path.join(work_dir, "bundled-outputs")
+            if input_root == DATA_DIR
+            else input_root
+        )
+        for split in splits:
+            for stage in stages:
+                result = {"corpus": corpus, "split": split, "stage": stage}
+                if stage == "annotate_concrete" and corpus != "bundled":
+                    continue
+                if not stage_inputs_exist(stage, input_root, split):
+                    result["status"] = "missing_inputs"
+                else:
+                    result.update(
+                        run_in_subprocess(stage, input_root, output_root, split)
+                    )
+                print(format_result(result), flush=True)
+                results.append(result)
+    return results
+
+
+def format_result(r: Dict[str, Any]) -> str:
+    name = f"{r['corpus']:<18} {r['split']:<5} {r['stage']:<18}"
+    if r["status"] != "ok":
+        return f"{name} {r['status']}"
+    return (
+        f"{name} {r['seconds']:8.2f}s {r['docs_per_sec']:9.1f} docs/s "
+        f"{r['peak_rss_mb']:8.1f} MB"
+    )
+
+
+def result_key(r: Dict[str, Any]) -> Tuple[str, str, str]:
+    return r["corpus"], r["split"], r["stage"]
+
+
+def find_regressions(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Flags stages that got slower or used more memory than the baseline allows"""
+    baseline_by_key = {result_key(r): r for r in baseline if r["status"] == "ok"}
+    regressions = []
+    for r in results:
+        b = baseline_by_key.get(result_key(r))
+        if b is None or r["status"] != "ok":
+            continue
+        for metric in ["seconds", "peak_rss_mb"]:
+            if r[metric] > b[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{' '.join(result_key(r))}: {metric} {b[metric]:.2f} -> {r[metric]:.2f} "
+                    f"({100 * (r[metric] / b[metric] - 1):+.0f}%)"
+                )
+    return regressions
+
+
+def current_commit() -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    dirty = subprocess.run(
+        ["git", "status", "--porcelain", "--untracked-files=no"],
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout.strip()
+    return commit + ("-dirty" if dirty else "")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES, help="stages to run"
+    )
+    parser.add_argument(
+        "--splits", nargs="+", choices=SPLITS, default=SPLITS, help="splits to run"
+    )
+    parser.add_argument(
+        "--scales",
+        nargs="*",
+        type=int,
+        default=[],
+        help="also benchmark corpora this many times the size of the bundled data",
+    )
+    parser.add_argument(
+        "--replicate",
+        action="store_true",
+        help="build scaled corpora by copying the bundled raw data instead of generating synthetic data",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="random seed for synthetic corpora"
+    )
+    parser.add_argument(
+        "--no-bundled",
+        action="store_true",
+        help="skip benchmarking on the bundled data",
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=str,
+        default=None,
+        help="where generated corpora and stage outputs are written (default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help=f"also save the results as the baseline ({BASELINE_FILE})",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="compare the results against the saved baseline and exit with status 1 on regressions",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative increase in wall time or peak RSS over the baseline that counts as a regression",
+    )
+    # used internally to run a single measurement in a subprocess
+    parser.add_argument("--worker", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--input-root", help=argparse.SUPPRESS)
+    parser.add_argument("--output-root", help=argparse.SUPPRESS)
+    parser.add_argument("--split", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.input_root, args.output_root, args.split)
+        sys.exit(0)
+
+    scaled_kind = "replicated" if args.replicate else "synthetic"
+    corpora = ([] if args.no_bundled else ["bundled"]) + [
+        f"{scaled_kind}-x{n}" for n in args.scales
+    ]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="mucd-bench-")
+    try:
+        results = run_benchmarks(
+            corpora, args.stages, args.splits, work_dir, args.seed
+        )
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    commit = current_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    results_file = os.path.join(RESULTS_DIR, f"{commit}.json")
+    _write_json(report, results_file)
+    print(f"Wrote results to {results_file}")
+    if args.save_baseline:
+        _write_json(report, BASELINE_FILE)
+        print(f"Saved baseline to {BASELINE_FILE}")
+
+    if args.compare:
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline["results"], args.tolerance)
+        print(f"Compared against baseline from commit {baseline['commit']}:")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if not regressions:
+            print("No regressions.")
+        sys.exit(1 if regressions else 0)
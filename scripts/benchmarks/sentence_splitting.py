@@ -0,0 +1,133 @@
+"""
+Compares the sentence splitter backends (see
+scripts/preprocessing/sentence_splitters.py) on the processed data.
+Each backend splits every section of every document in data/processed,
+and its sentence boundaries are scored against the sentences stored
+there (which were produced by the spacy backend). Reports throughput,
+boundary precision/recall/F1 and the fraction of reference sentences
+reproduced exactly. Run from the project root:
+
+    python scripts/benchmarks/sentence_splitting.py --splits dev test
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from preprocessing.sentence_splitters import (
+    SENTENCE_SPLITTERS,
+    get_sentence_splitter,
+)
+from utils.columnar import PROCESSED_DATA_ROOT, load_split
+
+SPLITS = ["train", "dev", "test"]
+
+
+def split_document(splitter, doc: Dict[str, Any]) -> List[Tuple[int, int]]:
+    spans = []
+    for section_start, section_end in doc["sections"]:
+        section_text = doc["text"][section_start:section_end]
+        spans.extend(
+            (section_start + start, section_start + end)
+            for start, end in splitter.split(section_text)
+        )
+    return spans
+
+
+def evaluate_backend(name: str, docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    try:
+        start = time.perf_counter()
+        splitter = get_sentence_splitter(name)
+        load_seconds = time.perf_counter() - start
+    except (ImportError, OSError) as e:
+        # e.g. spaCy or the en_core_web_sm model is not installed
+        return {"backend": name, "status": "unavailable", "error": str(e)}
+
+    start = time.perf_counter()
+    predictions = [split_document(splitter, doc) for doc in docs]
+    seconds = time.perf_counter() - start
+
+    num_correct = num_predicted = num_reference = 0
+    exact = 0
+    for doc, predicted in zip(docs, predictions):
+        reference = [tuple(s) for s in doc["sentences"]]
+        # a boundary is the end of a sentence that is not the end of a section
+        section_ends = {end for _, end in doc["sections"]}
+        predicted_ends = {end for _, end in predicted} - section_ends
+        reference_ends = {end for _, end in reference} - section_ends
+        num_correct += len(predicted_ends & reference_ends)
+        num_predicted += len(predicted_ends)
+        num_reference += len(reference_ends)
+        exact += len(set(predicted) & set(reference))
+    precision = num_correct / num_predicted if num_predicted else 0.0
+    recall = num_correct / num_reference if num_reference else 0.0
+    num_chars = sum(len(doc["text"]) for doc in docs)
+    return {
+        "backend": name,
+        "status": "ok",
+        "load_seconds": load_seconds,
+        "seconds": seconds,
+        "docs_per_sec": len(docs) / seconds,
+        "chars_per_sec": num_chars / seconds,
+        "boundary_precision": precision,
+        "boundary_recall": recall,
+        "boundary_f1": (
+            2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        ),
+        "exact_sentence_match": exact / sum(len(doc["sentences"]) for doc in docs),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=list(SENTENCE_SPLITTERS),
+        default=list(SENTENCE_SPLITTERS),
+        help="sentence splitters to compare",
+    )
+    parser.add_argument(
+        "--splits", nargs="+", choices=SPLITS, default=SPLITS, help="splits to use"
+    )
+    parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed splits",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="also write the results to this JSON file",
+    )
+    args = parser.parse_args()
+
+    docs = []
+    for split in args.splits:
+        try:
+            docs.extend(load_split(split, args.data_root).values())
+        except FileNotFoundError:
+            print(f"WARNING: no processed data found for split {split}; skipping")
+    print(f"Splitting {len(docs)} documents")
+
+    results = [evaluate_backend(name, docs) for name in args.backends]
+    for r in results:
+        if r["status"] != "ok":
+            print(f"{r['backend']:<12} {r['status']}: {r['error']}")
+            continue
+        print(
+            f"{r['backend']:<12} {r['docs_per_sec']:9.1f} docs/s {r['chars_per_sec'] / 1e6:7.2f} Mchars/s  "
+            f"boundary P/R/F1 {r['boundary_precision']:.3f}/{r['boundary_recall']:.3f}/{r['boundary_f1']:.3f}  "
+            f"exact sentences {r['exact_sentence_match']:.3f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
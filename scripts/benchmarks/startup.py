@@ -0,0 +1,172 @@
+"""
+Measures the startup cost of each pipeline entry point by running
+`python -X importtime <script> --help` in a fresh interpreter. For every
+script, the wall time (best of --repeat runs, with the time of a bare
+interpreter subtracted), the total import time, and the heaviest
+top-level imports are reported. Scripts that do not need an NLP model
+(everything except the spaCy/allennlp based stages) are checked against
+a startup budget. Run from the project root:
+
+    python scripts/benchmarks/startup.py
+    python scripts/benchmarks/startup.py --budget-ms 200 --repeat 5
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from benchmarks.run_benchmarks import RESULTS_DIR, _write_json, current_commit
+
+# (script, whether it loads an NLP model when run)
+ENTRY_POINTS = [
+    ("scripts/preprocessing/proc_texts.py", False),
+    ("scripts/preprocessing/proc_keys.py", False),
+    ("scripts/preprocessing/preprocess.py", True),
+    ("scripts/preprocessing/processed_to_concrete.py", True),
+    ("scripts/preprocessing/resolve_locations.py", False),
+    ("scripts/preprocessing/suggest_fixes.py", False),
+    ("scripts/preprocessing/entity_sharing.py", False),
+    ("scripts/preprocessing/mention_overlaps.py", False),
+    ("scripts/postprocessing/annotate_concrete_with_iterx_predictions.py", False),
+    ("scripts/visualize_annotations.py", False),
+    ("scripts/pipeline/run.py", False),
+    ("scripts/pipeline/stream.py", False),
+    ("scripts/pipeline/merge_shards.py", False),
+    ("scripts/benchmarks/concrete_serialization.py", False),
+    ("scripts/utils/columnar.py", False),
+    ("scripts/utils/corpus.py", False),
+    ("scripts/utils/corpus_statistics.py", False),
+    ("scripts/utils/data_model.py", False),
+    ("scripts/utils/gazetteer.py", False),
+    ("scripts/utils/nlp_service.py", False),
+    ("annotation/evidental/data_to_mturk_csv.py", False),
+    ("annotation/template_anchors/data_to_mturk_csv.py", True),
+]
+
+# e.g. "import time:       512 |       1024 |   json"
+IMPORT_TIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(
+    stderr: str, exclude: Container[str] = ()
+) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Returns the total import time in milliseconds and the cumulative time
+    of each top-level import, heaviest first. Modules in `exclude` (those
+    imported by a bare interpreter, e.g. site) are left out.
+    """
+    top_level = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        # nested imports are indented by two spaces per level
+        if match and len(match.group(3)) == 1 and match.group(4) not in exclude:
+            top_level.append((match.group(4), int(match.group(2)) / 1000))
+    total = sum(ms for _, ms in top_level)
+    return total, sorted(top_level, key=lambda x: -x[1])
+
+
+def time_command(
+    cmd: List[str], repeat: int
+) -> Tuple[float, subprocess.CompletedProcess]:
+    best, proc = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best, proc
+
+
+def measure_startup(
+    script: str,
+    interpreter_ms: float,
+    interpreter_imports: Container[str],
+    repeat: int,
+    top: int,
+) -> Dict[str, Any]:
+    wall_ms, proc = time_command(
+        [sys.executable, "-X", "importtime", script, "--help"], repeat
+    )
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ""
+        status = "unavailable" if "ModuleNotFoundError" in error else "failed"
+        return {"script": script, "status": status, "error": error}
+    import_ms, imports = parse_importtime(proc.stderr, interpreter_imports)
+    return {
+        "script": script,
+        "status": "ok",
+        "wall_ms": wall_ms,
+        "startup_ms": max(wall_ms - interpreter_ms, 0.0),
+        "import_ms": import_ms,
+        "heaviest_imports": imports[:top],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=200.0,
+        help="startup budget (beyond bare interpreter startup) for scripts that do not load an NLP model",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per script; the fastest is kept"
+    )
+    parser.add_argument(
+        "--top", type=int, default=3, help="number of heaviest imports to report"
+    )
+    args = parser.parse_args()
+
+    interpreter_ms, proc = time_command(
+        [sys.executable, "-X", "importtime", "-c", "pass"], args.repeat
+    )
+    interpreter_imports = {name for name, _ in parse_importtime(proc.stderr)[1]}
+    print(f"bare interpreter: {interpreter_ms:.0f} ms")
+    results = []
+    over_budget = []
+    for script, loads_model in ENTRY_POINTS:
+        r = measure_startup(
+            script, interpreter_ms, interpreter_imports, args.repeat, args.top
+        )
+        r["loads_model"] = loads_model
+        results.append(r)
+        if r["status"] != "ok":
+            print(f"{script:<68} {r['status']}: {r['error']}")
+            continue
+        heaviest = ", ".join(f"{name} {ms:.0f}" for name, ms in r["heaviest_imports"])
+        print(
+            f"{script:<68} {r['startup_ms']:6.0f} ms  (imports {r['import_ms']:.0f} ms: {heaviest})"
+        )
+        if not loads_model and r["startup_ms"] > args.budget_ms:
+            over_budget.append(script)
+
+    commit = current_commit()
+    results_file = os.path.join(RESULTS_DIR, f"startup-{commit}.json")
+    _write_json(
+        {
+            "commit": commit,
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "interpreter_ms": interpreter_ms,
+            "budget_ms": args.budget_ms,
+            "results": results,
+        },
+        results_file,
+    )
+    print(f"Wrote results to {results_file}")
+    for script in over_budget:
+        print(f"OVER BUDGET {script}")
+    sys.exit(1 if over_budget else 0)
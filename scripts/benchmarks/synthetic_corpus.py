@@ -0,0 +1,454 @@
+"""
+Generates synthetic MUC-style corpora of arbitrary size in the raw formats
+consumed by proc_texts.py and proc_keys.py, for measuring how the pipeline
+scales beyond the bundled MUC-3/MUC-4 data.
+
+The output mirrors data/raw/splits/{train,dev,test}/{docs,keys}. Documents
+have DEV-/TST- headers, datelines, bracketed tags and wrapped uppercase
+paragraphs; key files use the 33-column layout with continuation lines,
+comments, optional templates and fillers, quoted alternations, colon
+clauses, "-" nulls, multi-part locations and the set-fill values from
+proc_keys.SET_FILL_KEYS_ALLOWED_VALUES. Every entity filler is mentioned
+in its document's text, so preprocess can locate it; as in the real data,
+country-level locations sometimes are not.
+
+Output is fully determined by --seed and --scale, e.g.
+
+    python scripts/benchmarks/synthetic_corpus.py /tmp/muc-x10 --scale 10
+"""
+import argparse
+import os
+import random
+import sys
+import textwrap
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from preprocessing.proc_keys import ALL_KEYS, SET_FILL_KEYS_ALLOWED_VALUES, cleankey
+
+# number of documents in each bundled split (i.e. at --scale 1)
+SPLIT_SIZES = {"train": 1300, "dev": 200, "test": 200}
+# (document ID prefix, key file name, doc file name) for each split, as in data/raw
+SPLIT_SERIES = {
+    "train": [("DEV-MUC3", "key-dev-{n:04d}.muc4", "dev-muc3-{n:04d}")],
+    "dev": [
+        ("TST1-MUC3", "key-tst1-{n:04d}.v7", "tst1-muc3-{n:04d}"),
+        ("TST2-MUC4", "key-tst2-{n:04d}.v4", "tst2-muc4-{n:04d}"),
+    ],
+    "test": [
+        ("TST3-MUC4", "key-tst3-{n:04d}.v2", "tst3-muc4-{n:04d}"),
+        ("TST4-MUC4", "key-tst4-{n:04d}.v2", "tst4-muc4-{n:04d}"),
+    ],
+}
+DOCS_PER_FILE = 100
+
+KEY_LABELS = """
+MESSAGE: ID
+MESSAGE: TEMPLATE
+INCIDENT: DATE
+INCIDENT: LOCATION
+INCIDENT: TYPE
+INCIDENT: STAGE OF EXECUTION
+INCIDENT: INSTRUMENT ID
+INCIDENT: INSTRUMENT TYPE
+PERP: INCIDENT CATEGORY
+PERP: INDIVIDUAL ID
+PERP: ORGANIZATION ID
+PERP: ORGANIZATION CONFIDENCE
+PHYS TGT: ID
+PHYS TGT: TYPE
+PHYS TGT: NUMBER
+PHYS TGT: FOREIGN NATION
+PHYS TGT: EFFECT OF INCIDENT
+PHYS TGT: TOTAL NUMBER
+HUM TGT: NAME
+HUM TGT: DESCRIPTION
+HUM TGT: TYPE
+HUM TGT: NUMBER
+HUM TGT: FOREIGN NATION
+HUM TGT: EFFECT OF INCIDENT
+HUM TGT: TOTAL NUMBER
+""".strip().split("\n")
+assert [cleankey(k) for k in KEY_LABELS if cleankey(k) not in ALL_KEYS] == []
+
+KEY_COLUMN = 36
+
+INCIDENT_TYPES = [
+    "ATTACK",
+    "BOMBING",
+    "KIDNAPPING",
+    "ARSON",
+    "ROBBERY",
+    "FORCED WORK STOPPAGE",
+]
+MONTHS = "JAN FEB MAR APR MAY JUN JUL AUG SEP OCT NOV DEC".split()
+SOURCES = ["NOSC", "NCCOSC", "ACAN-EFE", "AFP", "EFE", "DPA"]
+TAGS = ["REPORT", "TEXT", "COMMUNIQUE", "EDITORIAL", "INTERVIEW"]
+
+LOCATIONS = {
+    "EL SALVADOR": [
+        ("SAN SALVADOR", "CITY"),
+        ("SAN MIGUEL", "DEPARTMENT"),
+        ("USULUTAN", "DEPARTMENT"),
+        ("APOPA", "CITY"),
+        ("SAN LUIS DE LA REINA", "TOWN"),
+    ],
+    "COLOMBIA": [
+        ("MEDELLIN", "CITY"),
+        ("ANTIOQUIA", "DEPARTMENT"),
+        ("BOGOTA", "CITY"),
+        ("ENVIGADO", "MUNICIPALITY"),
+        ("BARRANCABERMEJA", "CITY"),
+    ],
+    "PERU": [
+        ("LIMA", "CITY"),
+        ("AYACUCHO", "DEPARTMENT"),
+        ("JULCAMARCA", "PROVINCE"),
+        ("PIURA", "DEPARTMENT"),
+    ],
+    "GUATEMALA": [
+        ("GUATEMALA CITY", "CITY"),
+        ("HUEHUETENANGO", "DEPARTMENT"),
+        ("LA EMINENCIA", "FARM"),
+    ],
+}
+ORGANIZATIONS = [
+    ("FARABUNDO MARTI NATIONAL LIBERATION FRONT", "FMLN"),
+    ("ARMY OF NATIONAL LIBERATION", "ELN"),
+    ("SHINING PATH", "SL"),
+    ("TUPAC AMARU REVOLUTIONARY MOVEMENT", "MRTA"),
+    ("GUATEMALAN NATIONAL REVOLUTIONARY UNITY", "URNG"),
+    ("MEDELLIN CARTEL", None),
+    ("THE EXTRADITABLES", None),
+]
+PERP_INDIVIDUALS = [
+    "TERRORISTS",
+    "GUERRILLAS",
+    "URBAN COMMANDOS",
+    "GUNMEN",
+    "ARMED MEN",
+    "SUBVERSIVES",
+    "DEATH SQUAD",
+]
+PHYS_TARGETS = [
+    ("POWER SUBSTATION", "ENERGY"),
+    ("LAS CANAS BRIDGE", "TRANSPORTATION ROUTE"),
+    ("U.S. EMBASSY", "DIPLOMAT OFFICE OR RESIDENCE"),
+    ("CAR DEALERSHIP", "COMMERCIAL"),
+    ("BUS", "TRANSPORT VEHICLE"),
+    ("MAYOR'S OFFICE", "GOVERNMENT OFFICE OR RESIDENCE"),
+    ('"SANTO TOMAS" PRESIDENTIAL FARM', "GOVERNMENT OFFICE OR RESIDENCE"),
+]
+HUM_DESCRIPTIONS = [
+    ("PEASANTS", "CIVILIAN"),
+    ("JUDGE", "LEGAL OR JUDICIAL"),
+    ("SOLDIERS", "ACTIVE MILITARY"),
+    ("MAYOR", "GOVERNMENT OFFICIAL"),
+    ("JOURNALIST", "CIVILIAN"),
+    ("POLICEMEN", "LAW ENFORCEMENT"),
+]
+FIRST_NAMES = ["LUIS", "MARIA", "PEDRO", "ANTONIO", "CARLOS", "ROSA", "JORGE"]
+LAST_NAMES = ["OSORIO", "PARDO", "LOPEZ", "CEREZO", "GALAN", "ISAACS", "RAMIREZ"]
+WEAPONS = [
+    ("BOMB", "BOMB"),
+    ("DYNAMITE", "DYNAMITE"),
+    ("MACHINEGUNS", "MACHINE GUN"),
+    ("CAR BOMB", "VEHICLE BOMB"),
+    ("M-16 RIFLE", "RIFLE"),
+    ("MORTAR", "MORTAR"),
+]
+FOREIGN_NATIONS = ["UNITED STATES", "SPAIN", "WEST GERMANY", "JAPAN"]
+FILLER_SENTENCES = [
+    "THE ARMED FORCES PRESS COMMITTEE REPORTED THAT SECURITY MEASURES HAVE BEEN STEPPED UP THROUGHOUT THE REGION.",
+    "AUTHORITIES HAVE NOT RULED OUT THE POSSIBILITY OF FURTHER ATTACKS IN THE COMING DAYS.",
+    "THE GOVERNMENT ISSUED A COMMUNIQUE DESCRIBING THE REPORT AS FALSE AND INCORRECT.",
+    "MEANWHILE, MILITARY UNITS CONTINUE TO COMB THE AREA.",
+    "NO FURTHER DETAILS WERE AVAILABLE AT PRESS TIME.",
+    "THE PRESIDENT MET WITH THE DIPLOMATIC CORPS TO DISCUSS THE SITUATION.",
+]
+
+
+class SyntheticIncident:
+    """The entities of one incident, from which both text and key are derived"""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.type = rng.choice(INCIDENT_TYPES)
+        self.country = rng.choice(sorted(LOCATIONS))
+        self.places = rng.sample(LOCATIONS[self.country], rng.randint(1, 2))
+        self.date = (rng.randint(1, 28), rng.choice(MONTHS), rng.choice([88, 89, 90]))
+        self.org = rng.choice(ORGANIZATIONS) if rng.random() < 0.7 else None
+        self.perps = rng.sample(PERP_INDIVIDUALS, rng.randint(0, 2))
+        self.phys_targets = rng.sample(PHYS_TARGETS, rng.randint(0, 2))
+        self.victims = [
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            for _ in range(rng.randint(0, 2))
+        ]
+        self.hum_descriptions = rng.sample(HUM_DESCRIPTIONS, rng.randint(0, 2))
+        self.weapons = rng.sample(WEAPONS, rng.randint(0, 2))
+        self.optional = rng.random() < 0.1
+
+    def sentences(self) -> List[str]:
+        rng = self.rng
+        place = self.places[-1][0]
+        perp = self.perps[0] if self.perps else "UNIDENTIFIED INDIVIDUALS"
+        out = []
+        if self.org is not None:
+            name, acronym = self.org
+            org = f"{name} [{acronym}]" if acronym else name
+            out.append(f"{perp} OF THE {org} WERE BEHIND THE {self.type} IN {place}.")
+        else:
+            out.append(f"{perp} WERE BEHIND THE {self.type} IN {place}.")
+        for other in self.perps[1:]:
+            out.append(f"WITNESSES SAID THAT {other} WERE ALSO INVOLVED.")
+        for target, _ in self.phys_targets:
+            out.append(f"THE {target} WAS SEVERELY DAMAGED DURING THE INCIDENT.")
+        for (desc, _), victim in zip(self.hum_descriptions, self.victims):
+            out.append(f"{desc} {victim} WAS AMONG THE VICTIMS.")
+        for desc, _ in self.hum_descriptions[len(self.victims) :]:
+            out.append(f"SEVERAL {desc} WERE HURT.")
+        for victim in self.victims[len(self.hum_descriptions) :]:
+            out.append(f"{victim} WAS TAKEN TO A HOSPITAL IN {self.country}.")
+        for weapon, _ in self.weapons:
+            out.append(f"POLICE SOURCES SAID THAT A {weapon} WAS USED.")
+        if len(self.places) > 1:
+            out.append(
+                f"THE INCIDENT TOOK PLACE NEAR {self.places[0][0]}, {self.country}."
+            )
+        rng.shuffle(out)
+        return out
+
+    def key_values(self) -> Dict[str, List[str]]:
+        """Maps each key label to its (possibly multi-line) value"""
+        rng = self.rng
+        values = {}
+        values["MESSAGE: TEMPLATE"] = []  # filled in by the caller
+        values["INCIDENT: DATE"] = [self._date_value()]
+        values["INCIDENT: LOCATION"] = [self._location_value()]
+        values["INCIDENT: TYPE"] = [self.type]
+        values["INCIDENT: STAGE OF EXECUTION"] = [
+            rng.choice(
+                sorted(SET_FILL_KEYS_ALLOWED_VALUES["incident_stage_of_execution"])
+            )
+        ]
+        values["INCIDENT: INSTRUMENT ID"] = [quote(w) for w, _ in self.weapons] or ["-"]
+        values["INCIDENT: INSTRUMENT TYPE"] = [
+            f"{t}: {quote(w)}" for w, t in self.weapons
+        ] or ["-"]
+        category = rng.choice(
+            sorted(SET_FILL_KEYS_ALLOWED_VALUES["perp_incident_category"])
+        )
+        values["PERP: INCIDENT CATEGORY"] = [category]
+        values["PERP: INDIVIDUAL ID"] = [
+            ("? " if rng.random() < 0.2 else "") + quote(p) for p in self.perps
+        ] or ["-"]
+        if self.org is not None:
+            org_value = " / ".join(quote(s) for s in self.org if s)
+            confidences = sorted(
+                SET_FILL_KEYS_ALLOWED_VALUES["perp_organization_confidence"]
+            )
+            confidence = " / ".join(rng.sample(confidences, rng.randint(1, 2)))
+            values["PERP: ORGANIZATION ID"] = [org_value]
+            values["PERP: ORGANIZATION CONFIDENCE"] = [f"{confidence}: {org_value}"]
+        else:
+            values["PERP: ORGANIZATION ID"] = ["-"]
+            values["PERP: ORGANIZATION CONFIDENCE"] = ["-"]
+        self._target_values(
+            values,
+            "PHYS TGT",
+            [(quote(t), ty) for t, ty in self.phys_targets],
+            "phys_tgt_effect_of_incident",
+        )
+        hum_targets = [
+            (quote(d) + (": " + quote(v) if v else ""), ty)
+            for (d, ty), v in zip(
+                self.hum_descriptions,
+                self.victims + [None] * len(self.hum_descriptions),
+            )
+        ]
+        values["HUM TGT: NAME"] = [quote(v) for v in self.victims] or ["-"]
+        self._target_values(
+            values, "HUM TGT", hum_targets, "hum_tgt_effect_of_incident"
+        )
+        return values
+
+    def _target_values(
+        self,
+        values: Dict[str, List[str]],
+        prefix: str,
+        targets: List[Tuple[str, str]],
+        effect_key: str,
+    ) -> None:
+        rng = self.rng
+        id_label = "ID" if prefix == "PHYS TGT" else "DESCRIPTION"
+        values[f"{prefix}: {id_label}"] = [t for t, _ in targets] or ["-"]
+        # the RHS of a colon clause refers back to the entity by its (quoted) name
+        refs = [t.split(": ")[-1] for t, _ in targets]
+        values[f"{prefix}: TYPE"] = [
+            f"{ty}: {ref}" for (_, ty), ref in zip(targets, refs)
+        ] or ["-"]
+        values[f"{prefix}: NUMBER"] = [
+            f"{rng.choice(['1', 'PLURAL', '-'])}: {ref}" for ref in refs
+        ] or ["-"]
+        values[f"{prefix}: FOREIGN NATION"] = (
+            [f"{rng.choice(FOREIGN_NATIONS)}: {refs[0]}"]
+            if refs and rng.random() < 0.2
+            else ["-"]
+        )
+        effects = sorted(v for v in SET_FILL_KEYS_ALLOWED_VALUES[effect_key] if v)
+        values[f"{prefix}: EFFECT OF INCIDENT"] = [
+            ("? " if rng.random() < 0.1 else "") + f"{rng.choice(effects)}: {ref}"
+            for ref in refs
+        ] or ["-"]
+        # total numbers are often missing their quotes in the original data
+        values[f"{prefix}: TOTAL NUMBER"] = (
+            [str(rng.randint(2, 60))] if len(refs) > 1 else ["-"]
+        )
+
+    def _date_value(self) -> str:
+        day, month, year = self.date
+        date = f"{day:02d} {month} {year}"
+        return self.rng.choice(
+            [date, date, f"- {date}", f"({date}) / (- {date})", f"{date} / - {date}"]
+        )
+
+    def _location_value(self) -> str:
+        parts = [f"{p} ({t})" for p, t in self.places]
+        if len(parts) == 1 or self.rng.random() < 0.5:
+            return f"{self.country}: " + ": ".join(parts)
+        # alternatives, or ranges between places
+        sep = self.rng.choice([" / ", " - "])
+        if sep == " / ":
+            return " / ".join(f"({self.country}: {p})" for p in parts)
+        return f"{self.country}: " + sep.join(parts)
+
+
+def quote(s: str) -> str:
+    return '"' + s.replace('"', '\\"') + '"'
+
+
+def format_template(doc_id: str, values: Dict[str, List[str]]) -> List[str]:
+    lines = []
+    for i, label in enumerate(KEY_LABELS):
+        value_lines = [doc_id] if i == 0 else values.get(label) or ["*"]
+        prefix = f"{i}.".ljust(4) + label
+        lines.append(prefix.ljust(KEY_COLUMN) + value_lines[0])
+        lines.extend(" " * KEY_COLUMN + v for v in value_lines[1:])
+    return lines
+
+
+def generate_document(
+    rng: random.Random, doc_id: str, has_source: bool
+) -> Tuple[str, List[str]]:
+    """Returns the raw text of a document (with header) and its key lines"""
+    incidents = []
+    if rng.random() < 0.6:
+        incidents = [SyntheticIncident(rng) for _ in range(rng.choice([1, 1, 1, 2, 3]))]
+
+    sentences = [s for incident in incidents for s in incident.sentences()]
+    sentences += rng.sample(FILLER_SENTENCES, rng.randint(1, 4))
+    paragraphs = []
+    while sentences:
+        n = rng.randint(1, 3)
+        paragraphs.append(" ".join(sentences[:n]))
+        sentences = sentences[n:]
+
+    country = incidents[0].country if incidents else rng.choice(sorted(LOCATIONS))
+    city = LOCATIONS[country][0][0]
+    day, month, year = rng.randint(1, 28), rng.choice(MONTHS), rng.choice([89, 90])
+    tags = " ".join(f"[{t}]" for t in rng.sample(TAGS, rng.randint(1, 2)))
+    dateline = f"{city}, {day} {month} {year}"
+    if not has_source:
+        dateline += f" ({rng.choice(SOURCES)})"
+    paragraphs[0] = f"{dateline} -- {tags} {paragraphs[0]}"
+
+    header = f"{doc_id} ({rng.choice(SOURCES)})" if has_source else doc_id
+    body = "\n\n".join(
+        textwrap.fill(p, width=72, initial_indent="   ", break_on_hyphens=False)
+        for p in paragraphs
+    )
+    text = f"{header}\n\n{body}\n\n"
+
+    key_id = f"{doc_id} (NCCOSC)" if has_source else doc_id
+    key_lines = []
+    if rng.random() < 0.05:
+        key_lines.append(";;; synthetic annotator comment")
+    if not incidents:
+        return text, key_lines + format_template(key_id, {"MESSAGE: TEMPLATE": ["*"]})
+    for i, incident in enumerate(incidents, start=1):
+        values = incident.key_values()
+        values["MESSAGE: TEMPLATE"] = [
+            f"{i} (OPTIONAL)" if incident.optional else str(i)
+        ]
+        if key_lines and key_lines[-1] != "":
+            key_lines.append("")
+        key_lines.extend(format_template(key_id, values))
+    return text, key_lines
+
+
+def generate_split(output_root: str, split: str, scale: float, seed: int) -> int:
+    rng = random.Random(f"{seed}-{split}")
+    docs_dir = os.path.join(output_root, "raw", "splits", split, "docs")
+    keys_dir = os.path.join(output_root, "raw", "splits", split, "keys")
+    os.makedirs(docs_dir, exist_ok=True)
+    os.makedirs(keys_dir, exist_ok=True)
+
+    series = SPLIT_SERIES[split]
+    num_docs = max(len(series), round(SPLIT_SIZES[split] * scale))
+    docs_per_series = -(-num_docs // len(series))
+    for prefix, key_file_pattern, doc_file_pattern in series:
+        has_source = prefix.startswith("DEV")
+        for first in range(1, docs_per_series + 1, DOCS_PER_FILE):
+            last = min(first + DOCS_PER_FILE, docs_per_series + 1)
+            texts, keys = [], []
+            for n in range(first, last):
+                text, key_lines = generate_document(
+                    rng, f"{prefix}-{n:04d}", has_source
+                )
+                texts.append(text)
+                keys.append("\n".join(key_lines))
+            with open(
+                os.path.join(docs_dir, doc_file_pattern.format(n=first)), "w"
+            ) as f:
+                f.write("".join(texts))
+            with open(
+                os.path.join(keys_dir, key_file_pattern.format(n=first)), "w"
+            ) as f:
+                f.write("\n\n".join(keys) + "\n")
+    return docs_per_series * len(series)
+
+
+def generate_corpus(
+    output_root: str, scale: float, seed: int = 0, splits: Iterable[str] = SPLIT_SIZES
+) -> Dict[str, int]:
+    """Writes a synthetic corpus under output_root/raw/splits; returns doc counts"""
+    return {split: generate_split(output_root, split, scale, seed) for split in splits}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "output_root",
+        help="directory under which raw/splits/{train,dev,test}/{docs,keys} are written",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="corpus size as a multiple of the bundled MUC data",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=list(SPLIT_SIZES),
+        default=list(SPLIT_SIZES),
+        help="the splits to generate",
+    )
+    args = parser.parse_args()
+    counts = generate_corpus(args.output_root, args.scale, args.seed, args.splits)
+    for split, count in counts.items():
+        print(f"Wrote {count} {split} documents to {args.output_root}")
@@ -0,0 +1,419 @@
+"""
+Template-level scorer for IterX predictions (JSONlines files as in
+predictions/iterx/*/jsonlines/) against the gold templates in
+data/processed/{split}.
+
+For each document, predicted and gold templates are aligned one-to-one
+so as to maximize the number of matching slot fills (the incident type
+counts as one more slot), using linear_sum_assignment on a template-by-
+template score matrix. Within an aligned pair and slot, predicted fillers
+and gold entities are matched one-to-one as well; a predicted filler
+matches a gold entity if any of its mentions equals any of the entity's
+strings, ignoring case and whitespace. Precision, recall and F1 are
+reported overall, per slot and per incident type. Only the slots in
+data/concrete/sftp_ontology_mapping.json are scored, under the names the
+models use (e.g. perpind).
+
+Many prediction files (e.g. one per checkpoint) are scored in parallel
+with a process pool. Run from the project root, e.g.:
+
+    python scripts/evaluation/score_templates.py predictions/iterx/lowercase/jsonlines/dev.jsonlines
+    python scripts/evaluation/score_templates.py checkpoints/*/test.jsonlines --split test --num-workers 8
+"""
+import argparse
+import json
+import numpy as np
+import os
+import re
+import sys
+
+from collections import defaultdict
+from dataclasses import dataclass
+from multiprocessing import Pool
+from scipy.optimize import linear_sum_assignment
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.columnar import PROCESSED_DATA_ROOT, load_split
+
+ONTOLOGY_MAPPING = "data/concrete/sftp_ontology_mapping.json"
+SPLITS = ["train", "dev", "test"]
+INCIDENT_TYPE = "incident_type"
+
+# a template as a list of (slot index, list of mention strings) fillers,
+# plus its incident type. Slot 0 is reserved for the incident type, so
+# the i-th scored slot has index i + 1
+EncodedTemplate = Tuple[List[Tuple[int, List[str]]], str]
+
+
+@dataclass
+class Counts:
+    """
+    True positive, predicted and gold counts per document (rows) and slot
+    (columns, with the incident type first), plus the same counts summed
+    per incident type. The true positives of an aligned pair of templates
+    of different types count towards the precision of the predicted type
+    (type_tp_pred) and the recall of the gold type (type_tp_gold), and
+    those of a template with a compound type towards each of its types.
+    """
+
+    doc_ids: List[str]
+    slots: List[str]
+    tp: np.ndarray
+    pred: np.ndarray
+    gold: np.ndarray
+    types: List[str]
+    type_tp_pred: np.ndarray
+    type_tp_gold: np.ndarray
+    type_pred: np.ndarray
+    type_gold: np.ndarray
+
+
+def normalize(mention: str) -> str:
+    return re.sub(r"\s+", "", mention).lower()
+
+
+def incident_types(incident_type: str) -> Set[str]:
+    # some gold templates have types like "ATTACK / BOMBING"
+    return {t.strip() for t in incident_type.lower().split("/")}
+
+
+def load_slot_mapping(path: str = ONTOLOGY_MAPPING) -> Dict[str, str]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_gold(
+    split: str, slot_mapping: Dict[str, str], data_root: str = PROCESSED_DATA_ROOT
+) -> Dict[str, List[EncodedTemplate]]:
+    slots = list(slot_mapping.values())
+    gold = {}
+    for doc_id, doc in load_split(split, data_root).items():
+        templates = []
+        for template in doc["templates"]:
+            fillers = []
+            for slot, model_slot in slot_mapping.items():
+                for filler in template.get(slot) or []:
+                    fillers.append((1 + slots.index(model_slot), filler["strings"]))
+            templates.append((fillers, template[INCIDENT_TYPE]))
+        gold[doc_id] = templates
+    return gold
+
+
+def load_predictions(path: str, slots: List[str]) -> Dict[str, List[EncodedTemplate]]:
+    predictions = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            # each line contains all predictions for a single
+            # document for templates of a single type
+            for doc_id, templates in json.loads(line).items():
+                for template in templates:
+                    fillers = [
+                        (1 + slots.index(slot), mentions)
+                        for slot, slot_fillers in template.items()
+                        if slot in slots
+                        for mentions in slot_fillers
+                    ]
+                    predictions[doc_id].append((fillers, template[INCIDENT_TYPE]))
+    return predictions
+
+
+def _flatten(
+    templates: List[EncodedTemplate], string_ids: Dict[str, int]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the template and slot of each filler, and the normalized string
+    ID and filler of each mention, as arrays.
+    """
+    filler_template, filler_slot, mention_ids, mention_filler = [], [], [], []
+    for t, (fillers, _) in enumerate(templates):
+        for slot, mentions in fillers:
+            for mention in mentions:
+                mention_ids.append(
+                    string_ids.setdefault(normalize(mention), len(string_ids))
+                )
+                mention_filler.append(len(filler_template))
+            filler_template.append(t)
+            filler_slot.append(slot)
+    return (
+        np.array(filler_template, dtype=np.int64),
+        np.array(filler_slot, dtype=np.int64),
+        np.array(mention_ids, dtype=np.int64),
+        np.array(mention_filler, dtype=np.int64),
+    )
+
+
+def score_document(
+    predicted: List[EncodedTemplate], gold: List[EncodedTemplate], num_slots: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Tuple[int, int, np.ndarray]]]:
+    """
+    Aligns the predicted and gold templates of one document. Returns the
+    true positive, predicted and gold counts per slot (the incident type
+    being slot 0), and the aligned (predicted, gold, per-slot true
+    positives) template pairs.
+    """
+    string_ids = {}
+    p_template, p_slot, p_mentions, p_mention_filler = _flatten(predicted, string_ids)
+    g_template, g_slot, g_mentions, g_mention_filler = _flatten(gold, string_ids)
+
+    pred_counts = np.bincount(p_slot, minlength=num_slots)
+    gold_counts = np.bincount(g_slot, minlength=num_slots)
+    pred_counts[0], gold_counts[0] = len(predicted), len(gold)
+    if not predicted or not gold:
+        return np.zeros(num_slots, dtype=np.int64), pred_counts, gold_counts, []
+
+    # filler-by-entity matches: some mention in common and the same slot
+    match = np.zeros((len(p_template), len(g_template)), dtype=bool)
+    m_p, m_g = np.nonzero(p_mentions[:, None] == g_mentions[None, :])
+    match[p_mention_filler[m_p], g_mention_filler[m_g]] = True
+    match &= p_slot[:, None] == g_slot[None, :]
+
+    # per template pair and slot, the size of a one-to-one matching
+    pair_tp = np.zeros((len(predicted), len(gold), num_slots), dtype=np.int64)
+    pair_tp[:, :, 0] = [
+        [p_type.lower() in incident_types(g_type) for _, g_type in gold]
+        for _, p_type in predicted
+    ]
+    f_p, f_g = np.nonzero(match)
+    groups = np.unique(
+        np.stack([p_template[f_p], g_template[f_g], p_slot[f_p]], axis=1), axis=0
+    )
+    for t_p, t_g, slot in groups:
+        rows = np.nonzero((p_template == t_p) & (p_slot == slot))[0]
+        cols = np.nonzero((g_template == t_g) & (g_slot == slot))[0]
+        block = match[np.ix_(rows, cols)]
+        if (block.sum(0) <= 1).all() and (block.sum(1) <= 1).all():
+            pair_tp[t_p, t_g, slot] = block.sum()
+        else:
+            r, c = linear_sum_assignment(block, maximize=True)
+            pair_tp[t_p, t_g, slot] = block[r, c].sum()
+
+    rows, cols = linear_sum_assignment(pair_tp.sum(axis=2), maximize=True)
+    tp = pair_tp[rows, cols].sum(axis=0)
+    return tp, pred_counts, gold_counts, list(zip(rows, cols, pair_tp[rows, cols]))
+
+
+def score_predictions(
+    predictions: Dict[str, List[EncodedTemplate]],
+    gold: Dict[str, List[EncodedTemplate]],
+    slots: List[str],
+) -> Counts:
+    """Scores every gold document; missing predictions count as empty"""
+    for doc_id in predictions.keys() - gold.keys():
+        print(f"WARNING: ignoring predictions for unknown document {doc_id}")
+    doc_ids = list(gold)
+    all_slots = [INCIDENT_TYPE] + slots
+    n = len(all_slots)
+    tp = np.zeros((len(doc_ids), n), dtype=np.int64)
+    pred = np.zeros_like(tp)
+    gold_counts = np.zeros_like(tp)
+    type_counts = defaultdict(lambda: np.zeros((4, n), dtype=np.int64))
+    for i, doc_id in enumerate(doc_ids):
+        predicted = predictions.get(doc_id, [])
+        tp[i], pred[i], gold_counts[i], pairs = score_document(
+            predicted, gold[doc_id], n
+        )
+        # predicted counts, and the true positives they are precise by, go
+        # to the predicted template's type; gold counts, and the true
+        # positives they are recalled by, to the gold template's type. A
+        # compound type such as "ATTACK / BOMBING" counts towards each of
+        # its types, which are what the incident type is matched against
+        for fillers, incident_type in predicted:
+            for t in incident_types(incident_type):
+                type_counts[t][2, 0] += 1
+                np.add.at(type_counts[t][2], [slot for slot, _ in fillers], 1)
+        for fillers, incident_type in gold[doc_id]:
+            for t in incident_types(incident_type):
+                type_counts[t][3, 0] += 1
+                np.add.at(type_counts[t][3], [slot for slot, _ in fillers], 1)
+        for t_p, t_g, pair_tp in pairs:
+            for t in incident_types(predicted[t_p][1]):
+                type_counts[t][0] += pair_tp
+            for t in incident_types(gold[doc_id][t_g][1]):
+                type_counts[t][1] += pair_tp
+    types = sorted(type_counts)
+    stacked = (
+        np.stack([type_counts[t] for t in types]) if types else np.zeros((0, 4, n))
+    )
+    return Counts(
+        doc_ids=doc_ids,
+        slots=all_slots,
+        tp=tp,
+        pred=pred,
+        gold=gold_counts,
+        types=types,
+        type_tp_pred=stacked[:, 0],
+        type_tp_gold=stacked[:, 1],
+        type_pred=stacked[:, 2],
+        type_gold=stacked[:, 3],
+    )
+
+
+def prf(tp: np.ndarray, pred: np.ndarray, gold: np.ndarray) -> Tuple[Any, Any, Any]:
+    """Precision, recall and F1 (elementwise for arrays)"""
+    tp, pred, gold = (np.asarray(x, dtype=np.float64) for x in (tp, pred, gold))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.where(pred > 0, tp / pred, 0.0)
+        r = np.where(gold > 0, tp / gold, 0.0)
+        f = np.where(p + r > 0, 2 * p * r / (p + r), 0.0)
+    return p, r, f
+
+
+def summarize(counts: Counts) -> Dict[str, Any]:
+    def entry(tp, pred, gold, tp_gold=None):
+        # tp_gold, if given, are the true positives recall is computed from
+        p, _, _ = prf(tp, pred, gold)
+        _, r, _ = prf(tp if tp_gold is None else tp_gold, pred, gold)
+        f = 2 * p * r / (p + r) if p + r > 0 else 0.0
+        e = {
+            "precision": float(p),
+            "recall": float(r),
+            "f1": float(f),
+            "tp": int(tp),
+            "pred": int(pred),
+            "gold": int(gold),
+        }
+        if tp_gold is not None:
+            e["tp_gold"] = int(tp_gold)
+        return e
+
+    tp, pred, gold = counts.tp.sum(0), counts.pred.sum(0), counts.gold.sum(0)
+    return {
+        "overall": entry(tp.sum(), pred.sum(), gold.sum()),
+        "slots": {
+            slot: entry(tp[i], pred[i], gold[i]) for i, slot in enumerate(counts.slots)
+        },
+        "incident_types": {
+            t: entry(
+                counts.type_tp_pred[i].sum(),
+                counts.type_pred[i].sum(),
+                counts.type_gold[i].sum(),
+                counts.type_tp_gold[i].sum(),
+            )
+            for i, t in enumerate(counts.types)
+        },
+    }
+
+
+def infer_split(path: str) -> str:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem not in SPLITS:
+        raise ValueError(f"Cannot infer the split of {path}; please pass --split")
+    return stem
+
+
+_GOLD = {}
+_SLOTS = []
+
+
+def _init_worker(gold: Dict[str, Dict[str, List[EncodedTemplate]]], slots: List[str]):
+    global _GOLD, _SLOTS
+    _GOLD, _SLOTS = gold, slots
+
+
+def _score_file(job: Tuple[str, str]) -> Tuple[str, Dict[str, Any]]:
+    path, split = job
+    counts = score_predictions(load_predictions(path, _SLOTS), _GOLD[split], _SLOTS)
+    return path, summarize(counts)
+
+
+def score_files(
+    paths: List[str],
+    splits: List[str],
+    slot_mapping: Dict[str, str],
+    data_root: str = PROCESSED_DATA_ROOT,
+    num_workers: int = 1,
+) -> Dict[str, Dict[str, Any]]:
+    """Scores each prediction file against the gold data of its split"""
+    slots = list(slot_mapping.values())
+    gold = {
+        split: load_gold(split, slot_mapping, data_root)
+        for split in sorted(set(splits))
+    }
+    jobs = list(zip(paths, splits))
+    if num_workers <= 1:
+        _init_worker(gold, slots)
+        return dict(map(_score_file, jobs))
+    with Pool(num_workers, initializer=_init_worker, initargs=(gold, slots)) as pool:
+        return dict(pool.imap_unordered(_score_file, jobs))
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    def line(name, e):
+        print(
+            f"{name:<24} {100 * e['precision']:6.2f} {100 * e['recall']:6.2f} {100 * e['f1']:6.2f} "
+            f"{e['tp']:6d} {e['pred']:6d} {e['gold']:6d}"
+            + (f" {e['tp_gold']:6d}" if "tp_gold" in e else "")
+        )
+
+    print(f"{'':<24} {'P':>6} {'R':>6} {'F1':>6} {'TP':>6} {'pred':>6} {'gold':>6}")
+    for slot, e in summary["slots"].items():
+        line(slot, e)
+    # per incident type, TP counts towards precision and TP gold towards recall
+    print("-" * 66 + f" {'TP gold':>6}")
+    for incident_type, e in summary["incident_types"].items():
+        line(incident_type, e)
+    print("-" * 66)
+    line("overall", summary["overall"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "predictions", nargs="+", help="IterX JSONlines prediction files to score"
+    )
+    parser.add_argument(
+        "--split",
+        choices=SPLITS,
+        default=None,
+        help="gold split to score against; by default inferred from each file name (e.g. dev.jsonlines)",
+    )
+    parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed splits",
+    )
+    parser.add_argument(
+        "--ontology-mapping",
+        type=str,
+        default=ONTOLOGY_MAPPING,
+        help="JSON file mapping the scored slots to the names used in the predictions",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="number of processes used to score prediction files",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="also write all scores to this JSON file",
+    )
+    args = parser.parse_args()
+
+    splits = [args.split or infer_split(p) for p in args.predictions]
+    scores = score_files(
+        args.predictions,
+        splits,
+        load_slot_mapping(args.ontology_mapping),
+        args.data_root,
+        args.num_workers,
+    )
+    if len(scores) == 1:
+        print_summary(next(iter(scores.values())))
+    else:
+        for path, summary in sorted(
+            scores.items(), key=lambda kv: -kv[1]["overall"]["f1"]
+        ):
+            e = summary["overall"]
+            print(
+                f"{100 * e['precision']:6.2f} {100 * e['recall']:6.2f} {100 * e['f1']:6.2f}  {path}"
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(scores, f, indent=2)
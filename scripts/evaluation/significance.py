@@ -0,0 +1,190 @@
+"""
+Paired bootstrap significance test between two prediction files scored
+against the same gold split (see score_templates.py).
+
+Both files are scored once, giving per-document true positive, predicted
+and gold counts per slot. Each bootstrap resample draws documents with
+replacement; rather than re-scoring, it is represented as a vector of
+document multiplicities, so that the counts of all resamples are a
+single matrix product. For every slot and overall, the script reports
+both systems' scores, the difference, its bootstrap confidence interval
+and a two-sided p-value for the null hypothesis that the difference is
+zero. Run from the project root, e.g.:
+
+    python scripts/evaluation/significance.py run_a/test.jsonlines run_b/test.jsonlines
+"""
+import argparse
+import json
+import numpy as np
+import os
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from evaluation.score_templates import (
+    ONTOLOGY_MAPPING,
+    SPLITS,
+    infer_split,
+    load_gold,
+    load_predictions,
+    load_slot_mapping,
+    prf,
+    score_predictions,
+)
+from utils.columnar import PROCESSED_DATA_ROOT
+
+METRICS = ["f1", "precision", "recall"]
+# resamples are processed in blocks to bound memory use
+BLOCK_SIZE = 1000
+
+
+def metric(tp: np.ndarray, pred: np.ndarray, gold: np.ndarray, name: str) -> np.ndarray:
+    precision, recall, f1 = prf(tp, pred, gold)
+    return {"precision": precision, "recall": recall, "f1": f1}[name]
+
+
+def paired_bootstrap(
+    tp_a: np.ndarray,
+    pred_a: np.ndarray,
+    tp_b: np.ndarray,
+    pred_b: np.ndarray,
+    gold: np.ndarray,
+    num_resamples: int = 10000,
+    metric_name: str = "f1",
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> Dict[str, np.ndarray]:
+    """
+    Takes (documents x columns) count matrices for systems A and B and
+    returns, per column, the observed scores of A and B, the observed
+    difference B - A, its confidence interval and p-value.
+    """
+    rng = np.random.default_rng(seed)
+    num_docs = tp_a.shape[0]
+    # stack everything so each resample needs a single matrix product
+    stacked = np.concatenate([tp_a, pred_a, tp_b, pred_b, gold], axis=1).astype(
+        np.float64
+    )
+    k = tp_a.shape[1]
+
+    def scores(sums: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        tp_a, pred_a, tp_b, pred_b, gold = np.split(sums, 5, axis=-1)
+        return (
+            metric(tp_a, pred_a, gold, metric_name),
+            metric(tp_b, pred_b, gold, metric_name),
+        )
+
+    score_a, score_b = scores(stacked.sum(axis=0))
+    observed = score_b - score_a
+    deltas = np.empty((num_resamples, k))
+    for start in range(0, num_resamples, BLOCK_SIZE):
+        size = min(BLOCK_SIZE, num_resamples - start)
+        weights = rng.multinomial(num_docs, np.full(num_docs, 1 / num_docs), size)
+        a, b = scores(weights @ stacked)
+        deltas[start : start + size] = b - a
+
+    alpha = 1 - confidence
+    low, high = np.quantile(deltas, [alpha / 2, 1 - alpha / 2], axis=0)
+    # the bootstrap distribution is centered on the observed difference;
+    # shifting it to zero gives the distribution under the null hypothesis
+    p_value = (np.abs(deltas - observed) >= np.abs(observed)).mean(axis=0)
+    return {
+        "a": score_a,
+        "b": score_b,
+        "delta": observed,
+        "ci_low": low,
+        "ci_high": high,
+        "p_value": p_value,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("predictions_a", help="JSONlines predictions of system A")
+    parser.add_argument("predictions_b", help="JSONlines predictions of system B")
+    parser.add_argument(
+        "--split",
+        choices=SPLITS,
+        default=None,
+        help="gold split to score against; by default inferred from the file name of predictions_a",
+    )
+    parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed splits",
+    )
+    parser.add_argument(
+        "--ontology-mapping",
+        type=str,
+        default=ONTOLOGY_MAPPING,
+        help="JSON file mapping the scored slots to the names used in the predictions",
+    )
+    parser.add_argument("--num-resamples", type=int, default=10000)
+    parser.add_argument("--metric", choices=METRICS, default="f1")
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="confidence level of the reported intervals",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="also write the results to this JSON file",
+    )
+    args = parser.parse_args()
+
+    split = args.split or infer_split(args.predictions_a)
+    slot_mapping = load_slot_mapping(args.ontology_mapping)
+    slots = list(slot_mapping.values())
+    gold = load_gold(split, slot_mapping, args.data_root)
+    counts_a = score_predictions(
+        load_predictions(args.predictions_a, slots), gold, slots
+    )
+    counts_b = score_predictions(
+        load_predictions(args.predictions_b, slots), gold, slots
+    )
+
+    def with_overall(m: np.ndarray) -> np.ndarray:
+        return np.concatenate([m, m.sum(axis=1, keepdims=True)], axis=1)
+
+    results = paired_bootstrap(
+        with_overall(counts_a.tp),
+        with_overall(counts_a.pred),
+        with_overall(counts_b.tp),
+        with_overall(counts_b.pred),
+        with_overall(counts_a.gold),
+        args.num_resamples,
+        args.metric,
+        args.confidence,
+        args.seed,
+    )
+    names = counts_a.slots + ["overall"]
+    print(
+        f"{len(counts_a.doc_ids)} documents, {args.num_resamples} resamples, "
+        f"{100 * args.confidence:.0f}% confidence intervals for {args.metric} (B - A)"
+    )
+    print(f"{'':<16} {'A':>7} {'B':>7} {'B - A':>7} {'CI':>17} {'p':>7}")
+    for i, name in enumerate(names):
+        print(
+            f"{name:<16} {100 * results['a'][i]:7.2f} {100 * results['b'][i]:7.2f} "
+            f"{100 * results['delta'][i]:+7.2f} "
+            f"[{100 * results['ci_low'][i]:+6.2f}, {100 * results['ci_high'][i]:+6.2f}] "
+            f"{results['p_value'][i]:7.4f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    name: {key: float(values[i]) for key, values in results.items()}
+                    for i, name in enumerate(names)
+                },
+                f,
+                indent=2,
+            )
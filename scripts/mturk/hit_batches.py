@@ -0,0 +1,290 @@
+"""
+Shared HIT generation pipeline for the MTurk CSV generators in annotation/.
+
+Documents are streamed from a processed split one at a time, turned into
+HIT payloads (optionally in parallel), and written to a sequence of CSV
+batches, each capped by number of HITs and/or size in bytes. A JSON
+manifest describing the batches is written alongside them.
+
+With --shard (see utils/sharding.py), only the documents of one shard
+are turned into HITs, which keep the IDs they would have in an unsharded
+run, and are all written to a single shard CSV. The batches are then cut
+when the shards are merged with scripts/pipeline/merge_shards.py.
+"""
+import html
+import json
+import os
+import re
+
+from collections import deque
+from multiprocessing import Pool
+from typing import *
+
+from utils.data_model import Document, Template, iter_documents
+from utils.profiling import PROFILER
+from utils.sharding import Shard, shard_path, write_positions
+
+CSV_HEADER = "var_arrays\n"
+FILLER_STRING_KEYS = ["strings", "strings_lhs", "strings_rhs"]
+
+# maps a document to a list of keyword arguments for create_hit
+# (everything except the hit ID, which is assigned when the HIT is written)
+DocToHits = Callable[[Document], List[Dict[str, Any]]]
+
+
+def count_template_hits(doc: Document) -> int:
+    # both generators in annotation/ make one HIT per template
+    return len(doc.templates)
+
+
+def replace_string(s):
+    """
+    Make some changes to the input string to make it Turk readable
+    """
+
+    # replace all single quotes by double quotes : except at the start/end of the list
+    # s = re.sub(r'([^\]])\"', r'\1""', s)
+    s = re.sub(r"(?<!\}\])\"", r'""', s)
+
+    # replace single quotes
+    s = re.sub(r"\'\{", r"{", s)
+    s = re.sub(r"\}\'", r"}", s)
+
+    # replace two backslashes with three
+    s = re.sub(r"\\\\", r"\\\\\\", s)
+
+    # remove spaces before and after span
+    s = re.sub(r"> ", r">", s)
+    s = re.sub(r" <", r"<", s)
+
+    return s
+
+
+def escape_template(
+    template: Union[Template, Dict[str, Any]],
+    doc_id: str,
+    preprocess: Callable[[str], str] = lambda s: s,
+) -> Dict[str, Any]:
+    """
+    Returns a copy of the template, as JSON-serializable dicts, in which all
+    filler strings have been HTML-escaped (after applying `preprocess`).
+    The input is not modified.
+    """
+    if isinstance(template, Template):
+        template = template.to_json()
+    escaped = dict(template)
+    for slot, slot_data in template.items():
+        if not isinstance(slot_data, list):
+            continue
+        escaped_slot_data = []
+        for filler_data in slot_data:
+            filler_data = dict(filler_data)
+            for key in FILLER_STRING_KEYS:
+                if key not in filler_data:
+                    continue
+                try:
+                    filler_data[key] = [
+                        html.escape(preprocess(s)) for s in filler_data[key]
+                    ]
+                except AttributeError:
+                    print(
+                        f"WARNING: Invalid {key} value '{filler_data[key]}' for slot {slot} in document {doc_id}. Could not properly HTML escape this value. Continuing."
+                    )
+            escaped_slot_data.append(filler_data)
+        escaped[slot] = escaped_slot_data
+    return escaped
+
+
+class HITBatchWriter:
+    """
+    Writes rendered HIT rows to a sequence of CSV files, starting a new file
+    whenever adding a row would exceed `max_hits` rows or `max_bytes` bytes.
+    If neither cap is given, all rows go to `output_csv` itself; otherwise
+    batches are named <output_csv stem>_<batch number>.csv.
+    """
+
+    def __init__(
+        self,
+        output_csv: str,
+        max_hits: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.output_csv = output_csv
+        self.max_hits = max_hits
+        self.max_bytes = max_bytes
+        self.batches: List[Dict[str, Any]] = []
+        self._f = None
+
+    @property
+    def is_batched(self) -> bool:
+        return self.max_hits is not None or self.max_bytes is not None
+
+    def _batch_path(self, batch_num: int) -> str:
+        if not self.is_batched:
+            return self.output_csv
+        stem, ext = os.path.splitext(self.output_csv)
+        return f"{stem}_{batch_num:03d}{ext or '.csv'}"
+
+    def _open_batch(self, first_hit_id: int) -> None:
+        self._close_batch()
+        path = self._batch_path(len(self.batches))
+        self._f = open(path, "w", encoding="utf-8")
+        self._f.write(CSV_HEADER)
+        self.batches.append(
+            {
+                "file": os.path.basename(path),
+                "first_hit_id": first_hit_id,
+                "last_hit_id": None,
+                "num_hits": 0,
+                "num_bytes": len(CSV_HEADER.encode("utf-8")),
+            }
+        )
+
+    def _close_batch(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def _is_full(self, row_bytes: int) -> bool:
+        batch = self.batches[-1]
+        if batch["num_hits"] == 0:
+            # always accept at least one row, even if it exceeds the byte cap
+            return False
+        if self.max_hits is not None and batch["num_hits"] >= self.max_hits:
+            return True
+        if self.max_bytes is not None:
+            return batch["num_bytes"] + row_bytes > self.max_bytes
+        return False
+
+    def write(self, row: str, hit_id: int) -> None:
+        row_bytes = len(row.encode("utf-8"))
+        if self._f is None or self._is_full(row_bytes):
+            self._open_batch(hit_id)
+        self._f.write(row)
+        batch = self.batches[-1]
+        batch["last_hit_id"] = hit_id
+        batch["num_hits"] += 1
+        batch["num_bytes"] += row_bytes
+
+    def close(self) -> Dict[str, Any]:
+        """Closes the current batch and writes the manifest, which is returned"""
+        if self._f is None and not self.batches:
+            # no HITs at all: still produce a (header-only) CSV
+            self._open_batch(0)
+        self._close_batch()
+        manifest = {
+            "num_hits": sum(b["num_hits"] for b in self.batches),
+            "max_hits_per_batch": self.max_hits,
+            "max_bytes_per_batch": self.max_bytes,
+            "batches": self.batches,
+        }
+        manifest_path = os.path.splitext(self.output_csv)[0] + ".manifest.json"
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def iter_hit_payloads(
+    split_path: str,
+    doc_to_hits: DocToHits,
+    num_workers: int = 1,
+    shard: Optional[Shard] = None,
+    count_hits: Callable[[Document], int] = count_template_hits,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Streams documents from a processed split file and yields (HIT ID, HIT
+    payload) pairs in document order. With num_workers > 1, documents are
+    converted to HITs in a process pool. With a shard, the documents of
+    the other shards are not converted but their HITs are counted with
+    `count_hits`, so that HIT IDs are the same as in an unsharded run.
+    """
+    # (document ID, first HIT ID, number of HITs) of the documents being
+    # converted, in order
+    pending = deque()
+
+    def select_documents() -> Iterator[Document]:
+        next_hit_id = 0
+        for doc in iter_documents(split_path):
+            num_hits = count_hits(doc) if shard is not None else None
+            if shard is None or shard.contains(doc.doc_id):
+                pending.append((doc.doc_id, next_hit_id, num_hits))
+                yield doc
+            if shard is not None:
+                next_hit_id += num_hits
+
+    def number_hits(hits_per_doc: Iterable[List[Dict[str, Any]]]):
+        hit_id = 0
+        for payloads in hits_per_doc:
+            doc_id, first_hit_id, num_hits = pending.popleft()
+            if shard is not None:
+                if len(payloads) != num_hits:
+                    raise ValueError(
+                        f"Expected {num_hits} HITs for document {doc_id} but got {len(payloads)}; sharding requires count_hits to match doc_to_hits"
+                    )
+                hit_id = first_hit_id
+            for payload in payloads:
+                yield hit_id, payload
+                hit_id += 1
+
+    docs = select_documents()
+    if num_workers <= 1:
+        yield from number_hits(map(doc_to_hits, docs))
+    else:
+        with Pool(num_workers) as pool:
+            yield from number_hits(pool.imap(doc_to_hits, docs, chunksize=8))
+
+
+def write_hit_batches(
+    split_path: str,
+    output_csv: str,
+    doc_to_hits: DocToHits,
+    create_hit: Callable[..., str],
+    max_hits: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    num_workers: int = 1,
+    shard: Optional[Shard] = None,
+) -> Dict[str, Any]:
+    """
+    Generates HITs for every document in a processed split (or in `shard`)
+    and writes them to (possibly several) CSV files. Returns the batch
+    manifest. Shards are written to a single CSV, regardless of the caps.
+    """
+    if shard is not None:
+        output_csv = shard_path(output_csv, shard)
+        max_hits = max_bytes = None
+    writer = HITBatchWriter(output_csv, max_hits, max_bytes)
+    hit_ids = []
+    for hit_id, payload in iter_hit_payloads(
+        split_path, doc_to_hits, num_workers, shard
+    ):
+        with PROFILER.section("hit_rendering"):
+            row = create_hit(hit_id=hit_id, **payload)
+        with PROFILER.section("csv_write"):
+            writer.write(row, hit_id)
+        hit_ids.append(hit_id)
+    manifest = writer.close()
+    if shard is not None:
+        write_positions(output_csv, hit_ids)
+    return manifest
+
+
+def add_batching_args(parser) -> None:
+    """Adds the command line options shared by the MTurk CSV generators"""
+    parser.add_argument(
+        "--max-hits-per-batch",
+        type=int,
+        default=None,
+        help="start a new CSV file once this many HITs have been written",
+    )
+    parser.add_argument(
+        "--max-bytes-per-batch",
+        type=int,
+        default=None,
+        help="start a new CSV file before exceeding this many bytes",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="number of processes used to generate HITs",
+    )
@@ -0,0 +1,242 @@
+"""
+A small, dependency-free DAG executor for the data pipeline.
+
+Each Stage declares the files/directories it reads and writes. Edges
+between stages are inferred from those declarations: a stage depends on
+every stage that writes one of its inputs. A stage is skipped if the
+content hash of its inputs (including its own command) matches the hash
+recorded the last time it ran successfully and all of its outputs exist.
+The inputs of a stage include every local module that its scripts
+import, directly or not, so they need not be declared.
+"""
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import *
+
+HASH_BLOCK_SIZE = 1 << 20
+# where the scripts import local modules from besides their own directory,
+# relative to the project root the pipeline runs from
+IMPORT_ROOTS = ["scripts"]
+
+
+@dataclass
+class Stage:
+    name: str
+    cmd: List[str]
+    inputs: List[str]
+    outputs: List[str]
+    deps: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class StageResult:
+    name: str
+    status: str  # one of "ran", "skipped", "failed", "blocked"
+    seconds: float = 0.0
+    returncode: Optional[int] = None
+    input_hash: Optional[str] = None
+
+
+def hash_path(path: str, h: "hashlib._Hash") -> None:
+    """Feeds the relative path and contents of a file or directory into h"""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                hash_path(os.path.join(root, name), h)
+        return
+    h.update(path.encode("utf-8") + b"\0")
+    if not os.path.exists(path):
+        h.update(b"<missing>")
+        return
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+
+
+@lru_cache(maxsize=None)
+def _imported_names(path: str, mtime_ns: int) -> Tuple[str, ...]:
+    """
+    The modules a Python file may import, including deferred imports
+    inside functions. For "from a import b", both a and a.b.
+    """
+    with open(path, "rb") as f:
+        try:
+            tree = ast.parse(f.read(), path)
+        except SyntaxError:
+            return ()
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.append(node.module)
+            names.extend(f"{node.module}.{alias.name}" for alias in node.names)
+    return tuple(names)
+
+
+def _find_module(name: str, roots: List[str]) -> Optional[str]:
+    for root in roots:
+        base = os.path.join(root, *name.split("."))
+        for path in [base + ".py", os.path.join(base, "__init__.py")]:
+            if os.path.isfile(path):
+                return os.path.normpath(path)
+    return None
+
+
+def local_modules(script: str, import_roots: List[str] = IMPORT_ROOTS) -> List[str]:
+    """The local modules a script imports, directly or through other modules"""
+    # as when the script is run, its own directory comes first
+    roots = [os.path.dirname(script) or "."] + import_roots
+    found = set()
+    frontier = [script]
+    while frontier:
+        path = frontier.pop()
+        for name in _imported_names(path, os.stat(path).st_mtime_ns):
+            module = _find_module(name, roots)
+            if module is not None and module not in found:
+                found.add(module)
+                frontier.append(module)
+    found.discard(os.path.normpath(script))
+    return sorted(found)
+
+
+def stage_input_paths(stage: Stage) -> List[str]:
+    """A stage's declared inputs, plus the local modules its scripts import"""
+    paths = set(stage.inputs)
+    for path in stage.inputs:
+        if path.endswith(".py") and os.path.isfile(path):
+            paths.update(local_modules(path))
+    return sorted(paths)
+
+
+def hash_stage_inputs(stage: Stage) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(stage.cmd).encode("utf-8"))
+    for path in stage_input_paths(stage):
+        hash_path(path, h)
+    return h.hexdigest()
+
+
+def _overlaps(a: str, b: str) -> bool:
+    """Whether one of the two paths is equal to or contained in the other"""
+    a, b = os.path.normpath(a), os.path.normpath(b)
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def resolve_dependencies(stages: List[Stage]) -> None:
+    """Fills in Stage.deps from declared inputs and outputs"""
+    for stage in stages:
+        stage.deps = {
+            other.name
+            for other in stages
+            if other is not stage
+            and any(_overlaps(i, o) for i in stage.inputs for o in other.outputs)
+        }
+
+
+def select_stages(stages: List[Stage], targets: Set[str]) -> List[Stage]:
+    """Restricts stages to the targets and everything they (transitively) depend on"""
+    by_name = {s.name: s for s in stages}
+    selected = set()
+    frontier = list(targets)
+    while frontier:
+        name = frontier.pop()
+        if name not in selected:
+            selected.add(name)
+            frontier.extend(by_name[name].deps)
+    return [s for s in stages if s.name in selected]
+
+
+class PipelineRunner:
+    def __init__(self, stages: List[Stage], state_file: str, jobs: int = 1):
+        self.stages = {s.name: s for s in stages}
+        self.state_file = state_file
+        self.jobs = jobs
+        self.state = {}
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                self.state = json.load(f)
+
+    def _save_state(self) -> None:
+        if os.path.dirname(self.state_file):
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file, "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+
+    def _is_up_to_date(self, stage: Stage, input_hash: str) -> bool:
+        return self.state.get(stage.name) == input_hash and all(
+            os.path.exists(o) for o in stage.outputs
+        )
+
+    def _run_stage(self, stage: Stage, force: bool, dry_run: bool) -> StageResult:
+        input_hash = hash_stage_inputs(stage)
+        if not force and self._is_up_to_date(stage, input_hash):
+            return StageResult(stage.name, "skipped")
+        print(f"[{stage.name}] {' '.join(stage.cmd)}", flush=True)
+        if dry_run:
+            return StageResult(stage.name, "ran")
+        for output in stage.outputs:
+            if os.path.dirname(output):
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+        start = time.perf_counter()
+        proc = subprocess.run(stage.cmd)
+        seconds = time.perf_counter() - start
+        if proc.returncode != 0:
+            return StageResult(stage.name, "failed", seconds, proc.returncode)
+        return StageResult(stage.name, "ran", seconds, proc.returncode, input_hash)
+
+    def run(self, force: bool = False, dry_run: bool = False) -> List[StageResult]:
+        """
+        Runs all stages, starting each one as soon as its dependencies have
+        finished, with up to `jobs` stages running at once.
+        """
+        results: Dict[str, StageResult] = {}
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    dep_results = [results.get(d) for d in stage.deps]
+                    if any(r is None for r in dep_results):
+                        continue
+                    del pending[name]
+                    if any(r.status in {"failed", "blocked"} for r in dep_results):
+                        results[name] = StageResult(name, "blocked")
+                        continue
+                    future = executor.submit(self._run_stage, stage, force, dry_run)
+                    running[future] = name
+                if not running:
+                    if pending:
+                        raise ValueError(
+                            f"Dependency cycle among stages: {sorted(pending)}"
+                        )
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    results[running.pop(future)] = result
+                    if result.input_hash is not None:
+                        self.state[result.name] = result.input_hash
+                        self._save_state()
+        return [results[name] for name in self.stages]
+
+
+def print_report(results: List[StageResult]) -> None:
+    width = max(len(r.name) for r in results)
+    print()
+    print(f"{'stage'.ljust(width)}  {'status':<8}  seconds")
+    print("-" * (width + 20))
+    for r in results:
+        print(f"{r.name.ljust(width)}  {r.status:<8}  {r.seconds:7.2f}")
+    print("-" * (width + 20))
+    total = sum(r.seconds for r in results)
+    print(f"{'total (summed)'.ljust(width)}  {'':<8}  {total:7.2f}")
@@ -0,0 +1,202 @@
+"""
+Merges the outputs of a pipeline script run with --shard 0/N ... N-1/N
+(see scripts/utils/sharding.py) into the output of a single, unsharded
+run. Each OUTPUT is the path the unsharded run would have written; its
+shards are found next to it and interleaved using their positions
+files. The kind of output is told from its extension:
+
+- .json: processed splits and unlocatable mention reports (any JSON
+  object keyed by document ID)
+- .csv: MTurk HIT CSVs, which are cut into batches (and get a manifest)
+  here, according to the same --max-hits-per-batch and
+  --max-bytes-per-batch options as the generators take
+- anything else: Concrete archives (.zip, .tar.gz or directories), whose
+  members are copied without being deserialized
+
+Run from the project root, e.g.:
+
+    python scripts/preprocessing/preprocess.py --splits dev --shard 0/2 &
+    python scripts/preprocessing/preprocess.py --splits dev --shard 1/2 &
+    wait
+    python scripts/pipeline/merge_shards.py --num-shards 2 data/processed/dev/dev{,_unlocatable_entities,_unlocatable_locations}.json
+"""
+import argparse
+import os
+import shutil
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from mturk.hit_batches import CSV_HEADER, HITBatchWriter
+from utils.concrete_io import (
+    ArchiveOptions,
+    CommunicationArchiveWriter,
+    add_serialization_args,
+    infer_format,
+    iter_archive_members,
+)
+from utils.json_stream import iter_json_items, tee_json_items
+from utils.profiling import PROFILER, add_profiling_args, profiling
+from utils.sharding import (
+    Shard,
+    merge_shards,
+    positions_path,
+    read_positions,
+    shard_path,
+)
+
+# the indentation of the JSON files written by preprocess.py
+JSON_INDENT = 4
+
+
+def shard_paths(path: str, num_shards: int) -> List[str]:
+    paths = [shard_path(path, Shard(i, num_shards)) for i in range(num_shards)]
+    missing = [
+        p
+        for p in paths
+        if not os.path.exists(p) or not os.path.exists(positions_path(p))
+    ]
+    if missing:
+        raise FileNotFoundError(
+            f"Missing shard outputs for {path}: {', '.join(missing)}"
+        )
+    return paths
+
+
+def _merged(
+    paths: List[str],
+    read: Callable[[str, Optional[List[str]]], Iterable[Any]],
+    path: str,
+) -> Iterator[Tuple[int, Any]]:
+    """
+    Yields the (position, item) pairs of all shards in `paths`, in order.
+    `read` yields the items of a shard, given its path and member names.
+    """
+    shards = []
+    for p in paths:
+        positions, names = read_positions(p)
+        shards.append((positions, zip(positions, read(p, names))))
+    last_position = -1
+    for position, item in merge_shards(shards):
+        if position <= last_position:
+            raise ValueError(f"Shards of {path} overlap at position {position}")
+        last_position = position
+        yield position, item
+
+
+def merge_json(path: str, paths: List[str], indent: Optional[int] = JSON_INDENT) -> int:
+    num_items = 0
+    items = (item for _, item in _merged(paths, lambda p, _: iter_json_items(p), path))
+    for _ in tee_json_items(items, path, indent):
+        num_items += 1
+    return num_items
+
+
+def _iter_csv_rows(path: str, names: None = None) -> Iterator[str]:
+    with open(path, encoding="utf-8") as f:
+        header = f.readline()
+        if header != CSV_HEADER:
+            raise ValueError(f"{path} is not a HIT CSV")
+        # rows are JSON strings, so newlines only occur between them
+        yield from f
+
+
+def merge_csv(
+    path: str,
+    paths: List[str],
+    max_hits: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> int:
+    writer = HITBatchWriter(path, max_hits, max_bytes)
+    num_hits = 0
+    for hit_id, row in _merged(paths, _iter_csv_rows, path):
+        with PROFILER.section("csv_write"):
+            writer.write(row, hit_id)
+        num_hits += 1
+    writer.close()
+    return num_hits
+
+
+def _iter_members(path: str, names: Optional[List[str]]) -> Iterator[Tuple[str, bytes]]:
+    if not os.path.isdir(path):
+        # archives keep their members in the order they were written
+        return iter_archive_members(path)
+    return ((name, _read_bytes(os.path.join(path, name))) for name in names)
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def merge_archives(path: str, paths: List[str], options: ArchiveOptions) -> int:
+    num_members = 0
+    with CommunicationArchiveWriter(path, options) as writer:
+        for _, (name, data) in _merged(paths, _iter_members, path):
+            writer.write_bytes(name, data)
+            num_members += 1
+    return num_members
+
+
+def remove_shards(paths: List[str]) -> None:
+    for p in paths:
+        if os.path.isdir(p):
+            shutil.rmtree(p)
+        else:
+            os.remove(p)
+        os.remove(positions_path(p))
+        manifest_path = os.path.splitext(p)[0] + ".manifest.json"
+        if p.endswith(".csv") and os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "outputs",
+        nargs="+",
+        help="the outputs of the unsharded run, e.g. data/processed/dev/dev.json",
+    )
+    parser.add_argument(
+        "--num-shards", type=int, required=True, help="the N of --shard i/N"
+    )
+    parser.add_argument(
+        "--remove-shards",
+        action="store_true",
+        help="delete the shard outputs once they have been merged",
+    )
+    parser.add_argument(
+        "--max-hits-per-batch",
+        type=int,
+        default=None,
+        help="cut merged HIT CSVs into batches of at most this many HITs",
+    )
+    parser.add_argument(
+        "--max-bytes-per-batch",
+        type=int,
+        default=None,
+        help="cut merged HIT CSVs into batches of at most this many bytes",
+    )
+    add_serialization_args(parser)
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    with profiling(args):
+        for output in args.outputs:
+            paths = shard_paths(output, args.num_shards)
+            if output.endswith(".json"):
+                num_items = merge_json(output, paths)
+            elif output.endswith(".csv"):
+                num_items = merge_csv(
+                    output, paths, args.max_hits_per_batch, args.max_bytes_per_batch
+                )
+            else:
+                # the shards tell whether a directory was written
+                options = ArchiveOptions.from_args(args, infer_format(paths[0]))
+                num_items = merge_archives(output, paths, options)
+            print(f"Merged {num_items} items from {len(paths)} shards into {output}")
+            if args.remove_shards:
+                remove_shards(paths)
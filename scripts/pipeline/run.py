@@ -0,0 +1,244 @@
+"""
+Runs the data pipeline end to end, rerunning only the stages whose inputs
+have changed since they last succeeded:
+
+    data/raw --(proc_texts, proc_keys)--> data/semiprocessed
+             --(preprocess)--> data/processed
+             --(processed_to_concrete)--> data/concrete
+             --> IterX prediction archives and MTurk HIT CSVs
+
+Stages for different splits and casings are independent and are run
+concurrently (see --jobs). Run from the project root, e.g.:
+
+    python scripts/pipeline/run.py --jobs 4
+    python scripts/pipeline/run.py 'to_concrete_*_dev' --dry-run
+"""
+import argparse
+import fnmatch
+import os
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from pipeline.dag import (
+    PipelineRunner,
+    Stage,
+    print_report,
+    resolve_dependencies,
+    select_stages,
+)
+
+SPLITS = ["train", "dev", "test"]
+PREDICTION_SPLITS = ["dev", "test"]
+CASINGS = ["lowercase", "uppercase"]
+STATE_FILE = "data/.pipeline_state.json"
+
+PREPROCESSING = "scripts/preprocessing"
+POSTPROCESSING = "scripts/postprocessing"
+
+
+def build_stages() -> List[Stage]:
+    py = sys.executable
+    stages = []
+    for split in SPLITS:
+        raw = f"data/raw/splits/{split}"
+        semi = f"data/semiprocessed/{split}"
+        processed = f"data/processed/{split}"
+        stages.append(
+            Stage(
+                name=f"proc_texts_{split}",
+                cmd=[
+                    py,
+                    f"{PREPROCESSING}/proc_texts.py",
+                    f"{raw}/docs",
+                    f"{semi}/{split}_docs.json",
+                ],
+                inputs=[f"{PREPROCESSING}/proc_texts.py", f"{raw}/docs"],
+                outputs=[f"{semi}/{split}_docs.json"],
+            )
+        )
+        stages.append(
+            Stage(
+                name=f"proc_keys_{split}",
+                cmd=[
+                    py,
+                    f"{PREPROCESSING}/proc_keys.py",
+                    f"{raw}/keys",
+                    f"{semi}/{split}_keys.json",
+                ],
+                inputs=[f"{PREPROCESSING}/proc_keys.py", f"{raw}/keys"],
+                outputs=[f"{semi}/{split}_keys.json"],
+            )
+        )
+        stages.append(
+            Stage(
+                name=f"preprocess_{split}",
+                # the spaCy splitter reproduces the sentence splits in data/processed
+                cmd=[
+                    py,
+                    f"{PREPROCESSING}/preprocess.py",
+                    "--splits",
+                    split,
+                    "--sentence-splitter",
+                    "spacy",
+                ],
+                inputs=[
+                    f"{PREPROCESSING}/preprocess.py",
+                    f"{semi}/{split}_docs.json",
+                    f"{semi}/{split}_keys.json",
+                ],
+                outputs=[
+                    f"{processed}/{split}.json",
+                    f"{processed}/{split}_unlocatable_entities.json",
+                    f"{processed}/{split}_unlocatable_locations.json",
+                ],
+            )
+        )
+        stages.append(
+            Stage(
+                name=f"resolve_locations_{split}",
+                cmd=[py, f"{PREPROCESSING}/resolve_locations.py", "--splits", split],
+                inputs=[
+                    f"{PREPROCESSING}/resolve_locations.py",
+                    "data/documentation/templ-doc-basic",
+                    "data/documentation/templ-doc-more",
+                    f"{processed}/{split}.json",
+                    f"{processed}/{split}_unlocatable_locations.json",
+                ],
+                outputs=[f"{processed}/{split}_resolved_locations.json"],
+            )
+        )
+        stages.append(
+            Stage(
+                name=f"suggest_fixes_{split}",
+                cmd=[py, f"{PREPROCESSING}/suggest_fixes.py", "--splits", split],
+                inputs=[
+                    f"{PREPROCESSING}/suggest_fixes.py",
+                    f"{processed}/{split}.json",
+                    f"{processed}/{split}_unlocatable_entities.json",
+                    f"{processed}/{split}_unlocatable_locations.json",
+                ],
+                outputs=[f"{processed}/{split}_fix_suggestions.json"],
+            )
+        )
+        stages.append(
+            Stage(
+                name=f"entity_sharing_{split}",
+                cmd=[py, f"{PREPROCESSING}/entity_sharing.py", "--splits", split],
+                inputs=[
+                    f"{PREPROCESSING}/entity_sharing.py",
+                    f"{processed}/{split}.json",
+                ],
+                outputs=[f"{processed}/{split}_entity_sharing.json"],
+            )
+        )
+        stages.append(
+            Stage(
+                name=f"mention_overlaps_{split}",
+                cmd=[py, f"{PREPROCESSING}/mention_overlaps.py", "--splits", split],
+                inputs=[
+                    f"{PREPROCESSING}/mention_overlaps.py",
+                    f"{processed}/{split}.json",
+                ],
+                outputs=[f"{processed}/{split}_mention_overlaps.json"],
+            )
+        )
+        for casing in CASINGS:
+            cmd = [py, f"{PREPROCESSING}/processed_to_concrete.py", "--splits", split]
+            if casing == "lowercase":
+                cmd.append("--lowercase")
+            stages.append(
+                Stage(
+                    name=f"to_concrete_{casing}_{split}",
+                    cmd=cmd,
+                    inputs=[
+                        f"{PREPROCESSING}/processed_to_concrete.py",
+                        "data/concrete/sftp_ontology_mapping.json",
+                        f"{processed}/{split}.json",
+                    ],
+                    outputs=[f"data/concrete/{casing}/{split}.zip"],
+                )
+            )
+        for task in ["evidental", "template_anchors"]:
+            script = f"annotation/{task}/data_to_mturk_csv.py"
+            output_csv = f"annotation/{task}/hits/{split}.csv"
+            stages.append(
+                Stage(
+                    name=f"mturk_{task}_{split}",
+                    cmd=[py, script, "--split", split, "--output-csv", output_csv],
+                    inputs=[script, f"{processed}/{split}.json"],
+                    outputs=[output_csv],
+                )
+            )
+    for split in PREDICTION_SPLITS:
+        spanfinder = f"predictions/spanfinder/concrete/lowercase/{split}.zip"
+        iterx = f"predictions/iterx/lowercase/jsonlines/{split}.jsonlines"
+        output = f"predictions/iterx/lowercase/concrete/{split}.zip"
+        script = f"{POSTPROCESSING}/annotate_concrete_with_iterx_predictions.py"
+        stages.append(
+            Stage(
+                name=f"annotate_iterx_{split}",
+                cmd=[py, script, spanfinder, output, iterx],
+                inputs=[script, spanfinder, iterx],
+                outputs=[output],
+            )
+        )
+    resolve_dependencies(stages)
+    return stages
+
+
+def match_targets(stages: List[Stage], patterns: List[str]) -> Set[str]:
+    targets = set()
+    for pattern in patterns:
+        matches = fnmatch.filter([s.name for s in stages], pattern)
+        if not matches:
+            raise ValueError(f"No stage matches {pattern!r}")
+        targets.update(matches)
+    return targets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="names (or glob patterns) of the stages to bring up to date, along with their dependencies; defaults to all stages",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=1, help="number of stages to run at once"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="rerun stages even if they are up to date"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the commands of out-of-date stages without running them",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="list all stages with their dependencies"
+    )
+    parser.add_argument(
+        "--state-file",
+        type=str,
+        default=STATE_FILE,
+        help="where the input hashes of successfully completed stages are recorded",
+    )
+    args = parser.parse_args()
+
+    stages = build_stages()
+    if args.list:
+        for stage in stages:
+            print(f"{stage.name}: {', '.join(sorted(stage.deps)) or '-'}")
+        sys.exit(0)
+    if args.targets:
+        stages = select_stages(stages, match_targets(stages, args.targets))
+
+    runner = PipelineRunner(stages, args.state_file, args.jobs)
+    results = runner.run(force=args.force, dry_run=args.dry_run)
+    print_report(results)
+    if any(r.status in {"failed", "blocked"} for r in results):
+        sys.exit(1)
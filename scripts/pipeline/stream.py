@@ -0,0 +1,318 @@
+"""
+In-process, streaming version of the data pipeline (see run.py). Each
+stage is a generator over (document ID, item) pairs, so that the stages
+compose in memory instead of writing and re-parsing the JSON files in
+data/semiprocessed and data/processed:
+
+    iter_raw_docs --+
+                    +--> iter_preprocessed --> iter_communications
+    iter_keys ------+
+
+Any stage can still be written to disk as it streams past by wrapping
+it in tee_json (or, for the last stage, write_communications); the
+files are identical to those of the standalone scripts. Passing doc_ids
+restricts the pipeline to a subset of documents, e.g. in a notebook:
+
+    ids = {"TST1-MUC3-0001", "TST1-MUC3-0002"}
+    docs = iter_raw_docs("data/raw/splits/dev/docs", ids)
+    keys = iter_keys("data/raw/splits/dev/keys", ids)
+    for doc_id, comm in iter_communications(iter_preprocessed(docs, keys)):
+        ...
+
+To rebuild whole splits from the raw files, run from the project root:
+
+    python scripts/pipeline/stream.py --splits dev test --sentence-splitter spacy
+"""
+import argparse
+import json
+import os
+import sys
+
+from collections.abc import Mapping
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from preprocessing.preprocess import DEFAULT_SENTENCE_SPLITTER, iter_preprocess
+from preprocessing.proc_keys import iter_keyfiles, list_keyfiles
+from preprocessing.proc_texts import iter_texts, list_texts
+from preprocessing.sentence_splitters import SENTENCE_SPLITTERS
+from utils.concrete_io import (
+    ArchiveOptions,
+    CommunicationArchiveWriter,
+    add_serialization_args,
+    archive_path,
+)
+from utils.data_model import Document
+from utils.json_stream import tee_json_items
+from utils.profiling import PROFILER, add_profiling_args, profiling
+
+RAW_DATA_ROOT = "data/raw/splits/"
+OUTPUT_DIR = "data/concrete/"
+SPLITS = ["train", "dev", "test"]
+CASINGS = ["lowercase", "uppercase"]
+# the indentation of the files written by the standalone scripts
+SEMIPROCESSED_INDENT = 2
+PROCESSED_INDENT = 4
+
+Item = TypeVar("Item")
+
+
+def _select(
+    items: Iterable[Tuple[str, Item]], doc_ids: Optional[Collection[str]]
+) -> Iterator[Tuple[str, Item]]:
+    if doc_ids is None:
+        return iter(items)
+    return ((doc_id, item) for doc_id, item in items if doc_id in doc_ids)
+
+
+def iter_raw_docs(
+    input_path: str, doc_ids: Optional[Collection[str]] = None
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yields (document ID, document) pairs from a raw MUC document file or
+    directory, as proc_texts.py would write them
+    """
+    return _select(iter_texts(list_texts(input_path)), doc_ids)
+
+
+def iter_keys(
+    input_path: str, doc_ids: Optional[Collection[str]] = None
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Yields (document ID, templates) pairs from a raw MUC keyfile or
+    directory, as proc_keys.py would write them
+    """
+    return _select(iter_keyfiles(list_keyfiles(input_path)), doc_ids)
+
+
+def iter_preprocessed(
+    docs: Iterable[Tuple[str, Dict[str, Any]]],
+    keys: Union[
+        Mapping[str, List[Dict[str, Any]]], Iterable[Tuple[str, List[Dict[str, Any]]]]
+    ],
+    sentence_splitter: str = DEFAULT_SENTENCE_SPLITTER,
+    unlocatable_entity_mentions: Optional[Dict[str, Any]] = None,
+    unlocatable_location_mentions: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yields (document ID, processed document) pairs, as preprocess.py would
+    write them, in the order of `docs`. The keys are small, so unless they
+    already are a mapping, they are collected before the first document is
+    processed. Unlocatable mentions are recorded in the given dicts.
+    """
+    if not isinstance(keys, Mapping):
+        all_keys = {}
+        for doc_id, templates in keys:
+            all_keys.setdefault(doc_id, []).extend(templates)
+        keys = all_keys
+    return iter_preprocess(
+        docs,
+        keys,
+        sentence_splitter,
+        unlocatable_entity_mentions,
+        unlocatable_location_mentions,
+    )
+
+
+def _as_document(doc_id: str, doc: Union[Document, Dict[str, Any]]) -> Document:
+    return doc if isinstance(doc, Document) else Document.from_json(doc_id, doc)
+
+
+def iter_communications(
+    docs: Iterable[Tuple[str, Union[Document, Dict[str, Any]]]],
+    lowercase: bool = False,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Yields (document ID, Communication) pairs for processed documents, as
+    processed_to_concrete.py would write them
+    """
+    # cement and spaCy are only needed (and imported) for this stage
+    from preprocessing.processed_to_concrete import document_to_communication
+
+    for doc_id, doc in docs:
+        yield doc_id, document_to_communication(_as_document(doc_id, doc), lowercase)
+
+
+def tee_json(
+    items: Iterable[Tuple[str, Any]], path: str, indent: Optional[int] = None
+) -> Iterator[Tuple[str, Any]]:
+    """Passes a stage through unchanged, writing it to a JSON file on the way"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return tee_json_items(items, path, indent)
+
+
+def write_communications(
+    comms: Iterable[Tuple[str, Any]],
+    path: str,
+    options: ArchiveOptions = ArchiveOptions(),
+) -> int:
+    """
+    Writes (document ID, Communication) pairs to an archive (see
+    utils/concrete_io.py) and returns their number
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    num_comms = 0
+    with CommunicationArchiveWriter(path, options) as writer:
+        for doc_id, comm in comms:
+            writer.write(comm, doc_id + ".concrete")
+            num_comms += 1
+    return num_comms
+
+
+def run_split(
+    split: str,
+    raw_root: str = RAW_DATA_ROOT,
+    casings: List[str] = CASINGS,
+    sentence_splitter: str = DEFAULT_SENTENCE_SPLITTER,
+    doc_ids: Optional[Collection[str]] = None,
+    semiprocessed_dir: Optional[str] = None,
+    processed_dir: Optional[str] = None,
+    output_dir: str = OUTPUT_DIR,
+    options: ArchiveOptions = ArchiveOptions(),
+) -> int:
+    """
+    Runs the whole pipeline on one split, writing {casing}/{split}.zip (or
+    another archive format; see utils/concrete_io.py) to `output_dir` for
+    each of `casings`, and the intermediate files only to the directories
+    that are given. Returns the number of documents.
+    """
+    docs = iter_raw_docs(os.path.join(raw_root, split, "docs"), doc_ids)
+    keys = iter_keys(os.path.join(raw_root, split, "keys"), doc_ids)
+    if semiprocessed_dir is not None:
+        split_dir = os.path.join(semiprocessed_dir, split)
+        docs = tee_json(
+            docs, os.path.join(split_dir, f"{split}_docs.json"), SEMIPROCESSED_INDENT
+        )
+        keys = tee_json(
+            keys, os.path.join(split_dir, f"{split}_keys.json"), SEMIPROCESSED_INDENT
+        )
+
+    unlocatable_entity_mentions = {}
+    unlocatable_location_mentions = {}
+    processed = iter_preprocessed(
+        docs,
+        keys,
+        sentence_splitter,
+        unlocatable_entity_mentions,
+        unlocatable_location_mentions,
+    )
+    if processed_dir is not None:
+        processed = tee_json(
+            processed,
+            os.path.join(processed_dir, split, f"{split}.json"),
+            PROCESSED_INDENT,
+        )
+
+    num_docs = 0
+    if casings:
+        from preprocessing.processed_to_concrete import document_to_communication
+
+        writers = {}
+        for casing in casings:
+            os.makedirs(os.path.join(output_dir, casing), exist_ok=True)
+            writers[casing] = CommunicationArchiveWriter(
+                archive_path(os.path.join(output_dir, casing, split), options.format),
+                options,
+            )
+        try:
+            # every casing is converted from the same processed document
+            for doc_id, doc in processed:
+                doc = _as_document(doc_id, doc)
+                for casing, writer in writers.items():
+                    comm = document_to_communication(doc, casing == "lowercase")
+                    writer.write(comm, doc_id + ".concrete")
+                num_docs += 1
+        finally:
+            for writer in writers.values():
+                writer.close()
+    else:
+        for _ in processed:
+            num_docs += 1
+
+    if processed_dir is not None:
+        for name, mentions in [
+            ("entities", unlocatable_entity_mentions),
+            ("locations", unlocatable_location_mentions),
+        ]:
+            path = os.path.join(
+                processed_dir, split, f"{split}_unlocatable_{name}.json"
+            )
+            with open(path, "w") as f:
+                json.dump(mentions, f, indent=PROCESSED_INDENT)
+    return num_docs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=SPLITS,
+        default=SPLITS,
+        help="the splits to process",
+    )
+    parser.add_argument(
+        "--raw-root",
+        type=str,
+        default=RAW_DATA_ROOT,
+        help="directory containing the raw {split}/{docs,keys} files",
+    )
+    parser.add_argument(
+        "--doc-ids",
+        nargs="+",
+        default=None,
+        help="only process these documents",
+    )
+    parser.add_argument(
+        "--casings",
+        nargs="*",
+        choices=CASINGS,
+        default=CASINGS,
+        help="the Concrete versions to write; pass none to stop after preprocessing",
+    )
+    parser.add_argument(
+        "--sentence-splitter",
+        choices=list(SENTENCE_SPLITTERS),
+        default=DEFAULT_SENTENCE_SPLITTER,
+        help='sentence splitter backend; use "spacy" to reproduce the sentence splits in data/processed',
+    )
+    parser.add_argument(
+        "--semiprocessed-dir",
+        type=str,
+        default=None,
+        help="also write the semiprocessed files here (e.g. data/semiprocessed)",
+    )
+    parser.add_argument(
+        "--processed-dir",
+        type=str,
+        default=None,
+        help="also write the processed files here (e.g. data/processed)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=OUTPUT_DIR,
+        help="directory to which {lowercase,uppercase}/{split}.zip are written",
+    )
+    add_serialization_args(parser)
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    doc_ids = set(args.doc_ids) if args.doc_ids else None
+    with profiling(args):
+        for split in args.splits:
+            with PROFILER.section(f"split_{split}"):
+                num_docs = run_split(
+                    split,
+                    args.raw_root,
+                    args.casings,
+                    args.sentence_splitter,
+                    doc_ids,
+                    args.semiprocessed_dir,
+                    args.processed_dir,
+                    args.output_dir,
+                    ArchiveOptions.from_args(args),
+                )
+            print(f"Processed {num_docs} documents in split {split}")
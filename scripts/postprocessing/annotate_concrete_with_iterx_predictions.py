@@ -1,17 +1,33 @@
 import argparse
 import json
+import os
 import re
+import sys
 
 from cement.cement_document import CementDocument
 from collections import defaultdict
 from concrete import Argument
-from concrete.util import CommunicationReader, CommunicationWriterZip
 from concrete.validate import validate_communication
 from os import makedirs, PathLike
 from os.path import dirname
 from tqdm import tqdm
 from typing import *
 
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.concrete_io import (
+    DEFAULT_CHECKPOINT_EVERY,
+    ArchiveOptions,
+    CommunicationArchiveWriter,
+    add_checkpoint_args,
+    add_serialization_args,
+    infer_format,
+    read_communications,
+)
+from utils.profiling import PROFILER, add_profiling_args, profiling
+from utils.sharding import Shard, add_shard_args, shard_path, write_positions
+
 MUC_SLOT_FILLER = List[str]
 MUC_TEMPLATE = Dict[str, List[MUC_SLOT_FILLER]]
 
@@ -21,23 +37,39 @@ def annotate_concrete(
     concrete_output_archive: PathLike,
     model_predictions: PathLike,
     annotation_set: str,
+    options: ArchiveOptions = ArchiveOptions(),
+    shard: Optional[Shard] = None,
+    resume: bool = False,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
 ) -> None:
+    concrete_output_archive = shard_path(concrete_output_archive, shard)
     if dirname(concrete_output_archive) != "":
         makedirs(dirname(concrete_output_archive), exist_ok=True)
-    writer = CommunicationWriterZip(concrete_output_archive)
+    writer = CommunicationArchiveWriter(concrete_output_archive, options, resume)
+    if writer.completed:
+        print(
+            f"Resuming {concrete_output_archive} after {len(writer.completed)} documents"
+        )
     predictions_by_document: defaultdict[str, List[MUC_TEMPLATE]] = defaultdict(list)
     with open(model_predictions, "r") as f:
         for line in f:
-            prediction = json.loads(line)
+            with PROFILER.section("json_load"):
+                prediction = json.loads(line)
             doc_id = list(prediction.keys())[0]
             # each line contains all predictions for a
             # single document for templates of a single type
             templates = list(prediction.values())[0]
             predictions_by_document[doc_id] += templates
 
-    for comm, file_name in tqdm(
-        CommunicationReader(concrete_input_archive), desc="Processing..."
+    positions = []
+    for position, (comm, file_name) in enumerate(
+        tqdm(read_communications(concrete_input_archive), desc="Processing...")
     ):
+        if shard is not None and not shard.contains(comm.id):
+            continue
+        positions.append(position)
+        if comm.id in writer.completed:
+            continue
         cement_doc = CementDocument.from_communication(
             comm, annotation_set=annotation_set
         )
@@ -81,9 +113,14 @@ def annotate_concrete(
                 ].upper(),  # template type is always capitalized for no particularly good reason
                 arguments=template_fillers,
             )
-        validate_communication(cement_doc.comm)
+        with PROFILER.section("validate_communication"):
+            validate_communication(cement_doc.comm)
         writer.write(cement_doc.comm, comm.id)
+        if checkpoint_every and len(writer.names) % checkpoint_every == 0:
+            writer.checkpoint()
     writer.close()
+    if shard is not None:
+        write_positions(concrete_output_archive, positions, writer.names)
 
 
 if __name__ == "__main__":
@@ -91,12 +128,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "concrete_input_archive",
         type=str,
-        help="input .zip archive of Concrete Communication files; these should be communications annotated with SpanFinder predictions",
+        help="input archive (.zip, .tar.gz or directory) of Concrete Communication files; these should be communications annotated with SpanFinder predictions",
     )
     parser.add_argument(
         "concrete_output_archive",
         type=str,
-        help="output .zip archive of Concrete Communication files",
+        help="output archive of Concrete Communication files; unless --output-format is given, the format follows the extension",
     )
     parser.add_argument(
         "model_predictions",
@@ -109,10 +146,20 @@ if __name__ == "__main__":
         default="Span Finder",
         help="the Annotation Set associated with the SpanFinder annotations in the Concrete Communication files",
     )
+    add_serialization_args(parser)
+    add_checkpoint_args(parser)
+    add_shard_args(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
-    annotate_concrete(
-        args.concrete_input_archive,
-        args.concrete_output_archive,
-        args.model_predictions,
-        args.annotation_set,
-    )
+    options = ArchiveOptions.from_args(args, infer_format(args.concrete_output_archive))
+    with profiling(args):
+        annotate_concrete(
+            args.concrete_input_archive,
+            args.concrete_output_archive,
+            args.model_predictions,
+            args.annotation_set,
+            options,
+            args.shard,
+            args.resume,
+            args.checkpoint_every,
+        )
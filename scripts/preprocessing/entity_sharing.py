@@ -0,0 +1,283 @@
+"""
+Measures how entities are shared across the templates of a document,
+e.g. the same victim in two ATTACK templates. Within a document, two
+fillers of the entity slots (of any templates) are taken to be the same
+entity if they have a document mention or a string in common; entities
+are the connected components of that relation. incident_location is
+left out by default, as most templates of a document share a country.
+
+Everything is computed with SciPy sparse matrices over the whole split:
+
+    M  fillers x features   a filler's mention spans and strings
+    T  templates x entities  whether an entity fills a slot of a template
+    D  documents x templates which templates belong to a document
+
+M M^T links the fillers of an entity, T T^T counts the entities two
+templates share, and D T, restricted to the templates of an incident
+type, counts in how many of a document's templates of that type each
+entity occurs. The report, written to
+{split}/{split}_entity_sharing.json, gives
+
+- per slot, the share of fillers whose entity occurs in another template
+- per incident type, the share of templates sharing an entity with
+  another template of the document
+- per pair of incident types, the share of pairs of templates in the
+  same document that share an entity
+- the documents with several templates of the same incident type (see
+  --multi-same-type in scripts/visualize_annotations.py) and the
+  entities their templates of that type share
+
+Run from the project root:
+
+    python scripts/preprocessing/entity_sharing.py --splits dev test
+"""
+import argparse
+import json
+import numpy as np
+import os
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.data_model import (
+    PROCESSED_DATA_ROOT,
+    Document,
+    Filler,
+    iter_documents,
+    split_path,
+)
+from utils.profiling import PROFILER, add_profiling_args, profiling
+from visualize_annotations import ENTITY_KEYS
+
+LOCATION_SLOT = "incident_location"
+
+
+class SharingMatrices:
+    """The incidence matrices of a split, with the labels of their rows"""
+
+    def __init__(self, docs: Iterable[Document], slots: Container[str] = ENTITY_KEYS):
+        # imported here, as scipy.sparse takes a while to import
+        from scipy import sparse
+        from scipy.sparse.csgraph import connected_components
+
+        doc_ids, template_doc, template_types = [], [], []
+        filler_template, filler_slot = [], []
+        # (filler, feature) pairs, with features numbered per split
+        pairs_filler, pairs_feature = [], []
+        features = {}
+        for doc in docs:
+            d = len(doc_ids)
+            doc_ids.append(doc.doc_id)
+            for template in doc.templates:
+                t = len(template_doc)
+                template_doc.append(d)
+                template_types.append(template.incident_type)
+                for slot, value in template.items():
+                    if slot not in slots or not isinstance(value, (Filler, tuple)):
+                        continue
+                    for filler in template.fillers(slot):
+                        if filler.document_mentions is None:
+                            # a split that has not been processed
+                            continue
+                        f = len(filler_template)
+                        filler_template.append(t)
+                        filler_slot.append(slot)
+                        for start, end in filler.document_mentions:
+                            pairs_filler.append(f)
+                            pairs_feature.append(
+                                features.setdefault((d, start, end), len(features))
+                            )
+                        for s in filler.strings or filler.strings_lhs or ():
+                            pairs_filler.append(f)
+                            pairs_feature.append(
+                                features.setdefault((d, s), len(features))
+                            )
+        self.doc_ids = doc_ids
+        self.template_types = np.asarray(template_types, dtype=object)
+        self.filler_slots = np.asarray(filler_slot, dtype=object)
+        num_docs, num_templates = len(doc_ids), len(template_doc)
+        num_fillers = len(filler_template)
+        self.filler_template = np.asarray(filler_template, dtype=np.int64)
+
+        self.M = sparse.csr_matrix(
+            (np.ones(len(pairs_filler), dtype=np.int32), (pairs_filler, pairs_feature)),
+            shape=(num_fillers, len(features)),
+        )
+        # features are document-local, so entities never span documents
+        self.num_entities, self.filler_entity = connected_components(
+            self.M @ self.M.T, directed=False
+        )
+        T = sparse.csr_matrix(
+            (
+                np.ones(num_fillers, dtype=np.int32),
+                (self.filler_template, self.filler_entity),
+            ),
+            shape=(num_templates, self.num_entities),
+        )
+        # an entity filling several slots of a template counts once
+        T.data[:] = 1
+        self.T = T
+        self.D = sparse.csr_matrix(
+            (
+                np.ones(num_templates, dtype=np.int32),
+                (template_doc, np.arange(num_templates)),
+            ),
+            shape=(num_docs, num_templates),
+        )
+
+
+def _rates(totals: np.ndarray, shared: np.ndarray, labels: Sequence[str]) -> Dict:
+    return {
+        label: {
+            "total": int(total),
+            "shared": int(n),
+            "rate": round(n / total, 4) if total else None,
+        }
+        for label, total, n in zip(labels, totals.tolist(), shared.tolist())
+    }
+
+
+def sharing_report(m: SharingMatrices) -> Dict[str, Any]:
+    from scipy import sparse
+
+    # number of templates each entity occurs in
+    entity_templates = np.asarray(m.T.sum(axis=0)).ravel()
+    # number of entities each pair of templates shares
+    S = sparse.triu(m.T @ m.T.T, k=1).tocoo()
+    # every pair of templates of the same document
+    P = sparse.triu(m.D.T @ m.D, k=1).tocoo()
+
+    slots, filler_slot = np.unique(m.filler_slots.astype(str), return_inverse=True)
+    filler_shared = entity_templates[m.filler_entity] > 1
+    types, template_type = np.unique(m.template_types.astype(str), return_inverse=True)
+    template_shares = np.zeros(len(template_type), dtype=bool)
+    template_shares[S.row] = True
+    template_shares[S.col] = True
+
+    # unordered pairs of incident types, as codes i * len(types) + j with i <= j
+    def pair_codes(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        a, b = template_type[rows], template_type[cols]
+        return np.minimum(a, b) * len(types) + np.maximum(a, b)
+
+    num_pairs = len(types) ** 2
+    pair_totals = np.bincount(pair_codes(P.row, P.col), minlength=num_pairs)
+    pair_shared = np.bincount(pair_codes(S.row, S.col), minlength=num_pairs)
+    observed = np.flatnonzero(pair_totals)
+    # incident types such as "BOMBING / ATTACK" have slashes of their own
+    pair_labels = [
+        f"{types[c // len(types)]} & {types[c % len(types)]}" for c in observed
+    ]
+
+    multi_same_type = []
+    for i, incident_type in enumerate(types.tolist()):
+        of_type = sparse.diags((template_type == i).astype(np.int32), dtype=np.int32)
+        # documents x entities: in how many templates of this type an entity occurs
+        E = (m.D @ of_type @ m.T).tocsr()
+        counts = np.asarray((m.D @ of_type).sum(axis=1)).ravel()
+        shared = np.asarray((E > 1).sum(axis=1)).ravel()
+        for d in np.flatnonzero(counts > 1).tolist():
+            multi_same_type.append(
+                {
+                    "doc_id": m.doc_ids[d],
+                    "incident_type": incident_type,
+                    "templates": int(counts[d]),
+                    "shared_entities": int(shared[d]),
+                }
+            )
+    multi_same_type.sort(key=lambda x: (x["doc_id"], x["incident_type"]))
+
+    return {
+        "documents": len(m.doc_ids),
+        "templates": len(template_type),
+        "entities": int(m.num_entities),
+        "shared_entities": int(np.count_nonzero(entity_templates > 1)),
+        "slots": _rates(
+            np.bincount(filler_slot, minlength=len(slots)),
+            np.bincount(filler_slot[filler_shared], minlength=len(slots)),
+            slots.tolist(),
+        ),
+        "incident_types": _rates(
+            np.bincount(template_type, minlength=len(types)),
+            np.bincount(template_type[template_shares], minlength=len(types)),
+            types.tolist(),
+        ),
+        "incident_type_pairs": _rates(
+            pair_totals[observed], pair_shared[observed], pair_labels
+        ),
+        "multi_same_type": multi_same_type,
+    }
+
+
+def print_summary(split: str, report: Dict[str, Any]) -> None:
+    print(
+        f"Split {split}: {report['shared_entities']} of {report['entities']} entities "
+        f"occur in more than one of {report['templates']} templates"
+    )
+    for key, heading in [
+        ("slots", "fillers whose entity occurs in another template, by slot"),
+        ("incident_types", "templates sharing an entity, by incident type"),
+        ("incident_type_pairs", "pairs of templates sharing an entity"),
+    ]:
+        print(f"  {heading}:")
+        for label, r in sorted(report[key].items(), key=lambda x: -x[1]["total"]):
+            print(f"    {label:<44} {r['shared']:>5} / {r['total']:<5} {r['rate']:.2%}")
+    docs = {x["doc_id"] for x in report["multi_same_type"]}
+    sharing = {x["doc_id"] for x in report["multi_same_type"] if x["shared_entities"]}
+    print(
+        f"  {len(docs)} documents with several templates of the same incident type, "
+        f"{len(sharing)} of which share entities between them"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=["train", "dev", "test"],
+        default=["train", "dev", "test"],
+        help="the splits to analyze",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed {split}/{split}.json files",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory to which {split}/{split}_entity_sharing.json are written",
+    )
+    parser.add_argument(
+        "--include-locations",
+        action="store_true",
+        help=f"treat the fillers of {LOCATION_SLOT} as entities too",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    slots = set(ENTITY_KEYS)
+    if args.include_locations:
+        slots.add(LOCATION_SLOT)
+
+    with profiling(args):
+        for split in args.splits:
+            path = split_path(split, args.data_dir)
+            if not os.path.exists(path):
+                print(f"WARNING: {path} not found; skipping split {split}")
+                continue
+            with PROFILER.section("incidence_matrices"):
+                matrices = SharingMatrices(iter_documents(path), slots)
+            with PROFILER.section("entity_sharing"):
+                report = sharing_report(matrices)
+            print_summary(split, report)
+            split_dir = os.path.join(args.output_dir, split)
+            os.makedirs(split_dir, exist_ok=True)
+            with open(
+                os.path.join(split_dir, f"{split}_entity_sharing.json"), "w"
+            ) as f:
+                json.dump(report, f, indent=4)
@@ -0,0 +1,234 @@
+"""
+QA report of the document mentions of different fillers that coincide,
+nest or overlap in the text, e.g. a hum_tgt_name inside a
+hum_tgt_description, or a perp_individual_id inside a
+perp_organization_id. Such mentions break the assumption that every
+entity has a single mention of its own (see the singleton entities of
+scripts/postprocessing/annotate_concrete_with_iterx_predictions.py) and
+give SpanFinder overlapping spans to learn.
+
+The mentions of a split are sorted by (document, start, -end), so that
+the mentions overlapping a mention are the ones following it up to the
+first that starts at or after its end, which np.searchsorted finds for all
+mentions at once. Every pair of mentions of different fillers (of the
+same or different templates) is then classified as
+
+- "duplicate": the same span
+- "nested": one span contains the other
+- "overlapping": the spans cross
+
+and counted by slot pair: (outer, inner) for nested mentions and
+unordered pairs otherwise. The counts of each split are written to
+{split}/{split}_mention_overlaps.json, with a few examples of each slot
+pair, and printed side by side. Run from the project root:
+
+    python scripts/preprocessing/mention_overlaps.py --splits dev test
+"""
+import argparse
+import json
+import numpy as np
+import os
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.data_model import (
+    PROCESSED_DATA_ROOT,
+    Document,
+    Filler,
+    iter_documents,
+    split_path,
+)
+from utils.profiling import PROFILER, add_profiling_args, profiling
+
+RELATIONS = ["duplicate", "nested", "overlapping"]
+DUPLICATE, NESTED, OVERLAPPING = range(len(RELATIONS))
+
+
+class MentionTable:
+    """The document mentions of a split, one row per mention"""
+
+    def __init__(self, docs: Iterable[Document]):
+        doc_ids, texts, slots = [], [], {}
+        columns = {name: [] for name in ["doc", "start", "end", "slot", "filler"]}
+        num_fillers = 0
+        for doc in docs:
+            d = len(doc_ids)
+            doc_ids.append(doc.doc_id)
+            texts.append(doc.text)
+            for template in doc.templates:
+                for slot, value in template.items():
+                    if not isinstance(value, (Filler, tuple)):
+                        continue
+                    for filler in template.fillers(slot):
+                        for start, end in filler.document_mentions or ():
+                            columns["doc"].append(d)
+                            columns["start"].append(start)
+                            columns["end"].append(end)
+                            columns["slot"].append(slots.setdefault(slot, len(slots)))
+                            columns["filler"].append(num_fillers)
+                        num_fillers += 1
+        self.doc_ids = doc_ids
+        self.texts = texts
+        # number the slots alphabetically, so that unordered pairs are
+        # labeled the same way in every split
+        self.slots = sorted(slots)
+        renumber = np.empty(len(slots), dtype=np.int64)
+        renumber[list(slots.values())] = [self.slots.index(s) for s in slots]
+        arrays = {name: np.asarray(v, dtype=np.int64) for name, v in columns.items()}
+        arrays["slot"] = renumber[arrays["slot"]]
+        order = np.lexsort((-arrays["end"], arrays["start"], arrays["doc"]))
+        for name, values in arrays.items():
+            setattr(self, name, values[order])
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The (i, j, relation) of every pair of overlapping mentions of
+        different fillers, with i the earlier (and, if nested, outer) one
+        """
+        n = len(self)
+        # a key that orders mentions by document, then position
+        stride = int(self.end.max(initial=0)) + 1
+        start_keys = self.doc * stride + self.start
+        # the mentions after i that start before it ends overlap it
+        stops = np.searchsorted(start_keys, self.doc * stride + self.end, "left")
+        counts = np.maximum(stops - np.arange(n) - 1, 0)
+        i = np.repeat(np.arange(n), counts)
+        # j runs from i + 1 to stops[i] - 1 within each run of i
+        run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        j = i + 1 + np.arange(len(i)) - run_starts
+        keep = self.filler[i] != self.filler[j]
+        i, j = i[keep], j[keep]
+        relation = np.full(len(i), OVERLAPPING, dtype=np.int64)
+        # sorting by -end puts the longer of two mentions with the same
+        # start first, so j is within i if it ends no later
+        relation[self.end[j] <= self.end[i]] = NESTED
+        relation[(self.start[j] == self.start[i]) & (self.end[j] == self.end[i])] = (
+            DUPLICATE
+        )
+        return i, j, relation
+
+
+def overlap_report(table: MentionTable, num_examples: int = 3) -> Dict[str, Any]:
+    i, j, relation = table.pairs()
+    num_slots = len(table.slots)
+    slot_i, slot_j = table.slot[i], table.slot[j]
+    # nested pairs keep their (outer, inner) order; the others are unordered
+    ordered = relation == NESTED
+    a = np.where(ordered, slot_i, np.minimum(slot_i, slot_j))
+    b = np.where(ordered, slot_j, np.maximum(slot_i, slot_j))
+    codes = (relation * num_slots + a) * num_slots + b
+    counts = np.bincount(codes, minlength=len(RELATIONS) * num_slots**2)
+
+    report = {
+        "documents": len(table.doc_ids),
+        "mentions": len(table),
+        "pairs": {
+            r: int(np.count_nonzero(relation == k)) for k, r in enumerate(RELATIONS)
+        },
+        "slot_pairs": {r: {} for r in RELATIONS},
+    }
+    for code in np.flatnonzero(counts).tolist():
+        k, rest = divmod(code, num_slots**2)
+        outer, inner = divmod(rest, num_slots)
+        separator = " in " if k == NESTED else " & "
+        # for nested pairs, the inner slot first: "hum_tgt_name in hum_tgt_description"
+        first, second = (inner, outer) if k == NESTED else (outer, inner)
+        examples = []
+        for p in np.flatnonzero(codes == code)[:num_examples].tolist():
+            text = table.texts[table.doc[i[p]]]
+            examples.append(
+                {
+                    "doc_id": table.doc_ids[table.doc[i[p]]],
+                    "spans": [
+                        [int(table.start[m]), int(table.end[m])] for m in (i[p], j[p])
+                    ],
+                    "strings": [
+                        text[table.start[m] : table.end[m]] for m in (i[p], j[p])
+                    ],
+                }
+            )
+        report["slot_pairs"][RELATIONS[k]][
+            table.slots[first] + separator + table.slots[second]
+        ] = {"count": int(counts[code]), "examples": examples}
+    return report
+
+
+def format_reports(reports: Dict[str, Dict[str, Any]]) -> str:
+    splits = list(reports)
+    lines = []
+    for relation in RELATIONS:
+        slot_pairs = {}
+        for split, report in reports.items():
+            for label, r in report["slot_pairs"][relation].items():
+                slot_pairs.setdefault(label, {})[split] = r["count"]
+        lines.append(f"{relation:<56}" + "".join(f"{split:>8}" for split in splits))
+        for label, counts in sorted(
+            slot_pairs.items(), key=lambda x: (-sum(x[1].values()), x[0])
+        ):
+            lines.append(
+                f"  {label:<54}"
+                + "".join(f"{counts.get(split, 0):>8}" for split in splits)
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=["train", "dev", "test"],
+        default=["train", "dev", "test"],
+        help="the splits to check",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed {split}/{split}.json files",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory to which {split}/{split}_mention_overlaps.json are written",
+    )
+    parser.add_argument(
+        "--examples",
+        type=int,
+        default=3,
+        help="number of examples to keep per relation and slot pair",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    reports = {}
+    with profiling(args):
+        for split in args.splits:
+            path = split_path(split, args.data_dir)
+            if not os.path.exists(path):
+                print(f"WARNING: {path} not found; skipping split {split}")
+                continue
+            with PROFILER.section("mention_table"):
+                table = MentionTable(iter_documents(path))
+            with PROFILER.section("overlap_sweep"):
+                reports[split] = overlap_report(table, args.examples)
+            split_dir = os.path.join(args.output_dir, split)
+            os.makedirs(split_dir, exist_ok=True)
+            with open(
+                os.path.join(split_dir, f"{split}_mention_overlaps.json"), "w"
+            ) as f:
+                json.dump(reports[split], f, indent=4)
+    for split, report in reports.items():
+        print(
+            f"Split {split}: {report['mentions']} mentions, "
+            + ", ".join(f"{n} {r} pairs" for r, n in report["pairs"].items())
+        )
+    print(format_reports(reports))
@@ -1,18 +1,41 @@
 """
 process the train/dev/test file
 """
+import argparse
 import json
+import numpy as np
 import os
 import re
+import sys
 
-from allennlp.data.tokenizers.sentence_splitter import SpacySentenceSplitter
 from collections import OrderedDict
 from tqdm import tqdm
 from typing import *
 
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from preprocessing.sentence_splitters import (
+    SENTENCE_SPLITTERS,
+    SentenceSplitter,
+    get_sentence_splitter,
+)
+from utils.columnar import columnar_path, write_columns
+from utils.profiling import PROFILER, add_profiling_args, profiling
+from utils.sharding import (
+    Shard,
+    add_shard_args,
+    select_shard,
+    shard_path,
+    write_positions,
+)
+from utils.spans import SpanIndex
+
 
 DATA_DIR = "data/semiprocessed/"
 OUTPUT_DIR = "data/processed/"
+# NOTE: the sentence splits in data/processed were produced with "spacy"
+DEFAULT_SENTENCE_SPLITTER = "regex"
 
 ENTITY_KEYS = """
 perp_individual_id
@@ -64,177 +87,327 @@ def clean_muc_text(document: str) -> List[str]:
     return cleaned_sections
 
 
-def preprocess(split: str) -> Tuple[Dict, Dict, Dict]:
-    doc_file = os.path.join(DATA_DIR, split, f"{split}_docs.json")
-    keys_file = os.path.join(DATA_DIR, split, f"{split}_keys.json")
+def load_resources(sentence_splitter: str = DEFAULT_SENTENCE_SPLITTER) -> None:
+    get_sentence_splitter(sentence_splitter)
 
-    # get document text
-    with open(doc_file) as f_doc:
-        doc_dict = {k: clean_muc_text(v["text"]) for k, v in json.load(f_doc).items()}
 
-    sentence_splitter = SpacySentenceSplitter()
+def locate_mention(
+    mention: str,
+    document_text: str,
+    sentence_idxs: List[Tuple[int, int]],
+    sentence_index: SpanIndex,
+) -> Tuple[List[Tuple[int, int]], List[Tuple[int, Tuple[int, int]]]]:
+    """
+    Returns the document-level spans of all occurrences of `mention` and,
+    for those that lie within a single sentence, (sentence index, span
+    within the sentence) pairs
+    """
+    document_spans = [
+        match.span() for match in re.finditer(re.escape(mention), document_text)
+    ]
+    if not document_spans:
+        return document_spans, []
+    starts, ends = np.array(document_spans).T
+    sentence_spans = []
+    for (start, end), i in zip(
+        document_spans, sentence_index.containing(starts, ends).tolist()
+    ):
+        if i >= 0:
+            sentence_start = sentence_idxs[i][0]
+            sentence_spans.append((i, (start - sentence_start, end - sentence_start)))
+    return document_spans, sentence_spans
 
-    # read keys (annotations) from files
-    output = {}
-    with open(keys_file) as f_keys:
-        all_keys = json.load(f_keys)
 
-    # augment annotations with sentence- and document-level index information
-    unlocatable_entity_mentions = {}
-    unlocatable_location_mentions = {}
-    for document, document_sections in tqdm(
-        doc_dict.items(), desc=f'Processing split "{split}"'
+def preprocess_document(
+    document: str,
+    document_sections: List[str],
+    templates: List[Dict[str, Any]],
+    splitter: SentenceSplitter,
+    unlocatable_entity_mentions: Dict[str, Any],
+    unlocatable_location_mentions: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Returns the processed entry for one document, given its cleaned
+    sections (see clean_muc_text) and its templates from the keys, which
+    are augmented in place with mention offsets. Mentions that cannot be
+    found in the text are recorded in the two `unlocatable_*` dicts.
+    """
+    # postprocess document sections
+    document_text = " ".join(document_sections)
+    section_idxs = []
+    for section in document_sections:
+        start_idx = section_idxs[-1][1] + 1 if section_idxs else 0
+        end_idx = start_idx + len(section)
+        section_idxs.append((start_idx, end_idx))
+
+    # split document sections into sentences
+    # NOTE: strangely, the SpaCy sentence splitter works terribly on
+    #       text in all caps, which is why the "spacy" backend
+    #       lowercases the text before splitting it
+    sentence_idxs = []
+    with PROFILER.section("sentence_splitting"):
+        section_sentence_spans = splitter.split_all(document_sections)
+    for (section_start_idx, _), sentence_spans in zip(
+        section_idxs, section_sentence_spans
     ):
+        for start_idx_within_section, end_idx_within_section in sentence_spans:
+            start_idx = section_start_idx + start_idx_within_section
+            end_idx = section_start_idx + end_idx_within_section
+            sentence_idxs.append((start_idx, end_idx))
+
+    sentence_index = SpanIndex(sentence_idxs)
+    located_mentions = {}
+
+    # create augmented entry for this document
+    output = {
+        "text": document_text,
+        "sections": section_idxs,
+        "sentences": sentence_idxs,
+        "templates": [],
+    }
 
-        # postprocess document sections
-        document_text = " ".join(document_sections)
-        section_idxs = []
-        for section in document_sections:
-            start_idx = section_idxs[-1][1] + 1 if section_idxs else 0
-            end_idx = start_idx + len(section)
-            section_idxs.append((start_idx, end_idx))
-
-        # split document sections into sentences
-        # NOTE: strangely, the SpaCy sentence splitter works terribly on
-        #       text in all caps, which is why we lowercase the text here
-        sentence_idxs = []
-        for ((section_start_idx, _), section_text) in zip(section_idxs, document_sections):
-            lowercase_section_text = section_text.lower()
-            sentence_idx_offset = 0
-            for sentence in sentence_splitter.split_sentences(lowercase_section_text):
-                start_idx_within_section = lowercase_section_text.index(sentence, sentence_idx_offset)
-                start_idx = section_start_idx + start_idx_within_section
-                end_idx = start_idx + len(sentence)
-                sentence_idxs.append((start_idx, end_idx))
-                sentence_idx_offset = start_idx_within_section + len(sentence)
-
-        # create augmented entry for this document
-        output[document] = {
-            "text": document_text,
-            "sections": section_idxs,
-            "sentences": sentence_idxs,
-            "templates": [],
-        }
-
-        # augment templates with sentence- and document-level index information
-        templates = all_keys.get(document, [])
-        mentions_to_remove = MENTIONS_TO_REMOVE.get(document, [])
-        for template in templates:
-            # skip empty templates
-            if template["message_template"] == "*":
+    # augment templates with sentence- and document-level index information
+    mentions_to_remove = MENTIONS_TO_REMOVE.get(document, [])
+    for template in templates:
+        # skip empty templates
+        if template["message_template"] == "*":
+            continue
+
+        # we only care about the slots with entity fillers
+        # we also ignore here slots that describe features of those
+        # of those entities, like 'hum_tgt_foreign_nation' or 'phys_tgt_number'
+        for slot in ENTITY_KEYS:
+            if slot not in template or not template[slot]:
                 continue
+            fillers = template[slot]
 
-            # we only care about the slots with entity fillers
-            # we also ignore here slots that describe features of those
-            # of those entities, like 'hum_tgt_foreign_nation' or 'phys_tgt_number'
-            for slot in ENTITY_KEYS:
-                if slot not in template or not template[slot]:
-                    continue
-                fillers = template[slot]
-
-                # locate mentions of each filler in the document and in each sentence
-                for filler in fillers:
-                    mentions = filler.get("strings")
-                    mention_key = "strings"
-                    if mentions is None:
-                        if slot == "incident_location":
-                            mentions = filler["strings_lhs"]
-                            mention_key = "strings_lhs"
-                        elif slot == "hum_tgt_description":
-                            # colon clause mentions in the hum_tgt_description slot
-                            # are already covered in the hum_tgt_name slot
-                            continue
-                        else:
-                            raise ValueError(
-                                f"Found no mentions for filler of the {slot} slot in document {document}."
-                            )
+            # locate mentions of each filler in the document and in each sentence
+            for filler in fillers:
+                mentions = filler.get("strings")
+                mention_key = "strings"
+                if mentions is None:
+                    if slot == "incident_location":
+                        mentions = filler["strings_lhs"]
+                        mention_key = "strings_lhs"
+                    elif slot == "hum_tgt_description":
+                        # colon clause mentions in the hum_tgt_description slot
+                        # are already covered in the hum_tgt_name slot
+                        continue
+                    else:
+                        raise ValueError(
+                            f"Found no mentions for filler of the {slot} slot in document {document}."
+                        )
+
+                if mentions_to_remove:
+                    mentions = [m for m in mentions if m not in MENTIONS_TO_REMOVE]
+                filler["document_mentions"] = []
+                filler["sentence_mentions"] = OrderedDict()
+                for m in mentions:
+                    m = MANUAL_FIXES.get(m, m)
+                    m = m.replace("[", "(").replace("]", ")")
+                    try:
+                        with PROFILER.section("mention_location"):
+                            # mentions often recur across the fillers of a document
+                            if m not in located_mentions:
+                                located_mentions[m] = locate_mention(
+                                    m, document_text, sentence_idxs, sentence_index
+                                )
+                            mention_document_idxs, mention_sentence_idxs = located_mentions[m]
+                    except:
+                        print(
+                            f'WARNING: error while searching for mention "{m}" in document "{document}"'
+                        )
+                        continue
 
-                    if mentions_to_remove:
-                        mentions = [m for m in mentions if m not in MENTIONS_TO_REMOVE]
-                    filler["document_mentions"] = []
-                    filler["sentence_mentions"] = OrderedDict()
-                    for m in mentions:
-                        m = MANUAL_FIXES.get(m, m)
-                        m = m.replace("[", "(").replace("]", ")")
-                        try:
-                            mention_document_idxs = [
-                                match.span()
-                                for match in re.finditer(re.escape(m), document_text)
-                            ]
-                        except:
+                    if mention_document_idxs:
+                        filler["document_mentions"].extend(mention_document_idxs)
+                        for i, span in mention_sentence_idxs:
+                            if i not in filler["sentence_mentions"]:
+                                filler["sentence_mentions"][i] = []
+                            filler["sentence_mentions"][i].append(span)
+                        total_sentence_mentions = len(mention_sentence_idxs)
+                        if total_sentence_mentions != len(mention_document_idxs):
                             print(
-                                f'WARNING: error while searching for mention "{m}" in document "{document}"'
+                                f"WARNING: number of document-level mentions ({len(mention_document_idxs)}) does not match "
+                                + f'number of sentence-level mentions ({total_sentence_mentions}) for mention "{m}" in document "{document}"'
                             )
-                            continue
-
-                        if mention_document_idxs:
-                            filler["document_mentions"].extend(mention_document_idxs)
-                            total_sentence_mentions = 0
-                            for i, (sent_start, sent_end) in enumerate(sentence_idxs):
-                                sentence = document_text[sent_start:sent_end]
-                                mention_sentence_idxs = [
-                                    match.span()
-                                    for match in re.finditer(re.escape(m), sentence)
-                                ]
-                                total_sentence_mentions += len(mention_sentence_idxs)
-                                if mention_sentence_idxs:
-                                    if i not in filler["sentence_mentions"]:
-                                        filler["sentence_mentions"][i] = []
-                                    filler["sentence_mentions"][i].extend(
-                                        mention_sentence_idxs
-                                    )
-                            if total_sentence_mentions != len(mention_document_idxs):
-                                print(
-                                    f"WARNING: number of document-level mentions ({len(mention_document_idxs)}) does not match "
-                                    + f'number of sentence-level mentions ({total_sentence_mentions}) for mention "{m}" in document "{document}"'
-                                )
 
+                    else:
+                        if slot == "incident_location":
+                            if document not in unlocatable_location_mentions:
+                                unlocatable_location_mentions[document] = set()
+                            unlocatable_location_mentions[document].add(m)
                         else:
-                            if slot == "incident_location":
-                                if document not in unlocatable_location_mentions:
-                                    unlocatable_location_mentions[document] = set()
-                                unlocatable_location_mentions[document].add(m)
-                            else:
-                                if document not in unlocatable_entity_mentions:
-                                    unlocatable_entity_mentions[document] = set()
-                                unlocatable_entity_mentions[document].add(m)
-                        filler[mention_key] = mentions
-            output[document]["templates"].append(template)
-
-        if unlocatable_entity_mentions.get(document):
-            unlocatable_entity_mentions[document] = sorted(
-                unlocatable_entity_mentions[document]
-            )
+                            if document not in unlocatable_entity_mentions:
+                                unlocatable_entity_mentions[document] = set()
+                            unlocatable_entity_mentions[document].add(m)
+                    filler[mention_key] = mentions
+        output["templates"].append(template)
 
-        if unlocatable_location_mentions.get(document):
-            unlocatable_location_mentions[document] = sorted(
-                unlocatable_location_mentions[document]
-            )
+    if unlocatable_entity_mentions.get(document):
+        unlocatable_entity_mentions[document] = sorted(
+            unlocatable_entity_mentions[document]
+        )
 
-    return output, unlocatable_entity_mentions, unlocatable_location_mentions
+    if unlocatable_location_mentions.get(document):
+        unlocatable_location_mentions[document] = sorted(
+            unlocatable_location_mentions[document]
+        )
 
+    return output
 
-if __name__ == "__main__":
-    for split in ["train", "dev", "test"]:
-        (
-            preprocessed_data,
+
+def iter_preprocess(
+    docs: Iterable[Tuple[str, Dict[str, Any]]],
+    all_keys: Mapping[str, List[Dict[str, Any]]],
+    sentence_splitter: str = DEFAULT_SENTENCE_SPLITTER,
+    unlocatable_entity_mentions: Optional[Dict[str, Any]] = None,
+    unlocatable_location_mentions: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yields (document ID, processed document) pairs for the given
+    semiprocessed (document ID, document) pairs, one document at a time
+    """
+    splitter = get_sentence_splitter(sentence_splitter)
+    if unlocatable_entity_mentions is None:
+        unlocatable_entity_mentions = {}
+    if unlocatable_location_mentions is None:
+        unlocatable_location_mentions = {}
+    for document, doc in docs:
+        yield document, preprocess_document(
+            document,
+            clean_muc_text(doc["text"]),
+            all_keys.get(document, []),
+            splitter,
             unlocatable_entity_mentions,
             unlocatable_location_mentions,
-        ) = preprocess(split)
-        split_dir = os.path.join(OUTPUT_DIR, split)
-        os.makedirs(split_dir, exist_ok=True)
-        processed_file = os.path.join(split_dir, f"{split}.json")
-        print("Unlocatable entity mentions:")
-        print(json.dumps(unlocatable_entity_mentions, indent=4))
-        with open(processed_file, "w") as f_processed:
-            json.dump(preprocessed_data, f_processed, indent=4)
-        unlocatable_entity_mentions_file = os.path.join(
-            split_dir, f"{split}_unlocatable_entities.json"
         )
-        with open(unlocatable_entity_mentions_file, "w") as f_unlocatable_entities:
-            json.dump(unlocatable_entity_mentions, f_unlocatable_entities, indent=4)
-        unlocatable_location_mentions_file = os.path.join(
-            split_dir, f"{split}_unlocatable_locations.json"
+
+
+def preprocess(
+    split: str,
+    data_dir: str = DATA_DIR,
+    sentence_splitter: str = DEFAULT_SENTENCE_SPLITTER,
+    shard: Optional[Shard] = None,
+    positions: Optional[List[int]] = None,
+) -> Tuple[Dict, Dict, Dict]:
+    """
+    Preprocesses a split, or only the documents of `shard`, in which case
+    their positions among all documents are appended to `positions`
+    """
+    doc_file = os.path.join(data_dir, split, f"{split}_docs.json")
+    keys_file = os.path.join(data_dir, split, f"{split}_keys.json")
+
+    # get document text
+    with open(doc_file) as f_doc, PROFILER.section("json_load"):
+        docs = json.load(f_doc)
+
+    # read keys (annotations) from files
+    with open(keys_file) as f_keys, PROFILER.section("json_load"):
+        all_keys = json.load(f_keys)
+
+    # augment annotations with sentence- and document-level index information
+    unlocatable_entity_mentions = {}
+    unlocatable_location_mentions = {}
+    num_docs = len(docs)
+    if shard is not None:
+        num_docs = sum(shard.contains(doc_id) for doc_id in docs)
+    output = dict(
+        tqdm(
+            iter_preprocess(
+                select_shard(docs.items(), shard, positions),
+                all_keys,
+                sentence_splitter,
+                unlocatable_entity_mentions,
+                unlocatable_location_mentions,
+            ),
+            total=num_docs,
+            desc=f'Processing split "{split}"',
         )
-        with open(unlocatable_location_mentions_file, "w") as f_unlocatable_locations:
-            json.dump(unlocatable_location_mentions, f_unlocatable_locations, indent=4)
+    )
+    return output, unlocatable_entity_mentions, unlocatable_location_mentions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=["train", "dev", "test"],
+        default=["train", "dev", "test"],
+        help="the splits to preprocess",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=DATA_DIR,
+        help="directory containing the semiprocessed {split}/{split}_{docs,keys}.json files",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=OUTPUT_DIR,
+        help="directory to which the processed splits are written",
+    )
+    parser.add_argument(
+        "--sentence-splitter",
+        choices=list(SENTENCE_SPLITTERS),
+        default=DEFAULT_SENTENCE_SPLITTER,
+        help='sentence splitter backend; use "spacy" to reproduce the sentence splits in data/processed',
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="also write each split in the columnar .npz format (see scripts/utils/columnar.py)",
+    )
+    add_shard_args(parser)
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    if args.columnar and args.shard is not None:
+        parser.error(
+            "--columnar cannot be combined with --shard; convert the merged split with scripts/utils/columnar.py"
+        )
+    with profiling(args):
+        for split in args.splits:
+            positions = []
+            (
+                preprocessed_data,
+                unlocatable_entity_mentions,
+                unlocatable_location_mentions,
+            ) = preprocess(
+                split, args.data_dir, args.sentence_splitter, args.shard, positions
+            )
+            split_dir = os.path.join(args.output_dir, split)
+            os.makedirs(split_dir, exist_ok=True)
+            processed_file = shard_path(
+                os.path.join(split_dir, f"{split}.json"), args.shard
+            )
+            print("Unlocatable entity mentions:")
+            print(json.dumps(unlocatable_entity_mentions, indent=4))
+            with open(processed_file, "w") as f_processed, PROFILER.section(
+                "json_dump"
+            ):
+                json.dump(preprocessed_data, f_processed, indent=4)
+            if args.columnar:
+                write_columns(preprocessed_data, columnar_path(split, args.output_dir))
+            unlocatable_entity_mentions_file = shard_path(
+                os.path.join(split_dir, f"{split}_unlocatable_entities.json"),
+                args.shard,
+            )
+            with open(unlocatable_entity_mentions_file, "w") as f_unlocatable_entities:
+                json.dump(unlocatable_entity_mentions, f_unlocatable_entities, indent=4)
+            unlocatable_location_mentions_file = shard_path(
+                os.path.join(split_dir, f"{split}_unlocatable_locations.json"),
+                args.shard,
+            )
+            with open(unlocatable_location_mentions_file, "w") as f_unlocatable_locations:
+                json.dump(unlocatable_location_mentions, f_unlocatable_locations, indent=4)
+            if args.shard is not None:
+                # the reports are keyed by (a subset of) the same documents
+                doc_positions = dict(zip(preprocessed_data, positions))
+                for path, output in [
+                    (processed_file, preprocessed_data),
+                    (unlocatable_entity_mentions_file, unlocatable_entity_mentions),
+                    (unlocatable_location_mentions_file, unlocatable_location_mentions),
+                ]:
+                    write_positions(path, [doc_positions[doc_id] for doc_id in output])
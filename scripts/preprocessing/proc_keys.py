@@ -7,16 +7,28 @@ how outputs are written to JSON files.
 import os
 import re
 import json
+import sys
 from codecs import decode
 from collections import defaultdict
+from functools import lru_cache
+from typing import *
 
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.profiling import PROFILER, add_profiling_args, profiling
 
+
+@lru_cache(maxsize=None)
 def cleankey(keystr):
     return re.sub(r"[^A-Z]+", "_", keystr).strip("_").lower()
 
 
+DOCID_SUFFIX_RE = re.compile(r"\s*\(.*$")
+
+
 def clean_docid(value):
-    return re.sub(r"\s*\(.*$", "", value)
+    return DOCID_SUFFIX_RE.sub("", value)
 
 
 ALL_KEYS = """
@@ -49,8 +61,6 @@ HUM TGT: TOTAL NUMBER
     "\n"
 )
 
-LOCATION_RE = r"([\w ]+)(\(\w+ ?\w*\))*"
-
 ALL_KEYS = set(cleankey(k) for k in ALL_KEYS)
 
 NON_LIST_VALUED_KEYS = """
@@ -132,129 +142,347 @@ assert SELECTED_KEYS <= ALL_KEYS
 
 cur_docid = None
 
+# these slots have set-fill values on the left-hand side of colon clauses
+# (or as their only value), which are checked instead of unquoted
+SET_FILL_STRING_SLOTS = {
+    "hum_tgt_effect_of_incident",
+    "phys_tgt_effect_of_incident",
+    "incident_stage_of_execution",
+    "perp_incident_category",
+    "perp_organization_confidence",
+}
+
+# slots whose values are legitimately written without quotes
+UNQUOTED_SLOTS = {
+    "incident_date",
+    "incident_stage_of_execution",
+    "perp_incident_category",
+    "perp_organization_confidence",
+}
+
+
+class KeyFileError(ValueError):
+    """A malformed entry in a MUC key file"""
+
+    def __init__(self, message, path=None, line_num=None, line=None):
+        self.message = message
+        self.path = path
+        self.line_num = line_num
+        self.line = line
+        location = ""
+        if path is not None:
+            location = f"{path}:{line_num}: " if line_num is not None else f"{path}: "
+        detail = f"\n    {line.strip()}" if line is not None else ""
+        super().__init__(f"{location}{message}{detail}")
+
+    def at(self, path, line_num, line=None):
+        """Returns a copy of this error located at the given key file line"""
+        return KeyFileError(self.message, path, line_num, line)
+
 
 def warning(s):
     global cur_docid
     print(f"WARNING docid={cur_docid} | {s}")
 
 
-def yield_keyvals(chunk):
+COMMENT_RE = re.compile(r"^\s*;")
+
+
+def yield_keyvals(lines):
     """
-    Processes the raw MUC "key file" format.  Parses one entry ("chunk").
-    Yields a sequence of (key,value) pairs.
+    Processes the raw MUC "key file" format.  Parses one entry, given as a
+    list of (path, line number, line) triples.
+    Yields a sequence of (key, value, (path, line number)) triples.
     A single key can be repeated many times.
     This function cleans up key names, but passes the values through as-is.
     """
     curkey = None
-    for line in chunk.split("\n"):
+    for path, line_num, line in lines:
         if line.startswith(";"):
-            yield "comment", line
+            yield "comment", line, (path, line_num)
             continue
         middle = 33  ## Different in dev vs test files... this is the minimum size to get all keys.
         keytext = line[:middle].strip()
         valtext = line[middle:].strip()
         if not keytext:
             ## it's a continuation
-            assert curkey
+            if curkey is None:
+                raise KeyFileError(
+                    "continuation line before the first slot", path, line_num, line
+                )
         else:
             curkey = cleankey(keytext)
-            assert curkey in ALL_KEYS
+            if curkey not in ALL_KEYS:
+                raise KeyFileError(f"unknown slot {keytext!r}", path, line_num, line)
+
+        yield curkey, valtext, (path, line_num)
+
+
+# Slot values other than locations are parsed by a tokenizer and a small
+# recursive-descent grammar. Parses are memoized on the value string,
+# since most values recur many times.
+#
+#   value       := ["?"] alternation [":" alternation]
+#   alternation := element ("/" element)*
+#   element     := "(" alternation ")" | ITEM      (a lone "-" is a null)
+#
+# An ITEM is a run of quoted strings and bare text. "/" and ":" separate
+# alternatives and colon clauses even inside quotes, as they did for the
+# original regex-based parser (no quoted string in the data contains
+# either), while parentheses inside quotes are part of the string.
+VALUE_TOKEN_RE = re.compile(
+    r"""\s*(?:
+        (?P<op>[?:/()])
+        | (?P<item>(?:"[^"\\:/]*(?:\\.[^"\\:/]*)*"|[^?:/()"]+|")+)
+    )""",
+    re.VERBOSE,
+)
 
-        yield curkey, valtext
+# (kind, text, start offset)
+Token = Tuple[str, str, int]
 
 
-def parse_location(location_expr: str):
-    out = []
+def tokenize(value: str, token_re: Pattern) -> List[Token]:
+    # the token patterns match any character, so the tokens are contiguous.
+    # Whitespace-only items (e.g. after a trailing "/") are left out, so
+    # that the parser reports the missing string.
+    return [
+        (m.lastgroup, m.group(m.lastgroup), m.start(m.lastgroup))
+        for m in token_re.finditer(value)
+        if not m.group(m.lastgroup).isspace()
+    ]
+
+
+def _syntax_error(value: str, tokens: List[Token], i: int, expected: str):
+    if i >= len(tokens):
+        return KeyFileError(f"expected {expected} at the end of {value!r}")
+    _, text, start = tokens[i]
+    return KeyFileError(
+        f"expected {expected} but found {text!r} at column {start + 1} of {value!r}"
+    )
+
+
+def _is_op(tokens: List[Token], i: int, op: str) -> bool:
+    return i < len(tokens) and tokens[i][0] == "op" and tokens[i][1] == op
+
+
+class ParsedValue(NamedTuple):
+    """
+    The memoized parse of a slot value. `lhs` is None for simple strings;
+    for colon clauses `strings` holds the right-hand side.
+    """
+
+    optional: bool
+    lhs: Optional[Tuple[Optional[str], ...]]
+    strings: Tuple[Optional[str], ...]
+    warnings: Tuple[str, ...]
+
+    def to_filler(self) -> Dict[str, Any]:
+        # a fresh dict every time, since callers may modify fillers
+        d = {}
+        if self.optional:
+            d["optional"] = True
+        if self.lhs is None:
+            d.update({"type": "simple_strings", "strings": list(self.strings)})
+        else:
+            d.update(
+                {
+                    "type": "colon_clause",
+                    "strings_lhs": list(self.lhs),
+                    "strings_rhs": list(self.strings),
+                }
+            )
+        return d
+
+
+@lru_cache(maxsize=None)
+def _parse_item(
+    ss: str, slotname: Optional[str]
+) -> Tuple[Optional[str], Optional[str]]:
+    """Returns the string (or None) an item stands for and a warning, if any"""
+    ss = ss.strip()
+    if ss == "-":
+        # We should see this only inside a colon clause. There are a few of these, e.g.
+        # 21. HUM TGT: NUMBER                 -: "ORLANDO LETELIER"
+        return None, None
+    warning = None
+    if slotname in SET_FILL_STRING_SLOTS:
+        # These slots should not have strings escaped
+        if ss not in SET_FILL_KEYS_ALLOWED_VALUES[slotname]:
+            raise KeyFileError(f"invalid {slotname} value {ss!r}")
+    elif slotname != "incident_date":
+        if ss.startswith('"') != ss.endswith('"') or ss == '"':
+            warning = f"unbalanced quotes in {ss!r}"
+        if ss[0] == '"':
+            ss = ss[1:]
+        if ss[-1:] == '"':
+            ss = ss[:-1]
+    if "\\" in ss:
+        # They seem to use C-style backslash escaping
+        ss = decode(ss, "unicode-escape")
+    return ss.strip(), warning
+
+
+def _parse_alternation(
+    value: str,
+    tokens: List[Token],
+    i: int,
+    slotname: Optional[str],
+    strings: List[Optional[str]],
+    warnings: List[str],
+) -> int:
+    """
+    Parses the alternation starting at token i, appending its strings to
+    `strings`, and returns the index of the token after it
+    """
+    while True:
+        if i < len(tokens) and tokens[i][0] == "item":
+            string, warning = _parse_item(tokens[i][1], slotname)
+            strings.append(string)
+            if warning is not None:
+                warnings.append(warning)
+            i += 1
+        elif _is_op(tokens, i, "("):
+            i = _parse_alternation(value, tokens, i + 1, slotname, strings, warnings)
+            if not _is_op(tokens, i, ")"):
+                raise _syntax_error(value, tokens, i, "')'")
+            i += 1
+        else:
+            raise _syntax_error(value, tokens, i, "a string")
+        if not _is_op(tokens, i, "/"):
+            return i
+        i += 1
+
+
+@lru_cache(maxsize=None)
+def parse_value(namestr: str, slotname: Optional[str] = None) -> ParsedValue:
+    """
+    Parses a (non-location) slot value. Raises a KeyFileError (without a
+    location; see parse_values) if the value is malformed.
+    """
+    tokens = tokenize(namestr, VALUE_TOKEN_RE)
+    optional = _is_op(tokens, 0, "?")
+    strings, warnings = [], []
+    i = _parse_alternation(namestr, tokens, int(optional), slotname, strings, warnings)
+    lhs = None
+    if _is_op(tokens, i, ":"):
+        # only the left-hand side holds set-fill values or dates
+        lhs, strings = tuple(strings), []
+        i = _parse_alternation(namestr, tokens, i + 1, None, strings, warnings)
+    if i < len(tokens):
+        raise _syntax_error(namestr, tokens, i, "'/', ':' or the end of the value")
+    return ParsedValue(optional, lhs, tuple(strings), tuple(warnings))
+
+
+# As in the original parser, a place name consists of word characters and
+# spaces, optionally followed by its type in parentheses (e.g. "LIMA
+# (CITY)"). Anything else around it is dropped, with a warning.
+LOCATION_RE = re.compile(r"([\w ]+)(\(\w+ ?\w*\))*")
+
+
+@lru_cache(maxsize=None)
+def parse_location_value(
+    location_expr: str,
+) -> Tuple[Tuple[Tuple[str, Optional[str]], ...], Tuple[str, ...]]:
+    """
+    Parses an incident_location value into its distinct (name, type or
+    None) places, in order, and any warnings
+    """
+    places, warnings = [], []
     seen = set()
     for loc1 in location_expr.split(" / "):
-        loc1 = loc1.strip()
-        for loc2 in loc1.split(":"):
+        for loc2 in loc1.strip().split(":"):
             loc2 = loc2.strip()
-            if loc2[0] == "(" and loc2[-1] == ")":
+            if loc2.startswith("(") and loc2.endswith(")"):
                 loc2 = loc2[1:-1]
             for loc3 in loc2.split("-"):
                 loc3 = loc3.strip()
                 if loc3.startswith("? "):
                     loc3 = loc3[2:]
-                match = re.search(LOCATION_RE, loc3)
-                assert match is not None
-                groups = match.groups()
-                assert len(groups) == 2
-                g0 = groups[0].strip()
-                if groups[1] is None:
-                    if g0 not in seen:
-                        out.append({"type": "simple_strings", "strings": [g0]})
-                        seen.add(g0)
-                else:
-                    assert groups[1][0] == "(" and groups[1][-1] == ")"
-                    g1 = groups[1][1:-1]
-                    if g0 + g1 not in seen:
-                        out.append(
-                            {
-                                "type": "colon_clause",
-                                "strings_lhs": [g0],
-                                "strings_rhs": [g1],
-                            }
-                        )
-                        seen.add(g0 + g1)
-    return out
+                match = LOCATION_RE.search(loc3)
+                if match is None:
+                    raise KeyFileError(
+                        f"expected a location name in {loc3!r} of {location_expr!r}"
+                    )
+                name, place_type = match.groups()
+                name = name.strip()
+                # parentheses that only group places are not dropped characters
+                skipped = loc3[: match.start()] + " " + loc3[match.end() :]
+                skipped = skipped.strip(" ()")
+                if skipped:
+                    warnings.append(f"ignoring {skipped!r} around location {name!r}")
+                if place_type is not None:
+                    place_type = place_type[1:-1]
+                key = name if place_type is None else name + place_type
+                if key not in seen:
+                    places.append((name, place_type))
+                    seen.add(key)
+    return tuple(places), tuple(warnings)
+
+
+def parse_location(location_expr: str):
+    places, warnings = parse_location_value(location_expr)
+    for w in warnings:
+        warning(w)
+    # fresh dicts every time, since callers may modify fillers
+    return [
+        (
+            {"type": "simple_strings", "strings": [name]}
+            if place_type is None
+            else {
+                "type": "colon_clause",
+                "strings_lhs": [name],
+                "strings_rhs": [place_type],
+            }
+        )
+        for name, place_type in places
+    ]
+
+
+MESSAGE_TEMPLATE_RE = re.compile(r"^(?:(\d+)|\*|(\d+) \(OPTIONAL\))$")
 
 
 def parse_values(keyvals):
     """
-    Takes key,value pairs as input, where the values are unparsed.
-    Filter down to the slots we want, and parse their values as well.
+    Takes (key, value, (path, line number)) triples as input, where the
+    values are unparsed. Filter down to the slots we want, and parse their
+    values as well. Malformed values raise a KeyFileError giving their line.
     """
-    for key, value in keyvals:
-        if key == "message_id":
-            yield key, clean_docid(value)
-            continue
-        if key == "message_template":
-            if re.search(r"^\d+$", value):
-                yield key, int(value)
-            elif value == "*":
-                yield key, value
-            elif re.search(r"^\d+ \(OPTIONAL\)$", value):
-                yield key, int(value.split()[0])
-                yield "message_template_optional", True
-            else:
-                assert False, "bad message_template format"
-            continue
-        if key == "incident_type":
-            yield key, clean_docid(value)
-            continue
-
-        if key in SELECTED_KEYS:
-            if value == "*":
+    for key, value, (path, line_num) in keyvals:
+        try:
+            if key == "message_id" or key == "incident_type":
+                yield key, clean_docid(value)
+            elif key == "message_template":
+                match = MESSAGE_TEMPLATE_RE.match(value)
+                if match is None:
+                    raise KeyFileError(f"bad message_template format {value!r}")
+                if match.group(1) is not None:
+                    yield key, int(match.group(1))
+                elif match.group(2) is not None:
+                    yield key, int(match.group(2))
+                    yield "message_template_optional", True
+                else:
+                    yield key, value
+            elif key not in SELECTED_KEYS or value == "*":
                 continue
-
-            if value == "-":
+            elif value == "-":
                 yield key, None
-                continue
-
-            if key == "incident_location":
+            elif key == "incident_location":
                 yield key, parse_location(value)
-                continue
-
-            if '"' not in value:
-                if key not in {
-                    "incident_date",
-                    "incident_stage_of_execution",
-                    "perp_incident_category",
-                    "perp_organization_confidence",
-                }:
+            else:
+                if '"' not in value and key not in UNQUOTED_SLOTS:
                     warning(
-                        f"apparent data error, missing quotes. adding back in. value was ||| {value}"
+                        f"apparent data error, missing quotes; taking the unquoted text as is. value was ||| {value}"
                     )
-                    value = '"' + value + '"'
-
-            value = parse_one_value(value, key)
-            if key in SET_FILL_KEYS_ALLOWED_VALUES:
-                strings_key = "strings" if "strings" in value else "strings_lhs"
-                for v in value[strings_key]:
-                    assert v in SET_FILL_KEYS_ALLOWED_VALUES[key], f"{key}: {v}"
-
-            yield key, value
+                value = parse_one_value(value, key)
+                if key in SET_FILL_KEYS_ALLOWED_VALUES:
+                    strings_key = "strings" if "strings" in value else "strings_lhs"
+                    for v in value[strings_key]:
+                        if v not in SET_FILL_KEYS_ALLOWED_VALUES[key]:
+                            raise KeyFileError(f"invalid {key} value {v!r}")
+                yield key, value
+        except KeyFileError as e:
+            raise e.at(path, line_num, value) from None
 
 
 def parse_one_value(namestr, slotname=None):
@@ -276,71 +504,17 @@ def parse_one_value(namestr, slotname=None):
         # DEV-MUC3-0217
         namestr = '"' + namestr
 
-    d = {}
-    match = re.search(r"\? *(.*)", namestr)
-    if match:
-        d["optional"] = True
-        namestr = match.group(1)
-
-    if ":" in namestr:
-        assert len(re.findall(":", namestr)) == 1
-        lhs, rhs = re.split(r" *: *", namestr)
-        if lhs[0] == "(":
-            lhs = lhs[1:]
-        if lhs[-1] == ")":
-            lhs = lhs[:-1]
-        rhs_value = parse_strings_possibly_with_alternations(rhs)
-        lhs_value = parse_strings_possibly_with_alternations(lhs, slotname)
-        d.update(
-            {"type": "colon_clause", "strings_lhs": lhs_value, "strings_rhs": rhs_value}
-        )
-        return d
-
-    else:
-        strings = parse_strings_possibly_with_alternations(namestr, slotname)
-        d.update({"type": "simple_strings", "strings": strings})
-        return d
+    parsed = parse_value(namestr, slotname)
+    for w in parsed.warnings:
+        warning(w)
+    return parsed.to_filler()
 
 
 def parse_strings_possibly_with_alternations(namestr, slotname=None):
-    namestr = namestr.strip()
-    assert ":" not in namestr, namestr
-    assert not namestr.startswith("?")
-    parts = re.split(" */ *", namestr)
-    parts = [ss.strip() for ss in parts]
-    strings = []
-    for ss in parts:
-        if ss == "-":
-            # We should see this only inside a colon clause. There are a few of these, e.g.
-            # 21. HUM TGT: NUMBER                 -: "ORLANDO LETELIER"
-            strings.append(None)
-            continue
-        if slotname in {
-            "hum_tgt_effect_of_incident",
-            "phys_tgt_effect_of_incident",
-            "incident_stage_of_execution",
-            "perp_incident_category",
-            "perp_organization_confidence",
-        }:
-            # These slots should not have strings escaped
-            assert ss in SET_FILL_KEYS_ALLOWED_VALUES[slotname], f"{slotname}: {ss}"
-        elif slotname == "incident_date":
-            if ss[0] == "(":
-                ss = ss[1:]
-            if ss[-1] == ")":
-                ss = ss[:-1]
-        else:
-            if (ss[0] == '"' and ss[-1] != '"') or (ss[0] != '"' and ss[-1] == '"'):
-                warning("WTF ||| " + ss)
-            if ss[0] == '"':
-                ss = ss[1:]
-            if ss[-1] == '"':
-                ss = ss[:-1]
-        # ss = ss.decode('string_escape')  # They seem to use C-style backslash escaping
-        ss = decode(ss, "unicode-escape")
-        ss = ss.strip()
-        strings.append(ss)
-    return strings
+    parsed = parse_value(namestr.strip(), slotname)
+    if parsed.optional or parsed.lhs is not None:
+        raise KeyFileError(f"expected only alternatives in {namestr!r}")
+    return list(parsed.strings)
 
 
 def test_parsestrings():
@@ -358,6 +532,17 @@ def test_parse_one_value():
     assert d["strings_rhs"] == ["BERNARDETTE PARDO"]
 
 
+def test_parse_one_value_errors():
+    # empty alternatives are reported, not crashed on
+    for s in ['"A" / ', '"A" /  / "B"', '"A": ', "( )"]:
+        try:
+            parse_one_value(s, "hum_tgt_name")
+        except KeyFileError as e:
+            assert "expected a string" in str(e), e
+        else:
+            assert False, f"{s!r} should not parse"
+
+
 def fancy_json_print(keyvals):
     lines = [json.dumps(kv, sort_keys=True) for kv in keyvals]
     s = ""
@@ -380,49 +565,98 @@ def keyvals_to_dict(keyvals):
     return out
 
 
-if __name__ == "__main__":
-
-    import argparse
-
-    p = argparse.ArgumentParser()
-    p.add_argument("input", help="the raw MUC keyfiles to be processed")
-    p.add_argument("output", help="the JSON file where the output will be written")
-    args = p.parse_args()
-
-    if os.path.isfile(args.input):
-        keyfiles = [args.input]
-    elif os.path.isdir(args.input):
-        path = os.path.abspath(args.input)
+def list_keyfiles(input_path: str):
+    if os.path.isfile(input_path):
+        keyfiles = [input_path]
+    elif os.path.isdir(input_path):
+        path = os.path.abspath(input_path)
         keyfiles = [
             os.path.join(path, f)
-            for f in os.listdir(args.input)
+            for f in os.listdir(input_path)
             if f.startswith("key-")
         ]
     else:
         raise ValueError("Could not find input file or directory!")
     assert keyfiles, f"No keyfiles found!"
-    lines = []
+    return keyfiles
+
+
+def read_entries(keyfiles):
+    """
+    Yields the entries of the given raw MUC keyfiles, each as a list of
+    (path, line number, line) triples. Comment lines are dropped, and
+    entries are separated by blank lines or start with "0. ".
+    """
+    entry = []
     for keyfile in keyfiles:
         with open(keyfile) as f:
-            for line in f:
+            for line_num, line in enumerate(f, 1):
                 l = line.rstrip()
-                if not re.search(r"^\s*;", l):
-                    lines.append(l)
-    data = "\n".join(lines)
-    chunks = re.split(r"\n\n+|\n(?=0\. )", data)
-    chunks = [c.strip() for c in chunks if c.strip()]
-
+                if COMMENT_RE.match(l):
+                    continue
+                if not l or l.startswith("0. "):
+                    if entry:
+                        yield entry
+                    entry = []
+                if l:
+                    entry.append((keyfile, line_num, l if entry else l.lstrip()))
+    if entry:
+        yield entry
+
+
+def process_keyfiles(keyfiles):
+    """
+    Parses the given raw MUC keyfiles and returns a dictionary mapping
+    each document ID to the list of templates for that document.
+    """
     output = defaultdict(list)
-    for chunk in chunks:
-        keyvals1 = list(yield_keyvals(chunk))
-        assert all(k in ALL_KEYS or k == "comment" for k, v in keyvals1)
-        cur_docid = clean_docid(dict(keyvals1)["message_id"])
-        keyvals2 = list(parse_values(keyvals1))
+    for docid, templates in iter_keyfiles(keyfiles):
+        output[docid].extend(templates)
+    return output
+
+
+def iter_keyfiles(keyfiles):
+    """
+    Like process_keyfiles, but yields (document ID, templates) pairs as
+    the keyfiles are parsed. The entries of a document are consecutive in
+    the MUC keyfiles, so each document is normally yielded once.
+    """
+    global cur_docid
+    docid, templates = None, []
+    for entry in read_entries(keyfiles):
+        keyvals1 = list(yield_keyvals(entry))
+        message_ids = [v for k, v, _ in keyvals1 if k == "message_id"]
+        if not message_ids:
+            path, line_num, line = entry[0]
+            raise KeyFileError("entry without a MESSAGE: ID", path, line_num, line)
+        cur_docid = clean_docid(message_ids[-1])
+        with PROFILER.section("key_parsing"):
+            keyvals2 = list(parse_values(keyvals1))
         keyvals_dict = keyvals_to_dict(keyvals2)
-        output[keyvals_dict["message_id"]].append(keyvals_dict)
+        if templates and keyvals_dict["message_id"] != docid:
+            yield docid, templates
+            templates = []
+        docid = keyvals_dict["message_id"]
+        templates.append(keyvals_dict)
+    if templates:
+        yield docid, templates
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    p = argparse.ArgumentParser()
+    p.add_argument("input", help="the raw MUC keyfiles to be processed")
+    p.add_argument("output", help="the JSON file where the output will be written")
+    add_profiling_args(p)
+    args = p.parse_args()
+
+    with profiling(args):
+        output = process_keyfiles(list_keyfiles(args.input))
 
-    with open(args.output, "w") as f:
-        json.dump(output, f, indent=2)
+        with open(args.output, "w") as f, PROFILER.section("json_dump"):
+            json.dump(output, f, indent=2)
 
     # print("%%%")
     # print(fancy_json_print(keyvals2))
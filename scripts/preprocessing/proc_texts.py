@@ -8,23 +8,39 @@ import argparse
 import json
 import os
 import re
+import sys
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("input", help="the raw MUC input file or directory")
-    parser.add_argument("output", help="the output JSON file")
-    args = parser.parse_args()
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.profiling import PROFILER, add_profiling_args, profiling
 
-    if os.path.isfile(args.input):
-        texts = [args.input]
-    elif os.path.isdir(args.input):
-        path = os.path.abspath(args.input)
-        texts = [os.path.join(path, f) for f in os.listdir(args.input)]
+
+def list_texts(input_path: str):
+    if os.path.isfile(input_path):
+        texts = [input_path]
+    elif os.path.isdir(input_path):
+        path = os.path.abspath(input_path)
+        texts = [os.path.join(path, f) for f in os.listdir(input_path)]
     else:
         raise ValueError("Could not find input file or directory!")
     assert texts, f"No texts found!"
+    return texts
+
+
+def process_texts(texts):
+    """
+    Splits the given raw MUC document files into individual documents and
+    returns a dictionary mapping each document ID to its dateline, tags and text.
+    """
+    return dict(iter_texts(texts))
+
 
-    output = {}
+def iter_texts(texts):
+    """
+    Like process_texts, but yields (document ID, document) pairs one raw
+    file at a time, in file order.
+    """
     for text in texts:
         doc_infos = []
         with open(text) as f:
@@ -77,8 +93,19 @@ if __name__ == "__main__":
             text = text.replace("[", "(").replace("]", ")")
 
             d["text"] = text
-            output[d["docid"]] = d
+            yield d["docid"], d
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="the raw MUC input file or directory")
+    parser.add_argument("output", help="the output JSON file")
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    with profiling(args):
+        with PROFILER.section("document_splitting"):
+            output = process_texts(list_texts(args.input))
 
-    # outside loop over texts
-    with open(args.output, "w") as f:
-        json.dump(output, f, indent=2)
+        with open(args.output, "w") as f, PROFILER.section("json_dump"):
+            json.dump(output, f, indent=2)
@@ -8,14 +8,21 @@ values for four five slots (apart from incident_type):
 - phys_tgt_id (Target)
 - incident_instrument_id (Weapon)
 
+With --content-uuids and --timestamp, the output is reproducible: UUIDs
+are derived from a hash of each document (and the conversion settings)
+rather than drawn at random, and the current time is replaced by the
+given one. With --incremental, only the documents whose hash differs
+from the one recorded for the existing archive are converted; the
+others are copied from it.
+
 Author: Will Gantt
 Date: 4/4/23
 """
 import argparse
 import json
+import numpy as np
 import os
-import spacy
-import tokenizations
+import sys
 
 from cement.cement_common import augf
 from cement.cement_document import CementDocument
@@ -31,129 +38,283 @@ from concrete import (
     Argument,
     Communication,
 )
-from concrete.util import CommunicationWriterZip
 import datetime
+from functools import lru_cache
 from tqdm import tqdm
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.concrete_io import (
+    DEFAULT_CHECKPOINT_EVERY,
+    ArchiveOptions,
+    CommunicationArchiveWriter,
+    add_checkpoint_args,
+    add_serialization_args,
+    archive_path,
+    assign_content_uuids,
+    content_hash,
+    iter_archive_members,
+    read_hashes,
+    remove_archive,
+    set_aside,
+    set_timestamps,
+    write_hashes,
+)
+from utils.data_model import Document, load_documents
+from utils.nlp_service import prepare_pipeline, tokenize
+from utils.profiling import PROFILER, add_profiling_args, profiling
+from utils.sharding import (
+    Shard,
+    add_shard_args,
+    select_shard,
+    shard_path,
+    write_positions,
+)
+from utils.spans import SpanIndex
 
 PROCESSED_DATA_ROOT = "data/processed/"
 OUTPUT_DIR = "data/concrete/"
 SPLITS = ["train", "dev", "test"]
 ONTOLOGY_MAPPING = "data/concrete/sftp_ontology_mapping.json"
+# see utils/nlp_service.py
+TOKENIZER_PIPELINE = "en_core_web_sm"
+
 
-# maps actual slot names (in data) to modified
-# slot names used by IterX and other models
-with open(ONTOLOGY_MAPPING) as f:
-    SLOTS_OF_INTEREST = json.load(f)
+# The ontology mapping and the spaCy model are only loaded on first use,
+# so that e.g. --help and imports of this module stay fast
+@lru_cache(maxsize=None)
+def get_slots_of_interest() -> Dict[str, str]:
+    # maps actual slot names (in data) to modified
+    # slot names used by IterX and other models
+    with open(ONTOLOGY_MAPPING) as f:
+        return json.load(f)
 
-TOKENIZER = spacy.load("en_core_web_sm")
 
+def load_resources() -> None:
+    get_slots_of_interest()
+    prepare_pipeline(TOKENIZER_PIPELINE)
 
-def to_concrete(lowercase: bool):
-    for split in SPLITS:
-        data = json.load(
-            open(os.path.join(PROCESSED_DATA_ROOT, split, split + ".json"))
+
+def document_to_communication(
+    doc: Document,
+    lowercase: bool = False,
+    slots_of_interest: Optional[Dict[str, str]] = None,
+    timestamp: Optional[int] = None,
+    uuid_seed: Optional[str] = None,
+) -> Communication:
+    """
+    Converts a processed document into a Communication with one
+    EVENT_TEMPLATE situation per template. A `timestamp` replaces the
+    current time in its metadata, and a `uuid_seed` (see
+    assign_content_uuids) its random UUIDs.
+    """
+    if slots_of_interest is None:
+        slots_of_interest = get_slots_of_interest()
+    doc_id = doc.doc_id
+    text = doc.text.lower() if lowercase else doc.text
+    # assign each sentence to the section containing it
+    section_index = SpanIndex(doc.sections)
+    sentence_index = SpanIndex(doc.sentences)
+    sentence_sections = section_index.containing(
+        sentence_index.starts, sentence_index.ends
+    )
+    # sentences must be in order, and so must the sections they fall in
+    if not (
+        np.all(sentence_sections >= 0)
+        and np.all(np.diff(sentence_index.order) > 0)
+        and np.all(np.diff(sentence_sections) >= 0)
+    ):
+        raise ValueError(
+            "Invalid input: Either sections are not ordered or sentence bounds exceed section bounds."
         )
-        output_subdir = "lowercase" if lowercase else "uppercase"
-        output_path = os.path.join(OUTPUT_DIR, output_subdir, split + '.zip')
-        with CommunicationWriterZip(output_path) as writer:
-            for doc_id, doc in tqdm(
-                data.items(), desc=f"Processing documents in split {split}"
-            ):
-                text = doc["text"].lower() if lowercase else doc["text"]
-                all_tokens = []
-                # last item in list represents current section
-                input_sentences_by_section = [[]]
-                # first item in list represents current section
-                remaining_sections = [(s, e) for (s, e) in doc["sections"]]
-                for (start, end) in doc["sentences"]:
-                    while not (
-                        remaining_sections[0][0] <= start
-                        and end <= remaining_sections[0][1]
+    all_token_spans = []
+    input_sentences_by_section = [[] for _ in doc.sections]
+    with PROFILER.section("tokenization"):
+        sentence_token_spans = tokenize(
+            [text[start:end] for start, end in doc.sentences], TOKENIZER_PIPELINE
+        )
+    for (start, end), section, token_spans in zip(
+        doc.sentences, sentence_sections.tolist(), sentence_token_spans
+    ):
+        input_tokens = []
+        for tok_start, tok_end in token_spans:
+            global_tok_start = start + tok_start
+            global_tok_end = start + tok_end
+            input_tokens.append(
+                InputTokenWithSpan(
+                    text=text[global_tok_start:global_tok_end],
+                    start=global_tok_start,
+                    end=global_tok_end,
+                )
+            )
+            all_token_spans.append((global_tok_start, global_tok_end))
+        input_sentences_by_section[section].append(
+            InputSentenceWithSpan(tokens=input_tokens, start=start, end=end)
+        )
+    # convert sentence lists to cement sections
+    input_sections = [
+        InputSectionWithSpan(sentences=input_sentences, start=start, end=end)
+        for ((start, end), input_sentences) in zip(
+            doc.sections, input_sentences_by_section
+        )
+    ]
+    token_index = SpanIndex(all_token_spans)
+
+    communication_metadata = AnnotationMetadata(
+        "cement",
+        int(datetime.datetime.now().timestamp()) if timestamp is None else timestamp,
+    )
+    comm = Communication(
+        uuid=augf.next(),
+        id=doc_id,
+        type="muc_document",
+        text=text,
+        sectionList=[
+            create_section_from_tokens(input_section)
+            for input_section in input_sections
+        ],
+        metadata=communication_metadata,
+    )
+    cement_doc = CementDocument.from_communication(comm)
+    for template in doc.templates:
+        template_fillers = []
+        for slot in slots_of_interest:
+            if slot in template and template[slot] is not None:
+                for filler in template[slot]:
+                    entity_mentions = []
+                    mentions = filler["document_mentions"]
+                    if len(mentions) == 0:
+                        mentions = np.empty((0, 2), dtype=np.int64)
+                    char_starts, char_ends = np.asarray(mentions).T
+                    # the tokens containing the first and last character
+                    tok_starts = token_index.find(char_starts)
+                    tok_ends = token_index.find(char_ends - 1)
+                    assert np.all(tok_starts >= 0)
+                    assert np.all(tok_ends >= 0)
+                    for char_start, char_end, tok_start, tok_end in zip(
+                        char_starts.tolist(),
+                        char_ends.tolist(),
+                        tok_starts.tolist(),
+                        tok_ends.tolist(),
                     ):
-                        input_sentences_by_section.append([])
-                        remaining_sections.pop(0)
-                        if not remaining_sections:
-                            raise ValueError(
-                                "Invalid input: Either sections are not ordered or sentence bounds exceed section bounds."
-                            )
-                    input_tokens = []
-                    for tok in TOKENIZER(text[start:end]):
-                        global_tok_start = start + tok.idx
-                        global_tok_end = global_tok_start + len(tok)
-                        input_tokens.append(
-                            InputTokenWithSpan(
-                                text=tok.text, start=global_tok_start, end=global_tok_end
+                        entity_mentions.append(
+                            CementEntityMention(
+                                tok_start,
+                                tok_end,
+                                text=text[char_start:char_end],
+                                document=cement_doc,
                             )
                         )
-                        all_tokens.append(tok.text)
-                    input_sentences_by_section[-1].append(
-                        InputSentenceWithSpan(tokens=input_tokens, start=start, end=end)
+                    entity_uuid = cement_doc.add_entity(
+                        entity_mentions, entity_type="ENTITY"
                     )
-                # remove current section
-                remaining_sections.pop()
-                # add empty sentence lists for remaining sections
-                while remaining_sections:
-                    input_sentences_by_section.append([])
-                    remaining_sections.pop()
-                # convert sentence lists to cement sections
-                input_sections = [
-                    InputSectionWithSpan(sentences=input_sentences, start=start, end=end)
-                    for ((start, end), input_sentences) in zip(
-                        doc["sections"], input_sentences_by_section
+                    template_fillers.append(
+                        Argument(role=slots_of_interest[slot], entityId=entity_uuid)
                     )
-                ]
-                tok2char, char2tok = tokenizations.get_alignments(all_tokens, text)
+        cement_doc.add_raw_situation(
+            situation_type="EVENT_TEMPLATE",
+            situation_kind=template["incident_type"],
+            arguments=template_fillers,
+        )
+    comm = cement_doc.comm
+    if timestamp is not None:
+        # cement stamps the annotations it adds with the current time
+        set_timestamps(comm, timestamp)
+    if uuid_seed is not None:
+        assign_content_uuids(comm, uuid_seed)
+    return comm
 
-                communication_metadata = AnnotationMetadata(
-                    "cement", int(datetime.datetime.now().timestamp())
-                )
-                comm = Communication(
-                    uuid=augf.next(),
-                    id=doc_id,
-                    type="muc_document",
-                    text=text,
-                    sectionList=[
-                        create_section_from_tokens(input_section)
-                        for input_section in input_sections
-                    ],
-                    metadata=communication_metadata,
-                )
-                cement_doc = CementDocument.from_communication(comm)
-                for template in doc["templates"]:
-                    template_fillers = []
-                    for slot in SLOTS_OF_INTEREST:
-                        if slot in template and template[slot] is not None:
-                            for filler in template[slot]:
-                                entity_mentions = []
-                                for (char_start, char_end) in filler["document_mentions"]:
-                                    tok_start, tok_end = (
-                                        char2tok[char_start],
-                                        char2tok[char_end - 1],
-                                    )
-                                    assert len(tok_start) == 1
-                                    assert len(tok_end) == 1
-                                    entity_mentions.append(
-                                        CementEntityMention(
-                                            tok_start[0],
-                                            tok_end[0],
-                                            text=text[char_start:char_end],
-                                            document=cement_doc,
-                                        )
-                                    )
-                                entity_uuid = cement_doc.add_entity(
-                                    entity_mentions, entity_type="ENTITY"
-                                )
-                                template_fillers.append(
-                                    Argument(
-                                        role=SLOTS_OF_INTEREST[slot], entityId=entity_uuid
-                                    )
-                                )
-                    cement_doc.add_raw_situation(
-                        situation_type="EVENT_TEMPLATE",
-                        situation_kind=template["incident_type"],
-                        arguments=template_fillers,
+
+def document_hash(doc: Document, settings: str) -> str:
+    return content_hash(settings, doc.doc_id, json.dumps(doc.to_json(), sort_keys=True))
+
+
+def to_concrete(
+    lowercase: bool,
+    splits: List[str] = SPLITS,
+    data_root: str = PROCESSED_DATA_ROOT,
+    output_dir: str = OUTPUT_DIR,
+    options: ArchiveOptions = ArchiveOptions(),
+    shard: Optional[Shard] = None,
+    resume: bool = False,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+    content_uuids: bool = False,
+    incremental: bool = False,
+):
+    if resume and incremental:
+        raise ValueError("An incremental update cannot be resumed")
+    slots_of_interest = get_slots_of_interest()
+    prepare_pipeline(TOKENIZER_PIPELINE)
+    # everything besides a document that its Communication depends on
+    settings = json.dumps(
+        [
+            lowercase,
+            slots_of_interest,
+            options.protocol,
+            options.timestamp,
+            content_uuids,
+        ]
+    )
+    for split in splits:
+        with PROFILER.section("json_load"):
+            data = load_documents(os.path.join(data_root, split, split + ".json"))
+        output_subdir = "lowercase" if lowercase else "uppercase"
+        os.makedirs(os.path.join(output_dir, output_subdir), exist_ok=True)
+        output_path = shard_path(
+            archive_path(
+                os.path.join(output_dir, output_subdir, split), options.format
+            ),
+            shard,
+        )
+        positions = []
+        docs = list(select_shard(data.items(), shard, positions))
+        hashes = {
+            doc_id + ".concrete": document_hash(doc, settings) for doc_id, doc in docs
+        }
+        previous, unchanged = None, {}
+        if incremental:
+            previous_hashes = read_hashes(output_path)
+            previous = set_aside(output_path)
+        if previous is not None:
+            with PROFILER.section("archive_copy"):
+                unchanged = {
+                    name: data
+                    for name, data in iter_archive_members(previous)
+                    if name in hashes and previous_hashes.get(name) == hashes[name]
+                }
+        with CommunicationArchiveWriter(output_path, options, resume) as writer:
+            if writer.completed:
+                print(f"Resuming {output_path} after {len(writer.completed)} documents")
+            for doc_id, doc in tqdm(
+                docs, desc=f"Processing documents in split {split}"
+            ):
+                name = doc_id + ".concrete"
+                if name in writer.completed:
+                    continue
+                if name in unchanged:
+                    writer.write_bytes(name, unchanged[name])
+                else:
+                    comm = document_to_communication(
+                        doc,
+                        lowercase,
+                        slots_of_interest,
+                        options.timestamp,
+                        hashes[name] if content_uuids else None,
                     )
-                writer.write(cement_doc.comm)
+                    writer.write(comm, name)
+                if checkpoint_every and len(writer.names) % checkpoint_every == 0:
+                    writer.checkpoint()
+        write_hashes(output_path, hashes)
+        if previous is not None:
+            remove_archive(previous)
+        if incremental:
+            print(
+                f"Updated {output_path}: converted {len(docs) - len(unchanged)} and copied {len(unchanged)} of {len(docs)} documents"
+            )
+        if shard is not None:
+            write_positions(output_path, positions, writer.names)
 
 
 if __name__ == "__main__":
@@ -161,5 +322,52 @@ if __name__ == "__main__":
     parser.add_argument(
         "--lowercase", action="store_true", help="whether to lowercase all MUC text"
     )
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=SPLITS,
+        default=SPLITS,
+        help="the splits to convert",
+    )
+    parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed {split}/{split}.json files",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=OUTPUT_DIR,
+        help="directory to which {lowercase,uppercase}/{split}.zip are written",
+    )
+    parser.add_argument(
+        "--content-uuids",
+        action="store_true",
+        help="derive the UUIDs of each Communication from a hash of its document instead of drawing them at random",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only convert the documents that changed since the existing archives were written, copying the others from them",
+    )
+    add_serialization_args(parser)
+    add_checkpoint_args(parser)
+    add_shard_args(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
-    to_concrete(args.lowercase)
+    if args.incremental and args.resume:
+        parser.error("--incremental and --resume cannot be combined")
+    with profiling(args):
+        to_concrete(
+            args.lowercase,
+            args.splits,
+            args.data_root,
+            args.output_dir,
+            ArchiveOptions.from_args(args),
+            args.shard,
+            args.resume,
+            args.checkpoint_every,
+            args.content_uuids,
+            args.incremental,
+        )
@@ -0,0 +1,221 @@
+"""
+Resolves the incident_location fillers of the processed splits against
+the gazetteer of the MUC place name lists (see scripts/utils/gazetteer.py),
+in place of looking up the unlocatable locations by hand. Each document
+is scanned once for all the place names it mentions, and each distinct
+location string of its templates gets one of these statuses:
+
+- "exact": the string occurs in the text
+- "synonym": a synonym of it does (e.g. NORTHERN SANTANDER for NORTE
+  DE SANTANDER)
+- "completion": the string is a truncated name (e.g. "WASHINGTON D"),
+  which is completed to the only matching name that occurs in the text
+- "contained": a place it contains does (e.g. SAN SALVADOR for EL
+  SALVADOR)
+- "unlocated": none of the above, although the gazetteer knows the name
+- "unknown": none of the above, and the gazetteer does not know the name
+
+along with the spans of the evidence, the canonical name, its types and
+the areas containing it. The results are written to
+{split}/{split}_resolved_locations.json, keyed by document ID like the
+{split}_unlocatable_locations.json reports of preprocess.py. Run from
+the project root:
+
+    python scripts/preprocessing/resolve_locations.py --splits dev test
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+from collections import Counter
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.data_model import PROCESSED_DATA_ROOT, Document, iter_documents, split_path
+from utils.gazetteer import (
+    Gazetteer,
+    add_gazetteer_args,
+    gazetteer_from_args,
+    normalize,
+)
+from utils.profiling import PROFILER, add_profiling_args, profiling
+
+LOCATION_SLOT = "incident_location"
+STATUSES = ["exact", "synonym", "completion", "contained", "unlocated", "unknown"]
+UNRESOLVED = ("unlocated", "unknown")
+
+
+def location_strings(doc: Document) -> List[str]:
+    """The distinct location strings of a document's templates, in order"""
+    strings = {}
+    for template in doc.templates:
+        for filler in template.fillers(LOCATION_SLOT):
+            for s in filler.strings or filler.strings_lhs or ():
+                strings[s] = None
+    return list(strings)
+
+
+def find_string(text: str, s: str) -> List[List[int]]:
+    """The spans of `s` in `text` as a whole word sequence, ignoring case"""
+    pattern = r"(?<![A-Za-z0-9])" + re.escape(s) + r"(?![A-Za-z0-9])"
+    return [[m.start(), m.end()] for m in re.finditer(pattern, text, re.IGNORECASE)]
+
+
+class LocationResolver:
+    def __init__(self, gazetteer: Gazetteer):
+        self.gazetteer = gazetteer
+        # canonical ID -> canonical IDs of its containing areas
+        self.ancestors = {}
+
+    def _ancestors(self, canonical: int) -> List[int]:
+        if canonical not in self.ancestors:
+            self.ancestors[canonical] = self.gazetteer.ancestors(canonical)
+        return self.ancestors[canonical]
+
+    def resolve_document(self, doc: Document) -> List[Dict[str, Any]]:
+        strings = location_strings(doc)
+        if not strings:
+            return []
+        g = self.gazetteer
+        # canonical ID -> (start, end, ID) of the mentions of its synonym class
+        mentioned = {}
+        for mention in g.find_mentions(doc.text):
+            mentioned.setdefault(g.canonical[mention[2]], []).append(mention)
+        return [self.resolve(s, doc.text, mentioned) for s in strings]
+
+    def resolve(
+        self, s: str, text: str, mentioned: Dict[int, List[Tuple[int, int, int]]]
+    ) -> Dict[str, Any]:
+        g = self.gazetteer
+        name = normalize(s)
+        id = g.lookup(name)
+        status, evidence = None, []
+        spans = find_string(text, name)
+        if spans:
+            status = "exact"
+        elif id is not None and g.canonical[id] in mentioned:
+            status = "synonym"
+            evidence = mentioned[g.canonical[id]]
+        elif id is None:
+            completions = {
+                g.canonical[i] for i in g.complete(name) if g.canonical[i] in mentioned
+            }
+            if len(completions) == 1:
+                id = completions.pop()
+                status = "completion"
+                evidence = mentioned[id]
+        if status is None and id is not None:
+            canonical = g.canonical[id]
+            evidence = sorted(
+                mention
+                for c, mentions in mentioned.items()
+                if canonical in self._ancestors(c)
+                for mention in mentions
+            )
+            status = "contained" if evidence else "unlocated"
+        result = {
+            "string": s,
+            "status": status or "unknown",
+            "spans": spans or [[start, end] for start, end, _ in evidence],
+            "evidence": list(dict.fromkeys(g.names[i] for _, _, i in evidence)),
+            "canonical": None,
+        }
+        if id is not None:
+            canonical = g.canonical[id]
+            result.update(
+                canonical=g.names[canonical],
+                types=list(g.types[id]),
+                containing_areas=[g.names[c] for c in self._ancestors(canonical)],
+            )
+        return result
+
+
+def resolve_split(
+    path: str, resolver: LocationResolver
+) -> Dict[str, List[Dict[str, Any]]]:
+    resolved = {}
+    for doc in iter_documents(path):
+        with PROFILER.section("location_resolution"):
+            locations = resolver.resolve_document(doc)
+        if locations:
+            resolved[doc.doc_id] = locations
+    return resolved
+
+
+def print_summary(
+    split: str,
+    resolved: Dict[str, List[Dict[str, Any]]],
+    unlocatable: Optional[Dict[str, List[str]]],
+) -> None:
+    counts = Counter(r["status"] for locations in resolved.values() for r in locations)
+    print(
+        f"Split {split}: "
+        + ", ".join(f"{counts[status]} {status}" for status in STATUSES)
+    )
+    if unlocatable is None:
+        return
+    # the report has the strings after preprocess.py's manual fixes, so
+    # compare by normalized string
+    statuses = {
+        (doc_id, normalize(r["string"])): r["status"]
+        for doc_id, locations in resolved.items()
+        for r in locations
+    }
+    reported = [
+        statuses.get((doc_id, normalize(s)), "unknown")
+        for doc_id, strings in unlocatable.items()
+        for s in strings
+    ]
+    num_resolved = sum(1 for status in reported if status not in UNRESOLVED)
+    print(
+        f"  {num_resolved} of the {len(reported)} unlocatable locations reported by preprocess.py were resolved"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=["train", "dev", "test"],
+        default=["train", "dev", "test"],
+        help="the splits to resolve",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed {split}/{split}.json files",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory to which {split}/{split}_resolved_locations.json are written",
+    )
+    add_gazetteer_args(parser)
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    with profiling(args):
+        resolver = LocationResolver(gazetteer_from_args(args))
+        for split in args.splits:
+            resolved = resolve_split(split_path(split, args.data_dir), resolver)
+            unlocatable_path = os.path.join(
+                args.data_dir, split, f"{split}_unlocatable_locations.json"
+            )
+            unlocatable = None
+            if os.path.exists(unlocatable_path):
+                with open(unlocatable_path) as f:
+                    unlocatable = json.load(f)
+            print_summary(split, resolved, unlocatable)
+            split_dir = os.path.join(args.output_dir, split)
+            os.makedirs(split_dir, exist_ok=True)
+            with open(
+                os.path.join(split_dir, f"{split}_resolved_locations.json"), "w"
+            ) as f:
+                json.dump(resolved, f, indent=4)
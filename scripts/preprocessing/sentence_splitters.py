@@ -0,0 +1,152 @@
+"""
+Interchangeable sentence splitters for preprocess.py. Each backend maps
+the text of a document section to (start, end) character spans of its
+sentences, with surrounding whitespace excluded:
+
+- spacy: spaCy's dependency parser-based splitter (en_core_web_sm), as
+  used by allennlp's SpacySentenceSplitter, which produced the sentence
+  splits in data/processed. The parser does badly on all-caps text, so
+  the text is lowercased first.
+- sentencizer: spaCy's rule-based sentencizer, which needs no model.
+- regex: a fast splitter for the uppercase MUC wire text that splits
+  after sentence-final punctuation unless it ends an abbreviation.
+
+Backends are looked up by name with get_sentence_splitter and only
+import spaCy when they are first used. The spaCy backends run on the
+NLP service (see scripts/utils/nlp_service.py) when it is running.
+"""
+import re
+
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import *
+
+from utils.nlp_service import prepare_pipeline, split_sentences
+
+Span = Tuple[int, int]
+
+# words that are followed by a period without ending the sentence
+ABBREVIATIONS = set("""
+    MR MRS MS DR PROF GEN LT COL MAJ CAPT SGT CPL ADM CMDR GOV SEN REP PRES
+    AMB REV FR MSGR ST MT NO NOS INC LTD CORP CO BROS JR SR VS
+    JAN FEB MAR APR AUG SEP SEPT OCT NOV DEC
+    """.split())
+
+# ., ? or ! (possibly repeated), optionally followed by closing quotes or
+# brackets, and then whitespace
+SENTENCE_END_RE = re.compile(r"[.?!]+[\"')\]]*(?=\s)")
+# initials and dotted abbreviations such as "A.", "U.S." or "CHILEAN-U.S."
+DOTTED_RE = re.compile(r"(?:^|[-\"'(])(?:[A-Z]\.)+$")
+
+
+def _strip(text: str, start: int, end: int) -> Optional[Span]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if start < end else None
+
+
+class SentenceSplitter(ABC):
+    name = None
+
+    @abstractmethod
+    def split(self, text: str) -> List[Span]:
+        """Returns the spans of the sentences in `text`, in order"""
+
+    def split_all(self, texts: List[str]) -> List[List[Span]]:
+        """split, over a batch of texts"""
+        return [self.split(text) for text in texts]
+
+    def split_sentences(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split(text)]
+
+
+class _SpacySplitter(SentenceSplitter):
+    # the name of the pipeline in nlp_service.PIPELINES
+    pipeline = None
+    lowercase = False
+
+    def __init__(self):
+        prepare_pipeline(self.pipeline)
+
+    def split(self, text: str) -> List[Span]:
+        return self.split_all([text])[0]
+
+    def split_all(self, texts: List[str]) -> List[List[Span]]:
+        sentences = split_sentences(
+            [text.lower() if self.lowercase else text for text in texts],
+            self.pipeline,
+        )
+        return [
+            [
+                span
+                for span in (_strip(text, start, end) for start, end in spans)
+                if span is not None
+            ]
+            for text, spans in zip(texts, sentences)
+        ]
+
+
+class SpacyParserSplitter(_SpacySplitter):
+    name = "spacy"
+    pipeline = "en_core_web_sm_parser"
+    lowercase = True
+
+
+class SpacySentencizerSplitter(_SpacySplitter):
+    name = "sentencizer"
+    pipeline = "sentencizer"
+
+
+class RegexSplitter(SentenceSplitter):
+    name = "regex"
+
+    def __init__(self, abbreviations: Set[str] = ABBREVIATIONS):
+        self.abbreviations = abbreviations
+
+    def is_abbreviation(self, text: str, start: int, end: int) -> bool:
+        """Whether the period ending at `end` belongs to an abbreviation"""
+        if text[end - 1] != ".":
+            return False
+        word_start = text.rfind(" ", 0, start) + 1
+        word = text[word_start:end]
+        if word.endswith("..."):
+            # an ellipsis (possibly followed by a period) trails off
+            return True
+        return (
+            word.rstrip(".").lstrip("\"'(") in self.abbreviations
+            or DOTTED_RE.search(word) is not None
+        )
+
+    def split(self, text: str) -> List[Span]:
+        boundaries = []
+        for match in SENTENCE_END_RE.finditer(text):
+            punctuation_end = match.start() + len(match.group().rstrip("\"')]"))
+            if not self.is_abbreviation(text, match.start(), punctuation_end):
+                boundaries.append(match.end())
+        boundaries.append(len(text))
+
+        spans = []
+        start = 0
+        for end in boundaries:
+            span = _strip(text, start, end)
+            start = end
+            if span is not None:
+                spans.append(span)
+        return spans
+
+
+SENTENCE_SPLITTERS = {
+    cls.name: cls
+    for cls in [SpacyParserSplitter, SpacySentencizerSplitter, RegexSplitter]
+}
+
+
+@lru_cache(maxsize=None)
+def get_sentence_splitter(name: str) -> SentenceSplitter:
+    if name not in SENTENCE_SPLITTERS:
+        raise ValueError(
+            f"Unknown sentence splitter {name!r}; choose from {', '.join(SENTENCE_SPLITTERS)}"
+        )
+    return SENTENCE_SPLITTERS[name]()
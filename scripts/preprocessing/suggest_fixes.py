@@ -0,0 +1,164 @@
+"""
+Suggests fixes for the filler strings that preprocess.py could not find
+verbatim in their documents, i.e. those in the
+{split}_unlocatable_{entities,locations}.json reports. Each one is
+matched approximately against its document's text (see
+scripts/utils/approximate_match.py), tolerating typos, token
+reorderings and differences in whitespace and punctuation, e.g.
+
+    "RUTH ESPERANA AGUILAR MARROQUIN" -> "RUTH ESPERANZA AGUILAR MARROQUIN"
+
+For every split, the ranked candidate spans of each string are written
+to {split}/{split}_fix_suggestions.json, and the best fix of each string
+is printed in the format of preprocess.MANUAL_FIXES, closest first, for
+review before pasting. Run from the project root:
+
+    python scripts/preprocessing/suggest_fixes.py --splits dev test
+"""
+import argparse
+import json
+import os
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.approximate_match import NormalizedText, find_matches
+from utils.data_model import PROCESSED_DATA_ROOT, iter_documents, split_path
+from utils.profiling import PROFILER, add_profiling_args, profiling
+
+REPORTS = ["entities", "locations"]
+
+
+def load_unlocatable(split: str, data_dir: str) -> Dict[str, List[str]]:
+    """The unlocatable strings of each document, from both reports"""
+    unlocatable = {}
+    for report in REPORTS:
+        path = os.path.join(data_dir, split, f"{split}_unlocatable_{report}.json")
+        if not os.path.exists(path):
+            print(f"WARNING: {path} not found")
+            continue
+        with open(path) as f:
+            for doc_id, strings in json.load(f).items():
+                unlocatable.setdefault(doc_id, []).extend(strings)
+    return unlocatable
+
+
+def suggest_split(
+    path: str,
+    unlocatable: Dict[str, List[str]],
+    max_error_rate: float,
+    top: int,
+) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    Returns the `top` candidate fixes of each unlocatable string, by
+    document ID. Strings without any candidate are left out.
+    """
+    suggestions = {}
+    for doc in iter_documents(path):
+        strings = unlocatable.get(doc.doc_id)
+        if not strings:
+            continue
+        text = NormalizedText(doc.text)
+        for s in dict.fromkeys(strings):
+            with PROFILER.section("approximate_matching"):
+                matches = find_matches(s, text, max_error_rate)[:top]
+            if matches:
+                suggestions.setdefault(doc.doc_id, {})[s] = [
+                    {
+                        "fix": doc.text[m.start : m.end],
+                        "span": [m.start, m.end],
+                        "distance": m.distance,
+                        "method": m.method,
+                    }
+                    for m in matches
+                ]
+    return suggestions
+
+
+def best_fixes(
+    suggestions: Dict[str, Dict[str, List[Dict[str, Any]]]],
+) -> List[Tuple[str, Dict[str, Any], str]]:
+    """
+    The best candidate of every string across documents, as (string,
+    candidate, document ID) triples, closest first
+    """
+    best = {}
+    for doc_id, candidates in suggestions.items():
+        for s, ranked in candidates.items():
+            if s not in best or ranked[0]["distance"] < best[s][1]["distance"]:
+                best[s] = (s, ranked[0], doc_id)
+    return sorted(best.values(), key=lambda x: (x[1]["distance"], x[0]))
+
+
+def format_manual_fixes(fixes: List[Tuple[str, Dict[str, Any], str]]) -> str:
+    lines = ["MANUAL_FIXES = {"]
+    for s, candidate, doc_id in fixes:
+        lines.append(
+            f"    {json.dumps(s)}: {json.dumps(candidate['fix'])},  "
+            f"# {doc_id}, {candidate['method']}, distance {candidate['distance']}"
+        )
+    lines.append("}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=["train", "dev", "test"],
+        default=["train", "dev", "test"],
+        help="the splits whose unlocatable strings to match",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed splits and their unlocatable mention reports",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory to which {split}/{split}_fix_suggestions.json are written",
+    )
+    parser.add_argument(
+        "--max-error-rate",
+        type=float,
+        default=0.15,
+        help="the most edits a match may take, per character of the normalized string",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=3,
+        help="number of candidates to keep per string",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    with profiling(args):
+        for split in args.splits:
+            unlocatable = load_unlocatable(split, args.data_dir)
+            suggestions = suggest_split(
+                split_path(split, args.data_dir),
+                unlocatable,
+                args.max_error_rate,
+                args.top,
+            )
+            split_dir = os.path.join(args.output_dir, split)
+            os.makedirs(split_dir, exist_ok=True)
+            with open(
+                os.path.join(split_dir, f"{split}_fix_suggestions.json"), "w"
+            ) as f:
+                json.dump(suggestions, f, indent=4)
+            fixes = best_fixes(suggestions)
+            num_strings = len({s for strings in unlocatable.values() for s in strings})
+            print(
+                f"Split {split}: found candidate fixes for {len(fixes)} of {num_strings} unlocatable strings"
+            )
+            if fixes:
+                print(format_manual_fixes(fixes))
@@ -0,0 +1,220 @@
+"""
+Approximate matching of filler strings against document text, for
+finding what a filler that does not occur verbatim was meant to point
+to (see scripts/preprocessing/suggest_fixes.py). Both sides are
+normalized first: upper-cased, with every run of whitespace and
+punctuation collapsed to a single space, so that those differences cost
+nothing. What remains is matched in two ways:
+
+- by edit distance, with Myers' bit-parallel algorithm: the pattern's
+  column of the edit distance matrix is kept as bit vectors in Python
+  ints, so each text character costs a handful of integer operations
+  regardless of the pattern's length, and a whole document is searched
+  in a single pass. Matches are widened to whole tokens.
+- by token reordering ("GACHA GONZALO RODRIGUEZ"), comparing the sorted
+  tokens of every window of as many text tokens as the pattern has
+
+Matches are returned as character spans of the original text.
+"""
+import re
+
+from collections import Counter
+from typing import *
+
+# a run of letters and digits
+TOKEN_RE = re.compile(r"[^\W_]+")
+METHODS = ["edit", "reordered"]
+
+
+class Match(NamedTuple):
+    start: int
+    end: int
+    distance: int
+    method: str
+
+
+class NormalizedText:
+    """
+    `text` upper-cased, with its tokens joined by single spaces, and the
+    offset in the original text of every normalized character
+    """
+
+    __slots__ = ("text", "offsets", "tokens")
+
+    def __init__(self, original: str):
+        chars, offsets, tokens = [], [], []
+        for m in TOKEN_RE.finditer(original):
+            if chars:
+                # the separator stands for the gap before the token
+                chars.append(" ")
+                offsets.append(offsets[-1] + 1)
+            start = len(chars)
+            chars.extend(m.group().upper())
+            offsets.extend(range(m.start(), m.end()))
+            tokens.append((start, len(chars)))
+        self.text = "".join(chars)
+        self.offsets = offsets
+        # (start, end) of every token in the normalized text
+        self.tokens = tokens
+
+    def snap(self, start: int, end: int) -> Tuple[int, int]:
+        """Widens a span of the normalized text to whole tokens"""
+        while start > 0 and self.text[start - 1] != " ":
+            start -= 1
+        while end < len(self.text) and self.text[end] != " ":
+            end += 1
+        return start, end
+
+    def original_span(self, start: int, end: int) -> Tuple[int, int]:
+        """Maps a span of the normalized text to one of the original text"""
+        while start < end and self.text[start] == " ":
+            start += 1
+        while end > start and self.text[end - 1] == " ":
+            end -= 1
+        if start == end:
+            return self.offsets[start], self.offsets[start]
+        return self.offsets[start], self.offsets[end - 1] + 1
+
+
+def normalize(s: str) -> str:
+    return " ".join(m.group().upper() for m in TOKEN_RE.finditer(s))
+
+
+def edit_distances(pattern: str, text: str, anchored: bool = False) -> List[int]:
+    """
+    Returns, for every i, the edit distance between `pattern` and the
+    best substring of `text` ending at i + 1 (Myers, 1999), or, if
+    `anchored`, text[: i + 1] itself
+    """
+    m = len(pattern)
+    if m == 0:
+        return list(range(1, len(text) + 1)) if anchored else [0] * len(text)
+    peq = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    distances = []
+    for c in text:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # anchoring adds a row of 0, 1, 2, ... above the matrix, in place
+        # of the row of zeros that lets a match start anywhere
+        ph = ((ph << 1) | anchored) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        distances.append(score)
+    return distances
+
+
+def edit_distance(a: str, b: str) -> int:
+    return edit_distances(a, b, anchored=True)[-1] if b else len(a)
+
+
+def _local_minima(distances: List[int], max_distance: int) -> Iterator[int]:
+    """Indices of the ends of the best matches within `max_distance`"""
+    n = len(distances)
+    for i, d in enumerate(distances):
+        if d > max_distance:
+            continue
+        if i > 0 and distances[i - 1] < d:
+            continue
+        if i + 1 < n and distances[i + 1] <= d:
+            continue
+        yield i
+
+
+def search_edits(
+    pattern: str, text: NormalizedText, max_distance: int
+) -> Iterator[Match]:
+    """Yields the best matches of (normalized) `pattern` in `text` within `max_distance` edits"""
+    distances = edit_distances(pattern, text.text)
+    for end in _local_minima(distances, max_distance):
+        distance = distances[end]
+        end += 1
+        # the start of the match: search backwards from its end for the
+        # longest prefix of the reversed window that is as close
+        window_start = max(0, end - len(pattern) - distance)
+        window = text.text[window_start:end][::-1]
+        backwards = edit_distances(pattern[::-1], window, anchored=True)
+        start = end - max(i for i, d in enumerate(backwards) if d == distance) - 1
+        # a fix has to be a whole sequence of tokens, so partial tokens at
+        # either end are taken in whole, at the cost of more edits
+        start, end = text.snap(start, end)
+        distance = edit_distance(pattern, text.text[start:end])
+        if distance <= max_distance:
+            yield Match(*text.original_span(start, end), distance, "edit")
+
+
+def search_reorderings(
+    pattern: str, text: NormalizedText, max_distance: int
+) -> Iterator[Match]:
+    """
+    Yields the windows of as many tokens as `pattern` has, in any order,
+    whose sorted tokens are within `max_distance` edits of the pattern's
+    """
+    tokens = pattern.split()
+    n = len(tokens)
+    if n < 2 or len(text.tokens) < n:
+        return
+    target = Counter(tokens)
+    sorted_pattern = " ".join(sorted(tokens))
+    words = [text.text[s:e] for s, e in text.tokens]
+    window = Counter(words[:n])
+    for i in range(len(words) - n + 1):
+        if i > 0:
+            window[words[i - 1]] -= 1
+            window[words[i + n - 1]] += 1
+        # at most one token may differ, and windows in pattern order are
+        # left to search_edits
+        if sum((target - window).values()) > 1 or words[i : i + n] == tokens:
+            continue
+        distance = edit_distance(sorted_pattern, " ".join(sorted(words[i : i + n])))
+        if distance <= max_distance:
+            start, end = text.original_span(
+                text.tokens[i][0], text.tokens[i + n - 1][1]
+            )
+            yield Match(start, end, distance, "reordered")
+
+
+def max_distance_for(pattern: str, max_error_rate: float) -> int:
+    return int(len(pattern) * max_error_rate)
+
+
+def find_matches(
+    mention: str,
+    text: Union[str, NormalizedText],
+    max_error_rate: float = 0.15,
+) -> List[Match]:
+    """
+    Returns the approximate matches of `mention` in `text`, best first, at
+    most one per span. Matches may have distance 0 if `mention` differs
+    from them in case, whitespace or punctuation only.
+    """
+    if isinstance(text, str):
+        text = NormalizedText(text)
+    pattern = normalize(mention)
+    if not pattern:
+        return []
+    max_distance = max_distance_for(pattern, max_error_rate)
+    best = {}
+    for match in [
+        *search_edits(pattern, text, max_distance),
+        *search_reorderings(pattern, text, max_distance),
+    ]:
+        span = (match.start, match.end)
+        if span not in best or match.distance < best[span].distance:
+            best[span] = match
+    return sorted(
+        best.values(),
+        key=lambda m: (m.distance, METHODS.index(m.method), m.start),
+    )
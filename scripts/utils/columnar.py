@@ -0,0 +1,476 @@
+"""
+Columnar (NumPy .npz) encoding of the processed splits in
+data/processed/{split}/{split}.json.
+
+Each split is flattened into a handful of tables whose columns are
+stored as flat NumPy arrays, with "*_offsets" arrays (CSR style) giving
+the rows belonging to each parent row:
+
+    docs               doc_id, text, section_offsets, sentence_offsets,
+                       template_offsets
+    section_spans      (start, end) int32
+    sentence_spans     (start, end) int32
+    templates          template_doc, template_incident_type, slot_offsets
+    slots              slot_name, slot_kind, slot_value, slot_filler_offsets
+    fillers            filler_template, filler_slot, filler_type,
+                       filler_layout, filler_optional, filler_string_offsets,
+                       filler_mention_offsets, filler_sentence_mention_offsets
+    filler_strings     filler_string, filler_string_side
+    mentions           (start, end) int32 document-level mention spans
+    sentence_mentions  sentence_mention_sentence, (start, end) int32
+
+All strings (document IDs and texts, slot names, filler strings, ...) are
+stored once in a string pool and referenced by index. load_split returns
+exactly the nested Python view that preprocess.py writes as JSON, while
+load_columns gives direct access to the arrays for vectorized analysis.
+
+To convert the existing JSON splits, run from the project root:
+
+    python scripts/utils/columnar.py --splits dev test
+"""
+import argparse
+import json
+import numpy as np
+import os
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.profiling import PROFILER, add_profiling_args, profiling
+
+PROCESSED_DATA_ROOT = "data/processed/"
+SPLITS = ["train", "dev", "test"]
+
+# how the value of a template slot is encoded in slot_kind/slot_value
+SLOT_NONE = 0  # null
+SLOT_FILLER_LIST = 1  # list of filler dicts
+SLOT_FILLER = 2  # a single filler dict (e.g. incident_stage_of_execution)
+SLOT_STRING = 3  # slot_value indexes the string pool (e.g. incident_type)
+SLOT_INT = 4  # slot_value is the integer itself (e.g. message_template)
+SLOT_BOOL = 5  # slot_value is 0 or 1 (e.g. message_template_optional)
+
+# bit flags in filler_layout recording which keys a filler dict has
+HAS_STRINGS = 1
+HAS_COLON_CLAUSE = 2  # strings_lhs and strings_rhs
+HAS_MENTIONS = 4  # document_mentions and sentence_mentions
+
+# values of filler_string_side
+SIDE_STRINGS = 0
+SIDE_LHS = 1
+SIDE_RHS = 2
+STRING_KEYS = {
+    SIDE_STRINGS: "strings",
+    SIDE_LHS: "strings_lhs",
+    SIDE_RHS: "strings_rhs",
+}
+
+
+def columnar_path(split: str, data_root: str = PROCESSED_DATA_ROOT) -> str:
+    return os.path.join(data_root, split, f"{split}.npz")
+
+
+class _StringPool:
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def __call__(self, s: str) -> int:
+        idx = self.index.get(s)
+        if idx is None:
+            idx = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return idx
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        # offsets are in characters, so that the decoded text can be sliced
+        lengths = np.fromiter(map(len, self.strings), np.int64, len(self.strings))
+        offsets = np.zeros(len(self.strings) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return {
+            "string_data": np.frombuffer(
+                "".join(self.strings).encode("utf-8"), dtype=np.uint8
+            ),
+            "string_offsets": offsets,
+        }
+
+
+def _spans(spans: List[List[int]]) -> np.ndarray:
+    return np.asarray(spans, dtype=np.int32).reshape(-1, 2)
+
+
+def _offsets(counts: List[int]) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def encode_split(data: Dict[str, Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Flattens a processed split (as loaded from JSON) into columns"""
+    pool = _StringPool()
+    cols = {
+        name: []
+        for name in [
+            "doc_id",
+            "text",
+            "doc_sections",
+            "doc_sentences",
+            "doc_templates",
+            "section_spans",
+            "sentence_spans",
+            "template_doc",
+            "template_incident_type",
+            "template_slots",
+            "slot_name",
+            "slot_kind",
+            "slot_value",
+            "slot_fillers",
+            "filler_template",
+            "filler_slot",
+            "filler_type",
+            "filler_layout",
+            "filler_optional",
+            "filler_strings",
+            "filler_mentions",
+            "filler_sentence_mentions",
+            "filler_string",
+            "filler_string_side",
+            "mention_spans",
+            "sentence_mention_sentence",
+            "sentence_mention_spans",
+        ]
+    }
+
+    def add_filler(filler: Dict[str, Any], template_idx: int, slot: str) -> None:
+        layout = 0
+        num_strings = 0
+        for side, key in STRING_KEYS.items():
+            if key in filler:
+                layout |= HAS_STRINGS if side == SIDE_STRINGS else HAS_COLON_CLAUSE
+                for s in filler[key]:
+                    cols["filler_string"].append(pool(s))
+                    cols["filler_string_side"].append(side)
+                num_strings += len(filler[key])
+        num_sentence_mentions = 0
+        if "document_mentions" in filler:
+            layout |= HAS_MENTIONS
+            cols["mention_spans"].extend(filler["document_mentions"])
+            for sent_idx, spans in filler["sentence_mentions"].items():
+                cols["sentence_mention_sentence"].extend([int(sent_idx)] * len(spans))
+                cols["sentence_mention_spans"].extend(spans)
+                num_sentence_mentions += len(spans)
+        cols["filler_template"].append(template_idx)
+        cols["filler_slot"].append(pool(slot))
+        cols["filler_type"].append(pool(filler["type"]))
+        cols["filler_layout"].append(layout)
+        cols["filler_optional"].append(int(filler.get("optional", -1)))
+        cols["filler_strings"].append(num_strings)
+        cols["filler_mentions"].append(len(filler.get("document_mentions", [])))
+        cols["filler_sentence_mentions"].append(num_sentence_mentions)
+
+    for doc_idx, (doc_id, doc) in enumerate(data.items()):
+        cols["doc_id"].append(pool(doc_id))
+        cols["text"].append(pool(doc["text"]))
+        cols["doc_sections"].append(len(doc["sections"]))
+        cols["section_spans"].extend(doc["sections"])
+        cols["doc_sentences"].append(len(doc["sentences"]))
+        cols["sentence_spans"].extend(doc["sentences"])
+        cols["doc_templates"].append(len(doc["templates"]))
+        for template in doc["templates"]:
+            template_idx = len(cols["template_doc"])
+            cols["template_doc"].append(doc_idx)
+            cols["template_incident_type"].append(pool(template["incident_type"]))
+            cols["template_slots"].append(len(template))
+            for slot, value in template.items():
+                cols["slot_name"].append(pool(slot))
+                num_fillers = 0
+                if value is None:
+                    kind, encoded = SLOT_NONE, 0
+                elif isinstance(value, list):
+                    kind, encoded = SLOT_FILLER_LIST, 0
+                    for filler in value:
+                        add_filler(filler, template_idx, slot)
+                    num_fillers = len(value)
+                elif isinstance(value, dict):
+                    kind, encoded = SLOT_FILLER, 0
+                    add_filler(value, template_idx, slot)
+                    num_fillers = 1
+                elif isinstance(value, str):
+                    kind, encoded = SLOT_STRING, pool(value)
+                elif isinstance(value, bool):
+                    kind, encoded = SLOT_BOOL, int(value)
+                elif isinstance(value, int):
+                    kind, encoded = SLOT_INT, value
+                else:
+                    raise ValueError(
+                        f"Unsupported value {value!r} for slot {slot} in document {doc_id}"
+                    )
+                cols["slot_kind"].append(kind)
+                cols["slot_value"].append(encoded)
+                cols["slot_fillers"].append(num_fillers)
+
+    arrays = {
+        "doc_id": np.asarray(cols["doc_id"], dtype=np.int32),
+        "text": np.asarray(cols["text"], dtype=np.int32),
+        "section_offsets": _offsets(cols["doc_sections"]),
+        "sentence_offsets": _offsets(cols["doc_sentences"]),
+        "template_offsets": _offsets(cols["doc_templates"]),
+        "section_spans": _spans(cols["section_spans"]),
+        "sentence_spans": _spans(cols["sentence_spans"]),
+        "template_doc": np.asarray(cols["template_doc"], dtype=np.int32),
+        "template_incident_type": np.asarray(
+            cols["template_incident_type"], dtype=np.int32
+        ),
+        "slot_offsets": _offsets(cols["template_slots"]),
+        "slot_name": np.asarray(cols["slot_name"], dtype=np.int32),
+        "slot_kind": np.asarray(cols["slot_kind"], dtype=np.int8),
+        "slot_value": np.asarray(cols["slot_value"], dtype=np.int64),
+        "slot_filler_offsets": _offsets(cols["slot_fillers"]),
+        "filler_template": np.asarray(cols["filler_template"], dtype=np.int32),
+        "filler_slot": np.asarray(cols["filler_slot"], dtype=np.int32),
+        "filler_type": np.asarray(cols["filler_type"], dtype=np.int32),
+        "filler_layout": np.asarray(cols["filler_layout"], dtype=np.int8),
+        "filler_optional": np.asarray(cols["filler_optional"], dtype=np.int8),
+        "filler_string_offsets": _offsets(cols["filler_strings"]),
+        "filler_mention_offsets": _offsets(cols["filler_mentions"]),
+        "filler_sentence_mention_offsets": _offsets(cols["filler_sentence_mentions"]),
+        "filler_string": np.asarray(cols["filler_string"], dtype=np.int32),
+        "filler_string_side": np.asarray(cols["filler_string_side"], dtype=np.int8),
+        "mention_spans": _spans(cols["mention_spans"]),
+        "sentence_mention_sentence": np.asarray(
+            cols["sentence_mention_sentence"], dtype=np.int32
+        ),
+        "sentence_mention_spans": _spans(cols["sentence_mention_spans"]),
+    }
+    arrays.update(pool.to_arrays())
+    return arrays
+
+
+def write_columns(
+    data: Dict[str, Dict[str, Any]], path: str, compress: bool = False
+) -> None:
+    """Writes a processed split to a .npz file"""
+    arrays = encode_split(data)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with PROFILER.section("npz_write"):
+        if compress:
+            np.savez_compressed(path, **arrays)
+        else:
+            np.savez(path, **arrays)
+
+
+def load_columns(path: str) -> Dict[str, np.ndarray]:
+    """Reads all columns of a .npz split into memory"""
+    with PROFILER.section("npz_load"), np.load(path) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def decode_strings(columns: Dict[str, np.ndarray]) -> List[str]:
+    """Returns the string pool, which the string-valued columns index into"""
+    text = columns["string_data"].tobytes().decode("utf-8")
+    offsets = columns["string_offsets"].tolist()
+    return [text[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+# (offsets column, columns of the child table it indexes into), listed
+# with parent tables before their children
+_CHILD_TABLES = [
+    ("section_offsets", ["section_spans"]),
+    ("sentence_offsets", ["sentence_spans"]),
+    ("template_offsets", ["template_doc", "template_incident_type", "slot_offsets"]),
+    ("slot_offsets", ["slot_name", "slot_kind", "slot_value", "slot_filler_offsets"]),
+    (
+        "slot_filler_offsets",
+        [
+            "filler_template",
+            "filler_slot",
+            "filler_type",
+            "filler_layout",
+            "filler_optional",
+            "filler_string_offsets",
+            "filler_mention_offsets",
+            "filler_sentence_mention_offsets",
+        ],
+    ),
+    ("filler_string_offsets", ["filler_string", "filler_string_side"]),
+    ("filler_mention_offsets", ["mention_spans"]),
+    (
+        "filler_sentence_mention_offsets",
+        ["sentence_mention_sentence", "sentence_mention_spans"],
+    ),
+]
+_DOC_COLUMNS = [
+    "doc_id",
+    "text",
+    "section_offsets",
+    "sentence_offsets",
+    "template_offsets",
+]
+
+
+def slice_documents(
+    columns: Dict[str, np.ndarray], start: int, end: int
+) -> Dict[str, np.ndarray]:
+    """
+    Returns the columns of documents start, ..., end - 1 only, with offsets
+    rebased to the sliced tables. Template and filler indices (template_doc,
+    filler_template) keep referring to rows of the full split. The string
+    pool is shared, not sliced.
+    """
+    sliced = {name: columns[name][start:end] for name in _DOC_COLUMNS}
+    for name in _DOC_COLUMNS[2:]:
+        sliced[name] = columns[name][start : end + 1]
+    for offsets_name, child_names in _CHILD_TABLES:
+        offsets = sliced[offsets_name]
+        row_start, row_end = int(offsets[0]), int(offsets[-1])
+        sliced[offsets_name] = offsets - row_start
+        for name in child_names:
+            rows = columns[name][row_start:row_end]
+            if name.endswith("_offsets"):
+                # children of this table are sliced in a later iteration
+                rows = columns[name][row_start : row_end + 1]
+            sliced[name] = rows
+    for name in ["string_data", "string_offsets"]:
+        if name in columns:
+            sliced[name] = columns[name]
+    return sliced
+
+
+def decode_split(
+    columns: Dict[str, np.ndarray], strings: Optional[Sequence[str]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Rebuilds the nested view of a split (as written by preprocess.py). By
+    default the whole string pool is decoded; pass any sequence of strings
+    to look them up elsewhere.
+    """
+    if strings is None:
+        strings = decode_strings(columns)
+    # tolist() once up front; indexing NumPy arrays element-wise is slow
+    c = {
+        name: a.tolist()
+        for name, a in columns.items()
+        if name not in {"string_data", "string_offsets"}
+    }
+
+    def decode_filler(f: int) -> Dict[str, Any]:
+        filler = {}
+        if c["filler_optional"][f] >= 0:
+            filler["optional"] = bool(c["filler_optional"][f])
+        filler["type"] = strings[c["filler_type"][f]]
+        layout = c["filler_layout"][f]
+        if layout & HAS_STRINGS:
+            filler["strings"] = []
+        if layout & HAS_COLON_CLAUSE:
+            filler["strings_lhs"] = []
+            filler["strings_rhs"] = []
+        start, end = c["filler_string_offsets"][f : f + 2]
+        for s, side in zip(
+            c["filler_string"][start:end], c["filler_string_side"][start:end]
+        ):
+            filler[STRING_KEYS[side]].append(strings[s])
+        if layout & HAS_MENTIONS:
+            start, end = c["filler_mention_offsets"][f : f + 2]
+            filler["document_mentions"] = c["mention_spans"][start:end]
+            sentence_mentions = {}
+            start, end = c["filler_sentence_mention_offsets"][f : f + 2]
+            for sent_idx, span in zip(
+                c["sentence_mention_sentence"][start:end],
+                c["sentence_mention_spans"][start:end],
+            ):
+                sentence_mentions.setdefault(str(sent_idx), []).append(span)
+            filler["sentence_mentions"] = sentence_mentions
+        return filler
+
+    data = {}
+    for d in range(len(c["doc_id"])):
+        templates = []
+        for t in range(*c["template_offsets"][d : d + 2]):
+            template = {}
+            for s in range(*c["slot_offsets"][t : t + 2]):
+                kind, value = c["slot_kind"][s], c["slot_value"][s]
+                fillers = range(*c["slot_filler_offsets"][s : s + 2])
+                if kind == SLOT_NONE:
+                    value = None
+                elif kind == SLOT_FILLER_LIST:
+                    value = [decode_filler(f) for f in fillers]
+                elif kind == SLOT_FILLER:
+                    value = decode_filler(fillers[0])
+                elif kind == SLOT_STRING:
+                    value = strings[value]
+                elif kind == SLOT_BOOL:
+                    value = bool(value)
+                template[strings[c["slot_name"][s]]] = value
+            templates.append(template)
+        data[strings[c["doc_id"][d]]] = {
+            "text": strings[c["text"][d]],
+            "sections": c["section_spans"][slice(*c["section_offsets"][d : d + 2])],
+            "sentences": c["sentence_spans"][slice(*c["sentence_offsets"][d : d + 2])],
+            "templates": templates,
+        }
+    return data
+
+
+def load_split(split: str, data_root: str = PROCESSED_DATA_ROOT) -> Dict[str, Any]:
+    """
+    Loads a processed split, preferring the .npz encoding and falling back
+    to the JSON file if the former has not been written or is older.
+    """
+    path = columnar_path(split, data_root)
+    json_path = os.path.join(data_root, split, f"{split}.json")
+    if os.path.exists(path):
+        # the JSON file is rewritten by preprocess.py runs without --columnar
+        stale = os.path.exists(json_path) and (
+            os.path.getmtime(path) < os.path.getmtime(json_path)
+        )
+        if not stale:
+            return decode_split(load_columns(path))
+        print(f"WARNING: {path} is older than {json_path}; loading the latter")
+    with open(json_path) as f, PROFILER.section("json_load"):
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=SPLITS,
+        default=SPLITS,
+        help="the splits to convert",
+    )
+    parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed {split}/{split}.json files; the .npz files are written alongside them",
+    )
+    parser.add_argument(
+        "--compress", action="store_true", help="write compressed .npz files"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="verify that each .npz file decodes to the same data as its JSON file",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    with profiling(args):
+        for split in args.splits:
+            json_path = os.path.join(args.data_root, split, f"{split}.json")
+            if not os.path.exists(json_path):
+                print(f"WARNING: {json_path} not found; skipping split {split}")
+                continue
+            with open(json_path) as f, PROFILER.section("json_load"):
+                data = json.load(f)
+            path = columnar_path(split, args.data_root)
+            write_columns(data, path, args.compress)
+            print(f"Wrote {len(data)} documents to {path}")
+            # compare serializations so that key order is checked too
+            if args.check and json.dumps(
+                decode_split(load_columns(path))
+            ) != json.dumps(data):
+                raise ValueError(f"{path} does not round-trip to {json_path}")
@@ -0,0 +1,555 @@
+"""
+Reading and writing archives of Concrete Communications with a choice of
+Thrift protocol, container format and compression, so that the archives
+in data/concrete and predictions/*/concrete can be traded off between
+size and speed (see scripts/benchmarks/concrete_serialization.py):
+
+- protocol: "compact" (concrete-python's default, which all existing
+  archives use) or "binary", which is larger and, with thrift's
+  accelerated codecs, no faster
+- format: "zip", "tar.gz" or "dir" (a directory of .concrete files)
+- compression (zip only): "stored" (no compression, as written by
+  concrete's CommunicationWriterZip), "deflated", "bzip2" or "lzma",
+  with an optional level. tar.gz archives take a gzip level.
+
+Readers detect the protocol of each Communication from its first byte,
+so archives written with either protocol can be read without options.
+
+Long conversions can checkpoint their archive (see add_checkpoint_args):
+CommunicationArchiveWriter.checkpoint records the members written so
+far in a {path}.checkpoint.json file next to it, and brings the archive
+into a state it can be recovered from if the process dies before the
+next checkpoint. A writer opened with resume=True restores the archive
+as of the last checkpoint and appends to it; `completed` tells which
+members need not be written again.
+
+Archives can also be made reproducible, so that converting the same
+input twice gives the same bytes: ArchiveOptions.timestamp fixes the
+modification time of the members (and of a tar.gz's gzip header), and
+set_timestamps and assign_content_uuids replace the current time and the
+random UUIDs within each Communication. A {path}.hashes.json file next
+to an archive can record a content hash of the input of each member
+(see write_hashes), so that an update only needs to convert the inputs
+whose hash changed and can copy the other members from the previous
+archive (see set_aside).
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+import zlib
+
+from concrete import UUID, AnnotationMetadata, Communication
+from concrete.util.concrete_uuid import join_uuid
+from concrete.util.references import add_references_to_communication
+from io import BytesIO
+from thrift import TSerialization
+from thrift.protocol.TBinaryProtocol import TBinaryProtocolAcceleratedFactory
+from thrift.protocol.TCompactProtocol import TCompactProtocolAcceleratedFactory
+from typing import *
+
+from utils.profiling import PROFILER
+
+PROTOCOL_FACTORIES = {
+    "compact": TCompactProtocolAcceleratedFactory(),
+    "binary": TBinaryProtocolAcceleratedFactory(),
+}
+ZIP_COMPRESSION = {
+    "stored": zipfile.ZIP_STORED,
+    "deflated": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+FORMATS = ["zip", "tar.gz", "dir"]
+EXTENSIONS = {"zip": ".zip", "tar.gz": ".tar.gz", "dir": ""}
+# gzip's own default
+DEFAULT_GZIP_LEVEL = 9
+DEFAULT_CHECKPOINT_EVERY = 100
+# the earliest time a zip archive can record
+ZIP_EPOCH = 315532800
+
+
+class ArchiveOptions(NamedTuple):
+    format: str = "zip"
+    protocol: str = "compact"
+    compression: str = "stored"
+    compression_level: Optional[int] = None
+    # seconds since the epoch; None for the current time
+    timestamp: Optional[int] = None
+
+    @classmethod
+    def from_args(cls, args, default_format: str = "zip") -> "ArchiveOptions":
+        return cls(
+            args.output_format or default_format,
+            args.protocol,
+            args.compression,
+            args.compression_level,
+            args.timestamp,
+        )
+
+
+def archive_path(stem: str, format: str) -> str:
+    """e.g. data/concrete/lowercase/dev -> data/concrete/lowercase/dev.zip"""
+    return stem + EXTENSIONS[format]
+
+
+def infer_format(path: str, default: str = "zip") -> str:
+    if path.endswith(".zip"):
+        return "zip"
+    if path.endswith(".tar.gz") or path.endswith(".tgz"):
+        return "tar.gz"
+    if os.path.isdir(path):
+        return "dir"
+    return default
+
+
+def serialize_communication(comm: Communication, protocol: str = "compact") -> bytes:
+    return TSerialization.serialize(comm, protocol_factory=PROTOCOL_FACTORIES[protocol])
+
+
+def detect_protocol(data: bytes) -> str:
+    # A Communication starts with its id (field 1, a string). The binary
+    # protocol writes the field type (11) as a byte of its own, while the
+    # compact protocol packs the field id delta and type into one (0x18).
+    return "binary" if data[:1] == b"\x0b" else "compact"
+
+
+def deserialize_communication(
+    data: bytes, protocol: Optional[str] = None, add_references: bool = True
+) -> Communication:
+    comm = TSerialization.deserialize(
+        Communication(),
+        data,
+        protocol_factory=PROTOCOL_FACTORIES[protocol or detect_protocol(data)],
+    )
+    if add_references:
+        add_references_to_communication(comm)
+    return comm
+
+
+class CommunicationArchiveWriter:
+    """
+    Writes Communications to a zip or tar.gz archive or to a directory.
+    Unlike concrete's writers, the protocol and compression can be chosen,
+    and writing can be checkpointed and resumed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        options: ArchiveOptions = ArchiveOptions(),
+        resume: bool = False,
+    ):
+        if options.format not in FORMATS:
+            raise ValueError(f"Unknown archive format {options.format!r}")
+        self.path = path
+        self.options = options
+        # the names of the members written so far, in order
+        self.names = []
+        self.archive = None
+        if resume and os.path.exists(path):
+            self._resume()
+        else:
+            self._start_over()
+        # the members restored when resuming
+        self.completed = set(self.names)
+
+    def _open(self, mode: str) -> None:
+        if self.options.format == "zip":
+            self.archive = zipfile.ZipFile(
+                self.path,
+                mode,
+                compression=ZIP_COMPRESSION[self.options.compression],
+                compresslevel=self.options.compression_level,
+            )
+        elif self.options.format == "tar.gz":
+            level = self.options.compression_level
+            # opened here rather than by tarfile, which cannot set the
+            # modification time of the gzip header
+            self.archive = tarfile.open(
+                fileobj=gzip.GzipFile(
+                    self.path,
+                    "wb",
+                    compresslevel=DEFAULT_GZIP_LEVEL if level is None else level,
+                    mtime=self.options.timestamp,
+                ),
+                mode="w",
+            )
+        else:
+            os.makedirs(self.path, exist_ok=True)
+
+    def _start_over(self) -> None:
+        # a checkpoint left by an earlier run does not describe the new
+        # archive, and resuming from it would corrupt it
+        if os.path.exists(checkpoint_path(self.path)):
+            os.remove(checkpoint_path(self.path))
+        self._open("w")
+
+    def _resume(self) -> None:
+        checkpoint = read_checkpoint(self.path)
+        if checkpoint is not None and checkpoint["format"] != self.options.format:
+            raise ValueError(
+                f"Cannot resume {self.path} as {self.options.format}: it was written as {checkpoint['format']}"
+            )
+        if (
+            checkpoint is not None
+            and self.options.format == "zip"
+            and checkpoint["zip_end"] > os.path.getsize(self.path)
+        ):
+            print(
+                f"WARNING: the checkpoint of {self.path} is past the end of the archive; starting over"
+            )
+            self._start_over()
+            return
+        if checkpoint is None:
+            # an archive that was closed properly, unless it is unreadable
+            try:
+                names = [name for name, _ in iter_archive_members(self.path)]
+            except (
+                ValueError,
+                EOFError,
+                OSError,
+                tarfile.TarError,
+                zipfile.BadZipFile,
+            ):
+                print(
+                    f"WARNING: cannot resume {self.path} without a checkpoint; starting over"
+                )
+                self._start_over()
+                return
+        else:
+            names = checkpoint["names"]
+        if self.options.format == "zip":
+            if checkpoint is not None:
+                # cut off whatever was written after the checkpoint, and put
+                # back the central directory as of the checkpoint
+                with open(self.path, "r+b") as f:
+                    f.truncate(checkpoint["zip_end"])
+                    f.seek(checkpoint["zip_end"])
+                    f.write(base64.b64decode(checkpoint["zip_directory"]))
+            self._open("a")
+            self.names = names
+        elif self.options.format == "tar.gz":
+            # a gzip stream cannot be appended to in place, so the members
+            # that made it into the old archive are copied into a new one
+            partial_path = self.path + ".partial"
+            os.replace(self.path, partial_path)
+            self._open("w")
+            expected = set(names)
+            try:
+                for name, data in iter_archive_members(partial_path):
+                    if name in expected:
+                        self.write_bytes(name, data)
+            except (EOFError, tarfile.TarError, zlib.error):
+                # the end of an archive cut off by a crash
+                pass
+            os.remove(partial_path)
+            if len(self.names) < len(names):
+                print(
+                    f"WARNING: recovered {len(self.names)} of the {len(names)} checkpointed members of {self.path}"
+                )
+        else:
+            self.names = [
+                name for name in names if os.path.exists(os.path.join(self.path, name))
+            ]
+
+    def write(self, comm: Communication, name: Optional[str] = None) -> None:
+        """Writes a Communication under `name` (by default, its id + ".concrete")"""
+        with PROFILER.section("thrift_serialization"):
+            data = serialize_communication(comm, self.options.protocol)
+        self.write_bytes(comm.id + ".concrete" if name is None else name, data)
+
+    def write_bytes(self, name: str, data: bytes) -> None:
+        with PROFILER.section("archive_write"):
+            if self.options.format == "zip" and self.options.timestamp is None:
+                self.archive.writestr(name, data)
+            elif self.options.format == "zip":
+                info = zipfile.ZipInfo(
+                    name,
+                    time.gmtime(max(self.options.timestamp, ZIP_EPOCH))[:6],
+                )
+                info.external_attr = 0o600 << 16
+                self.archive.writestr(
+                    info,
+                    data,
+                    compress_type=self.archive.compression,
+                    compresslevel=self.archive.compresslevel,
+                )
+            elif self.options.format == "tar.gz":
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = (
+                    time.time()
+                    if self.options.timestamp is None
+                    else self.options.timestamp
+                )
+                self.archive.addfile(info, BytesIO(data))
+            else:
+                member_path = os.path.join(self.path, name)
+                os.makedirs(os.path.dirname(member_path), exist_ok=True)
+                with open(member_path, "wb") as f:
+                    f.write(data)
+        # only once written, so that a checkpoint taken after a failed write
+        # does not count the member as completed
+        self.names.append(name)
+
+    def checkpoint(self) -> None:
+        """
+        Makes the members written so far recoverable by a writer opened
+        with resume=True, should this one not be closed
+        """
+        with PROFILER.section("archive_checkpoint"):
+            checkpoint = {"format": self.options.format, "names": self.names}
+            if self.options.format == "zip":
+                # closing writes the central directory after the last
+                # member, where the reopened archive will write the next one
+                self.archive.close()
+                with zipfile.ZipFile(self.path) as archive:
+                    checkpoint["zip_end"] = archive.start_dir
+                with open(self.path, "rb") as f:
+                    f.seek(checkpoint["zip_end"])
+                    checkpoint["zip_directory"] = base64.b64encode(f.read()).decode()
+                self._open("a")
+            elif self.options.format == "tar.gz":
+                # everything compressed so far can then be decompressed
+                self.archive.fileobj.flush(zlib.Z_SYNC_FLUSH)
+            tmp_path = checkpoint_path(self.path) + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(checkpoint, f)
+            os.replace(tmp_path, checkpoint_path(self.path))
+
+    def _close_archive(self) -> None:
+        if self.archive is None:
+            return
+        self.archive.close()
+        if self.options.format == "tar.gz":
+            # tarfile leaves a file object it was given open
+            self.archive.fileobj.close()
+        self.archive = None
+
+    def close(self) -> None:
+        """Closes the archive, which is then complete, and removes its checkpoint"""
+        self._close_archive()
+        if os.path.exists(checkpoint_path(self.path)):
+            os.remove(checkpoint_path(self.path))
+
+    def __enter__(self) -> "CommunicationArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # keep what was written, to resume from
+        self.checkpoint()
+        self._close_archive()
+
+
+def checkpoint_path(path: str) -> str:
+    return path.rstrip(os.sep) + ".checkpoint.json"
+
+
+def read_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    """The last checkpoint of the archive at `path`, if it was not completed"""
+    if not os.path.exists(checkpoint_path(path)):
+        return None
+    with open(checkpoint_path(path)) as f:
+        return json.load(f)
+
+
+def content_hash(*parts: str) -> str:
+    """A hex digest of the input of an archive member and the settings it was converted with"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        data = part.encode("utf-8")
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+
+def hashes_path(path: str) -> str:
+    return path.rstrip(os.sep) + ".hashes.json"
+
+
+def read_hashes(path: str) -> Dict[str, str]:
+    """The content hashes of the members of the archive at `path`, if recorded"""
+    if not os.path.exists(hashes_path(path)):
+        return {}
+    with open(hashes_path(path)) as f:
+        return json.load(f)
+
+
+def write_hashes(path: str, hashes: Dict[str, str]) -> None:
+    tmp_path = hashes_path(path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(hashes, f, indent=1)
+    os.replace(tmp_path, hashes_path(path))
+
+
+def previous_path(path: str) -> str:
+    return path.rstrip(os.sep) + ".previous"
+
+
+def set_aside(path: str) -> Optional[str]:
+    """
+    Moves the archive at `path` out of the way of a new one, so that
+    members can be copied from it, and returns its new path. If an
+    earlier update was interrupted, its partial archive is discarded in
+    favour of the archive it was updating.
+    """
+    previous = previous_path(path)
+    if os.path.exists(previous):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        return previous
+    if not os.path.exists(path):
+        return None
+    os.replace(path.rstrip(os.sep), previous)
+    return previous
+
+
+def remove_archive(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def _iter_structs(obj: Any) -> Iterator[Any]:
+    """
+    Yields every Thrift struct within `obj`, depth first and in field
+    order, leaving out the references added by add_references_to_communication
+    """
+    if isinstance(obj, (list, set)):
+        for x in obj:
+            yield from _iter_structs(x)
+    elif isinstance(obj, dict):
+        for x in obj.values():
+            yield from _iter_structs(x)
+    elif hasattr(obj, "thrift_spec"):
+        yield obj
+        for spec in obj.thrift_spec:
+            if spec is not None:
+                yield from _iter_structs(getattr(obj, spec[2]))
+
+
+def set_timestamps(comm: Communication, timestamp: int) -> None:
+    """Sets the timestamp of every AnnotationMetadata of a Communication"""
+    for struct in _iter_structs(comm):
+        if isinstance(struct, AnnotationMetadata):
+            struct.timestamp = timestamp
+
+
+def assign_content_uuids(comm: Communication, seed: str) -> None:
+    """
+    Replaces the UUIDs of a Communication, and the references to them, by
+    UUIDs derived from `seed` (a hex string of at least 20 digits, such as
+    a content_hash) and the order of the annotations. Like concrete's
+    compressible UUIDs, they share their first 20 digits and count up in
+    the last 12.
+    """
+    structs = list(_iter_structs(comm))
+    mapping = {}
+    for struct in structs:
+        uuid = getattr(struct, "uuid", None)
+        if isinstance(uuid, UUID) and uuid.uuidString not in mapping:
+            mapping[uuid.uuidString] = join_uuid(
+                seed[:12], seed[12:20], f"{len(mapping) + 1:012x}"
+            )
+    for struct in structs:
+        # a UUID object may be shared, and so be seen again once replaced
+        if isinstance(struct, UUID) and struct.uuidString in mapping:
+            struct.uuidString = mapping[struct.uuidString]
+
+
+def iter_archive_members(path: str) -> Iterator[Tuple[str, bytes]]:
+    """Yields the (name, bytes) of every file in a zip or tar(.gz) archive or directory"""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                member_path = os.path.join(root, file_name)
+                with open(member_path, "rb") as f:
+                    yield os.path.relpath(member_path, path), f.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, archive.read(info)
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise ValueError(f"{path} is not a zip or tar archive or a directory")
+
+
+def read_communications(
+    path: str, protocol: Optional[str] = None, add_references: bool = True
+) -> Iterator[Tuple[Communication, str]]:
+    """
+    Yields (Communication, file name) pairs like concrete's
+    CommunicationReader, but for either protocol and any archive format
+    """
+    for name, data in iter_archive_members(path):
+        with PROFILER.section("thrift_deserialization"):
+            comm = deserialize_communication(data, protocol, add_references)
+        yield comm, name
+
+
+def add_serialization_args(parser) -> None:
+    """Adds the options shared by the scripts that write Concrete archives"""
+    parser.add_argument(
+        "--output-format",
+        choices=FORMATS,
+        default=None,
+        help="write a zip archive (the default), a tar.gz archive or a directory of .concrete files",
+    )
+    parser.add_argument(
+        "--protocol",
+        choices=list(PROTOCOL_FACTORIES),
+        default="compact",
+        help="Thrift protocol of the serialized Communications",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=list(ZIP_COMPRESSION),
+        default="stored",
+        help="compression method of zip archives",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=None,
+        help="compression level of zip (deflated or bzip2) and tar.gz archives",
+    )
+    parser.add_argument(
+        "--timestamp",
+        type=int,
+        default=None,
+        help="modification time of the archive members, in seconds since the epoch (by default, the current time), for reproducible archives",
+    )
+
+
+def add_checkpoint_args(parser) -> None:
+    """Adds the options of the scripts whose archive writing can be resumed"""
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted run from the last checkpoint of its output archives, skipping the Communications already written",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=DEFAULT_CHECKPOINT_EVERY,
+        help="checkpoint the output archives every this many Communications (0 to disable)",
+    )
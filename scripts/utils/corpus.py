@@ -0,0 +1,251 @@
+"""
+Memory-mapped, random-access container for the processed splits.
+
+A corpus file (data/processed/{split}/{split}.corpus) holds the columns
+of the columnar encoding (see utils/columnar.py) as raw arrays behind a
+small JSON header, together with a sorted document ID index. Opening a
+corpus only maps the file and reads the header; looking up a document
+binary-searches the index and decodes just that document's rows, so the
+cost of a lookup does not depend on the size of the corpus. Since the
+arrays are read straight from the mapping, processes opening the same
+file share the page cache.
+
+    from utils.corpus import open_corpus
+
+    corpus = open_corpus("dev")
+    doc = corpus["TST1-MUC3-0001"]  # same dict as in dev.json
+
+To build the corpus files from the processed JSON, run from the project
+root:
+
+    python scripts/utils/corpus.py build --splits dev test
+    python scripts/utils/corpus.py show dev TST1-MUC3-0001
+"""
+import argparse
+import json
+import mmap
+import numpy as np
+import os
+import struct
+import sys
+
+from collections.abc import Mapping
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.columnar import (
+    PROCESSED_DATA_ROOT,
+    SPLITS,
+    decode_split,
+    decode_strings,
+    encode_split,
+    load_split,
+    slice_documents,
+)
+
+MAGIC = b"MUCCORP1"
+# magic, followed by the length of the JSON header
+PREAMBLE = struct.Struct("<8sQ")
+ALIGNMENT = 64
+
+
+def corpus_path(split: str, data_root: str = PROCESSED_DATA_ROOT) -> str:
+    return os.path.join(data_root, split, f"{split}.corpus")
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_corpus(data: Dict[str, Dict[str, Any]], path: str) -> None:
+    """Writes a processed split (as loaded from JSON) to a corpus file"""
+    arrays = encode_split(data)
+    # the columnar string pool uses character offsets; a mapped corpus
+    # needs byte offsets so that single strings can be decoded in place
+    strings = decode_strings(arrays)
+    encoded = [s.encode("utf-8") for s in strings]
+    byte_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=byte_offsets[1:])
+    arrays["string_offsets"] = byte_offsets
+    arrays["string_data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    doc_ids = [strings[i] for i in arrays["doc_id"]]
+    order = np.argsort(np.array(doc_ids, dtype=object), kind="stable")
+    max_len = max((len(d.encode("utf-8")) for d in doc_ids), default=1)
+    arrays["index_doc_ids"] = np.array(
+        [doc_ids[i].encode("utf-8") for i in order], dtype=f"S{max_len}"
+    )
+    arrays["index_rows"] = order.astype(np.int32)
+
+    header = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        header[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _aligned(PREAMBLE.size + len(header_bytes))
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+class _MappedStrings(Sequence):
+    """The string pool of a corpus, decoding strings on access"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = self.offsets[i : i + 2]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+
+class Corpus(Mapping):
+    """
+    Read-only mapping from document ID to processed document, backed by a
+    memory-mapped corpus file. Iteration follows the order of the split.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a corpus file")
+        header = json.loads(self._mmap[PREAMBLE.size : PREAMBLE.size + header_len])
+        data_start = _aligned(PREAMBLE.size + header_len)
+        # zero-copy views into the mapping
+        self.columns = {
+            name: np.frombuffer(
+                self._mmap,
+                dtype=np.dtype(spec["dtype"]),
+                count=int(np.prod(spec["shape"])),
+                offset=data_start + spec["offset"],
+            ).reshape(spec["shape"])
+            for name, spec in header.items()
+        }
+        self.strings = _MappedStrings(
+            self.columns["string_data"], self.columns["string_offsets"]
+        )
+
+    def row(self, doc_id: str) -> int:
+        """Returns the position of a document within the split"""
+        keys = self.columns["index_doc_ids"]
+        key = doc_id.encode("utf-8")
+        i = int(np.searchsorted(keys, key))
+        if i == len(keys) or keys[i] != key:
+            raise KeyError(doc_id)
+        return int(self.columns["index_rows"][i])
+
+    def __getitem__(self, doc_id: str) -> Dict[str, Any]:
+        d = self.row(doc_id)
+        return decode_split(slice_documents(self.columns, d, d + 1), self.strings)[
+            doc_id
+        ]
+
+    def __contains__(self, doc_id: object) -> bool:
+        try:
+            self.row(doc_id)
+        except (KeyError, AttributeError):
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self.columns["doc_id"])
+
+    def __iter__(self) -> Iterator[str]:
+        for i in self.columns["doc_id"]:
+            yield self.strings[i]
+
+    def text(self, doc_id: str) -> str:
+        """Returns only the text of a document"""
+        return self.strings[self.columns["text"][self.row(doc_id)]]
+
+    def close(self) -> None:
+        # the arrays are views into the mapping and have to go first
+        self.columns = {}
+        self.strings = None
+        self._mmap.close()
+
+    def __enter__(self) -> "Corpus":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_corpus(split: str, data_root: str = PROCESSED_DATA_ROOT) -> Corpus:
+    path = corpus_path(split, data_root)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{path} does not exist; build it with: python scripts/utils/corpus.py build --splits {split}"
+        )
+    return Corpus(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser(
+        "build", help="build corpus files from the processed splits"
+    )
+    build_parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=SPLITS,
+        default=SPLITS,
+        help="the splits to build",
+    )
+    build_parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed {split}/{split}.json files; the .corpus files are written alongside them",
+    )
+    show_parser = subparsers.add_parser("show", help="print documents as JSON")
+    show_parser.add_argument("split", choices=SPLITS)
+    show_parser.add_argument("doc_ids", nargs="+", metavar="doc_id")
+    show_parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the {split}/{split}.corpus files",
+    )
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for split in args.splits:
+            try:
+                data = load_split(split, args.data_root)
+            except FileNotFoundError:
+                print(f"WARNING: no processed data found for split {split}; skipping")
+                continue
+            path = corpus_path(split, args.data_root)
+            write_corpus(data, path)
+            print(f"Wrote {len(data)} documents to {path}")
+    else:
+        with open_corpus(args.split, args.data_root) as corpus:
+            for doc_id in args.doc_ids:
+                print(json.dumps({doc_id: corpus[doc_id]}, indent=4))
@@ -0,0 +1,433 @@
+"""
+Counts over the templates of the MUC splits, in place of ad hoc loops
+over the key files. The templates of all splits are flattened once into
+a columnar table with one row per (filler, set-fill value):
+
+    split          the split of the document
+    doc            its document ID
+    template       the index of the template among all templates
+    incident_type  the template's incident type
+    slot           the slot name
+    filler         the filler's string (for colon clauses of set-fill
+                   slots, the filler it qualifies, e.g. the perpetrator
+                   organization of a perp_organization_confidence)
+    value          the set-fill value, if the slot has one, e.g.
+                   SUSPECTED OR ACCUSED; a filler with several gets a
+                   row for each
+    filler_id      the index of the filler among all fillers
+    mentions       the filler's number of document mentions, or -1 for
+                   splits that have not been processed
+
+Every template also gets a row for its incident_type slot, so that it
+is counted even if all of its other slots are empty. String columns are
+stored as integer codes into a shared string pool, so that filters and
+group-bys run as NumPy operations over the whole table. The table is
+built from data/processed/{split}/{split}.json, or from
+data/semiprocessed/{split}/{split}_keys.json for splits that have not
+been processed, and is cached in data/.statistics.npz until one of
+those files changes. Run from the project root, e.g.
+
+    python scripts/utils/corpus_statistics.py --group-by split slot --count fillers
+    python scripts/utils/corpus_statistics.py --where incident_type=ATTACK \\
+        --where slot=perp_organization_confidence \\
+        --where "value=SUSPECTED OR ACCUSED" --count templates
+"""
+import argparse
+import hashlib
+import numpy as np
+import os
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from preprocessing.proc_keys import SET_FILL_KEYS_ALLOWED_VALUES
+from utils.data_model import (
+    PROCESSED_DATA_ROOT,
+    Filler,
+    Template,
+    iter_documents,
+    load_templates,
+    split_path,
+)
+from utils.profiling import PROFILER, add_profiling_args, profiling
+
+KEYS_DATA_ROOT = "data/semiprocessed/"
+SPLITS = ["train", "dev", "test"]
+CACHE_PATH = "data/.statistics.npz"
+# bump to invalidate existing caches when the table layout changes
+CACHE_VERSION = 1
+
+# slots whose values come from a fixed set; colon clauses of the last two
+# qualify a target filler with its type
+SET_FILL_SLOTS = {
+    "incident_type",
+    *SET_FILL_KEYS_ALLOWED_VALUES,
+    "hum_tgt_type",
+    "phys_tgt_type",
+}
+STRING_COLUMNS = ["split", "doc", "incident_type", "slot", "filler", "value"]
+INT_COLUMNS = ["template", "filler_id", "mentions"]
+COLUMNS = STRING_COLUMNS + INT_COLUMNS
+# what --count counts: rows, or the distinct values of a column
+COUNT_UNITS = {
+    "rows": None,
+    "fillers": "filler_id",
+    "templates": "template",
+    "docs": "doc",
+}
+
+
+class StatisticsTable:
+    """The columns of the table, with the string pool their codes index into"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], strings: List[str]):
+        self.columns = columns
+        self.strings = strings
+        self.codes = {s: i for i, s in enumerate(strings)}
+
+    def __len__(self) -> int:
+        return len(self.columns["template"])
+
+    def mask(self, conditions: Dict[str, List[str]]) -> np.ndarray:
+        """
+        The rows where every column in `conditions` has one of the values
+        listed for it
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, values in conditions.items():
+            if column in STRING_COLUMNS:
+                # a string not in the pool matches nothing
+                codes = [self.codes.get(v, -1) for v in values]
+            else:
+                codes = [int(v) for v in values]
+            mask &= np.isin(self.columns[column], codes)
+        return mask
+
+    def count(
+        self,
+        group_by: Sequence[str] = (),
+        unit: str = "rows",
+        conditions: Optional[Dict[str, List[str]]] = None,
+    ) -> List[Tuple[Tuple[Any, ...], int]]:
+        """
+        Counts the rows (or distinct fillers, templates or documents, or
+        the sum of the fillers' mentions) that meet `conditions`, by the
+        values of the `group_by` columns, largest count first
+        """
+        mask = self.mask(conditions or {})
+        # a constant first column stands in for the group of an empty group_by
+        keys = np.column_stack(
+            [np.zeros(np.count_nonzero(mask), dtype=np.int64)]
+            + [self.columns[c][mask] for c in group_by]
+        )
+        if unit == "mentions":
+            # each filler's mentions once per group, however many rows it has
+            keys, first = np.unique(
+                np.column_stack([keys, self.columns["filler_id"][mask]]),
+                axis=0,
+                return_index=True,
+            )
+            weights = np.maximum(self.columns["mentions"][mask][first], 0)
+            keys = keys[:, :-1]
+        else:
+            if COUNT_UNITS[unit] is not None:
+                keys = np.unique(
+                    np.column_stack([keys, self.columns[COUNT_UNITS[unit]][mask]]),
+                    axis=0,
+                )[:, :-1]
+            weights = np.ones(len(keys), dtype=np.int64)
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights, minlength=len(groups))
+        order = np.lexsort((*groups.T[::-1], -counts))
+        return [
+            (self.decode(group_by, groups[i, 1:]), int(counts[i]))
+            for i in order.tolist()
+        ]
+
+    def decode(self, columns: Sequence[str], values: np.ndarray) -> Tuple[Any, ...]:
+        return tuple(
+            self.strings[v] if c in STRING_COLUMNS else v
+            for c, v in zip(columns, values.tolist())
+        )
+
+
+def _filler_values(slot: str, filler) -> Tuple[str, List[str]]:
+    """A filler's string and its set-fill values"""
+    if slot not in SET_FILL_SLOTS:
+        return (filler.strings or filler.strings_lhs or ("",))[0], [""]
+    if filler.strings_rhs:
+        return filler.strings_rhs[0], list(filler.strings_lhs)
+    return "", list(filler.strings or ("",))
+
+
+def build_table(
+    sources: List[Tuple[str, Iterable[Tuple[str, Sequence[Template]]]]],
+) -> StatisticsTable:
+    """Builds the table from the (document ID, templates) of each split"""
+    pool = {"": 0}
+    columns = {name: [] for name in COLUMNS}
+    num_templates = num_fillers = 0
+
+    def add_row(**row) -> None:
+        for name in STRING_COLUMNS:
+            # a few colon clauses of the train keys have no left-hand side
+            value = "" if row[name] is None else row[name]
+            columns[name].append(pool.setdefault(value, len(pool)))
+        for name in INT_COLUMNS:
+            columns[name].append(row[name])
+
+    for split, documents in sources:
+        for doc_id, templates in documents:
+            for template in templates:
+                if template.message_template == "*":
+                    # the placeholder of a document without templates
+                    continue
+                row = dict(
+                    split=split,
+                    doc=doc_id,
+                    template=num_templates,
+                    incident_type=template.incident_type,
+                )
+                add_row(
+                    **row,
+                    slot="incident_type",
+                    filler="",
+                    value=template.incident_type,
+                    filler_id=-1,
+                    mentions=-1,
+                )
+                for slot, value in template.items():
+                    if not isinstance(value, (Filler, tuple)):
+                        # incident_type and the message fields
+                        continue
+                    for filler in template.fillers(slot):
+                        string, values = _filler_values(slot, filler)
+                        mentions = filler.document_mentions
+                        for value in values:
+                            add_row(
+                                **row,
+                                slot=slot,
+                                filler=string,
+                                value=value,
+                                filler_id=num_fillers,
+                                mentions=-1 if mentions is None else len(mentions),
+                            )
+                        num_fillers += 1
+                num_templates += 1
+    return StatisticsTable(
+        {name: np.asarray(values, dtype=np.int32) for name, values in columns.items()},
+        list(pool),
+    )
+
+
+def source_paths(
+    splits: Sequence[str], data_root: str, keys_root: str
+) -> List[Tuple[str, str, bool]]:
+    """The (split, path, processed) of the file each split is read from"""
+    paths = []
+    for split in splits:
+        path = split_path(split, data_root)
+        if os.path.exists(path):
+            paths.append((split, path, True))
+            continue
+        path = os.path.join(keys_root, split, f"{split}_keys.json")
+        if os.path.exists(path):
+            paths.append((split, path, False))
+        else:
+            print(
+                f"WARNING: neither a processed nor a key file found for split {split}"
+            )
+    return paths
+
+
+def sources_key(paths: List[Tuple[str, str, bool]]) -> str:
+    """
+    Hash of the files' names, sizes and modification times (hashing their
+    contents would take longer than answering most queries)
+    """
+    h = hashlib.sha256(f"statistics v{CACHE_VERSION}".encode("utf-8"))
+    for split, path, processed in paths:
+        stat = os.stat(path)
+        h.update(
+            f"\0{split}\0{os.path.abspath(path)}\0{processed}\0{stat.st_size}\0{stat.st_mtime_ns}".encode(
+                "utf-8"
+            )
+        )
+    return h.hexdigest()
+
+
+def _documents(path: str, processed: bool) -> Iterator[Tuple[str, Sequence[Template]]]:
+    if processed:
+        for doc in iter_documents(path):
+            yield doc.doc_id, doc.templates
+    else:
+        yield from load_templates(path).items()
+
+
+def load_table(
+    splits: Sequence[str] = SPLITS,
+    data_root: str = PROCESSED_DATA_ROOT,
+    keys_root: str = KEYS_DATA_ROOT,
+    cache_path: Optional[str] = CACHE_PATH,
+    rebuild: bool = False,
+) -> StatisticsTable:
+    """
+    Loads the table from `cache_path` if it was built from the current
+    files, and otherwise builds it and writes the cache (unless
+    `cache_path` is None)
+    """
+    paths = source_paths(splits, data_root, keys_root)
+    key = sources_key(paths)
+    if cache_path is not None and not rebuild and os.path.exists(cache_path):
+        with PROFILER.section("statistics_load"):
+            try:
+                with np.load(cache_path) as npz:
+                    if str(npz["key"]) == key:
+                        return StatisticsTable(
+                            {name: npz[name] for name in COLUMNS},
+                            decode_strings(npz),
+                        )
+            except (OSError, ValueError, KeyError) as e:
+                print(
+                    f"WARNING: ignoring unreadable statistics cache {cache_path}: {e}"
+                )
+    with PROFILER.section("statistics_build"):
+        table = build_table(
+            [(split, _documents(path, processed)) for split, path, processed in paths]
+        )
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        # np.savez would append .npz to a name without it
+        tmp_path = cache_path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            key=np.array(key),
+            **encode_strings(table.strings),
+            **table.columns,
+        )
+        os.replace(tmp_path, cache_path)
+    return table
+
+
+def encode_strings(strings: List[str]) -> Dict[str, np.ndarray]:
+    """The string pool as UTF-8 data and character offsets, as in utils/columnar.py"""
+    lengths = np.fromiter(map(len, strings), np.int64, len(strings))
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return {
+        "string_data": np.frombuffer("".join(strings).encode("utf-8"), dtype=np.uint8),
+        "string_offsets": offsets,
+    }
+
+
+def decode_strings(npz) -> List[str]:
+    text = npz["string_data"].tobytes().decode("utf-8")
+    offsets = npz["string_offsets"].tolist()
+    return [text[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def parse_conditions(conditions: List[str]) -> Dict[str, List[str]]:
+    """
+    Parses COLUMN=VALUE conditions; values of the same column are
+    alternatives
+    """
+    parsed = {}
+    for condition in conditions:
+        column, sep, value = condition.partition("=")
+        if not sep or column not in COLUMNS:
+            raise ValueError(
+                f"Expected COLUMN=VALUE with COLUMN one of {', '.join(COLUMNS)}, got {condition!r}"
+            )
+        parsed.setdefault(column, []).append(value)
+    return parsed
+
+
+def format_counts(
+    group_by: Sequence[str], unit: str, counts: List[Tuple[Tuple[Any, ...], int]]
+) -> str:
+    rows = [[*group_by, unit]] + [
+        [str(v) for v in group] + [str(count)] for group, count in counts
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(
+            v.rjust(w) if i == len(row) - 1 else v.ljust(w)
+            for i, (v, w) in enumerate(zip(row, widths))
+        ).rstrip()
+        for row in rows
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=SPLITS,
+        default=SPLITS,
+        help="the splits to count over",
+    )
+    parser.add_argument(
+        "--group-by",
+        nargs="*",
+        choices=COLUMNS,
+        default=[],
+        help="the columns to group by",
+    )
+    parser.add_argument(
+        "--count",
+        choices=[*COUNT_UNITS, "mentions"],
+        default="rows",
+        help="what to count in each group: rows, distinct fillers, templates or documents, or the fillers' document mentions",
+    )
+    parser.add_argument(
+        "--where",
+        action="append",
+        default=[],
+        metavar="COLUMN=VALUE",
+        help="only count the rows where COLUMN has VALUE; may be repeated, and repeated values of the same column are alternatives",
+    )
+    parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed {split}/{split}.json files",
+    )
+    parser.add_argument(
+        "--keys-root",
+        type=str,
+        default=KEYS_DATA_ROOT,
+        help="directory containing the {split}/{split}_keys.json files, for splits that have not been processed",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=CACHE_PATH,
+        help="where the table is cached; pass an empty string to disable caching",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="rebuild the table even if the cache is up to date",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    try:
+        conditions = parse_conditions(args.where)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with profiling(args):
+        table = load_table(
+            args.splits,
+            args.data_root,
+            args.keys_root,
+            args.cache or None,
+            args.rebuild,
+        )
+        with PROFILER.section("statistics_query"):
+            counts = table.count(args.group_by, args.count, conditions)
+    print(format_counts(args.group_by, args.count, counts))
@@ -0,0 +1,473 @@
+"""
+Typed data model for the templates and documents in data/semiprocessed
+and data/processed, as a compact alternative to the nested dicts that
+json.load produces:
+
+    Document     doc_id, text, sections, sentences, templates
+    Template     slot name -> None, Filler, tuple of Fillers, str, int or bool
+    Filler       type, optional, strings / strings_lhs + strings_rhs,
+                 document_mentions, sentence_mentions
+    MentionSpan  (start, end) character offsets
+
+All classes use __slots__, lists become tuples, mention spans are
+packed into int arrays, and slot names, filler types and filler strings
+(e.g. set-fill values such as "ACCOMPLISHED") are interned, so a loaded
+split takes several times less memory than its JSON view. Templates also share one tuple of slot names per distinct
+slot order. Template and Filler are read-only Mappings with the same
+keys as the JSON, so code written against the dicts (template.get(slot),
+filler["strings"], ...) works unchanged; to_json converts back.
+
+Files are decoded one document at a time (see json_stream.py), so the
+full dict view is never held in memory. To compare memory use and check
+the round trip, run from the project root:
+
+    python scripts/utils/data_model.py --splits dev test --check
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from array import array
+from collections.abc import Mapping
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.json_stream import iter_json_items
+
+PROCESSED_DATA_ROOT = "data/processed/"
+SPLITS = ["train", "dev", "test"]
+# a small read size keeps the transient decoding buffer well below the
+# size of the loaded split
+CHUNK_SIZE = 1 << 16
+
+_intern = sys.intern
+
+
+class MentionSpan(NamedTuple):
+    start: int
+    end: int
+
+
+def _pack_spans(spans: Iterable[Sequence[int]]) -> array:
+    return array("i", [i for span in spans for i in span])
+
+
+def _unpack_spans(packed: array) -> Tuple[MentionSpan, ...]:
+    return tuple(
+        MentionSpan(packed[i], packed[i + 1]) for i in range(0, len(packed), 2)
+    )
+
+
+def _strings(strings: Optional[Sequence[str]]) -> Optional[Tuple[str, ...]]:
+    if strings is None:
+        return None
+    # a handful of malformed fillers have non-string values
+    return tuple(_intern(s) if isinstance(s, str) else s for s in strings)
+
+
+# keys of a filler dict, in the order they are written
+FILLER_KEYS = (
+    "optional",
+    "type",
+    "strings",
+    "strings_lhs",
+    "strings_rhs",
+    "document_mentions",
+    "sentence_mentions",
+)
+
+
+class Filler(Mapping):
+    """
+    A slot filler. Attributes that are None correspond to keys missing
+    from the JSON (e.g. the mentions of fillers that were not located).
+
+    Mentions make up most of a split, so rather than as tuples of
+    MentionSpans they are stored packed in int arrays: document mentions
+    as (start, end) pairs and sentence mentions as (sentence index,
+    start, end) triples. The document_mentions and sentence_mentions
+    properties unpack them.
+    """
+
+    __slots__ = (
+        "optional",
+        "type",
+        "strings",
+        "strings_lhs",
+        "strings_rhs",
+        "_document_mentions",
+        "_sentence_mentions",
+    )
+
+    def __init__(
+        self,
+        type: str,
+        strings: Optional[Sequence[str]] = None,
+        strings_lhs: Optional[Sequence[str]] = None,
+        strings_rhs: Optional[Sequence[str]] = None,
+        optional: Optional[bool] = None,
+        document_mentions: Optional[Iterable[Sequence[int]]] = None,
+        sentence_mentions: Optional[Mapping[int, Iterable[Sequence[int]]]] = None,
+    ):
+        self.optional = optional
+        self.type = _intern(type)
+        self.strings = _strings(strings)
+        self.strings_lhs = _strings(strings_lhs)
+        self.strings_rhs = _strings(strings_rhs)
+        self._document_mentions = (
+            None if document_mentions is None else _pack_spans(document_mentions)
+        )
+        self._sentence_mentions = (
+            None
+            if sentence_mentions is None
+            else array(
+                "i",
+                [
+                    i
+                    for sentence, spans in sentence_mentions.items()
+                    for start, end in spans
+                    for i in (int(sentence), start, end)
+                ],
+            )
+        )
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Filler":
+        return cls(
+            data["type"],
+            data.get("strings"),
+            data.get("strings_lhs"),
+            data.get("strings_rhs"),
+            data.get("optional"),
+            data.get("document_mentions"),
+            data.get("sentence_mentions"),
+        )
+
+    @property
+    def document_mentions(self) -> Optional[Tuple[MentionSpan, ...]]:
+        if self._document_mentions is None:
+            return None
+        return _unpack_spans(self._document_mentions)
+
+    @property
+    def sentence_mentions(self) -> Optional[Dict[int, Tuple[MentionSpan, ...]]]:
+        """Maps sentence indices to the mentions within that sentence"""
+        packed = self._sentence_mentions
+        if packed is None:
+            return None
+        mentions = {}
+        for i in range(0, len(packed), 3):
+            mentions.setdefault(packed[i], []).append(
+                MentionSpan(packed[i + 1], packed[i + 2])
+            )
+        return {sentence: tuple(spans) for sentence, spans in mentions.items()}
+
+    def to_json(self) -> Dict[str, Any]:
+        data = {}
+        for key, value in self.items():
+            if key == "document_mentions":
+                value = [list(span) for span in value]
+            elif key == "sentence_mentions":
+                value = {
+                    str(i): [list(span) for span in spans] for i, spans in value.items()
+                }
+            elif isinstance(value, tuple):
+                value = list(value)
+            data[key] = value
+        return data
+
+    def __getitem__(self, key: str) -> Any:
+        value = getattr(self, key) if key in FILLER_KEYS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        for key in FILLER_KEYS:
+            # avoid unpacking the mentions just to check that they exist
+            attr = "_" + key if key.endswith("_mentions") else key
+            if getattr(self, attr) is not None:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"Filler({dict(self)!r})"
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Filler):
+            return all(
+                getattr(self, attr) == getattr(other, attr) for attr in self.__slots__
+            )
+        return super().__eq__(other)
+
+    __hash__ = None
+
+
+SlotValue = Union[None, Filler, Tuple[Filler, ...], str, int, bool]
+
+# one shared (interned) tuple of slot names per distinct slot order, and
+# the position of each slot within it
+_SLOT_TUPLES: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+_SLOT_INDEX: Dict[Tuple[str, ...], Dict[str, int]] = {}
+
+
+def _slot_tuple(slots: Iterable[str]) -> Tuple[str, ...]:
+    slots = tuple(_intern(slot) for slot in slots)
+    shared = _SLOT_TUPLES.get(slots)
+    if shared is None:
+        shared = _SLOT_TUPLES[slots] = slots
+        _SLOT_INDEX[slots] = {slot: i for i, slot in enumerate(slots)}
+    return shared
+
+
+def _slot_value(value: Any) -> SlotValue:
+    if isinstance(value, list):
+        return tuple(Filler.from_json(filler) for filler in value)
+    if isinstance(value, dict):
+        return Filler.from_json(value)
+    if isinstance(value, str):
+        return _intern(value)
+    return value
+
+
+class Template(Mapping):
+    """
+    A template as a read-only mapping from slot names to values, in the
+    order of the JSON. List-valued slots hold tuples of Fillers.
+    """
+
+    __slots__ = ("slot_names", "slot_values")
+
+    def __init__(self, slot_names: Iterable[str], slot_values: Iterable[SlotValue]):
+        self.slot_names = _slot_tuple(slot_names)
+        self.slot_values = tuple(slot_values)
+        if len(self.slot_names) != len(self.slot_values):
+            raise ValueError(
+                f"Got {len(self.slot_values)} values for {len(self.slot_names)} slots"
+            )
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Template":
+        return cls(data.keys(), [_slot_value(v) for v in data.values()])
+
+    def to_json(self) -> Dict[str, Any]:
+        data = {}
+        for slot, value in zip(self.slot_names, self.slot_values):
+            if isinstance(value, Filler):
+                value = value.to_json()
+            elif isinstance(value, tuple):
+                value = [filler.to_json() for filler in value]
+            data[slot] = value
+        return data
+
+    @property
+    def message_id(self) -> str:
+        return self["message_id"]
+
+    @property
+    def message_template(self) -> Union[int, str]:
+        return self["message_template"]
+
+    @property
+    def incident_type(self) -> str:
+        return self["incident_type"]
+
+    def fillers(self, slot: str) -> Tuple[Filler, ...]:
+        """The fillers of `slot` as a tuple, whether the slot is list-valued or not"""
+        value = self.get(slot)
+        if value is None:
+            return ()
+        return (value,) if isinstance(value, Filler) else value
+
+    def __getitem__(self, slot: str) -> SlotValue:
+        return self.slot_values[_SLOT_INDEX[self.slot_names][slot]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.slot_names)
+
+    def __len__(self) -> int:
+        return len(self.slot_names)
+
+    def __reduce__(self):
+        # re-create through __init__ so that unpickled templates (e.g. in
+        # worker processes) share the slot name tuples as well
+        return (Template, (self.slot_names, self.slot_values))
+
+    def __repr__(self) -> str:
+        return f"Template({dict(self)!r})"
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Template):
+            return (
+                self.slot_names == other.slot_names
+                and self.slot_values == other.slot_values
+            )
+        return super().__eq__(other)
+
+    __hash__ = None
+
+
+class Document:
+    """
+    A processed document (see preprocess.py). Like mentions, the section
+    and sentence spans are stored packed and unpacked on access.
+    """
+
+    __slots__ = ("doc_id", "text", "_sections", "_sentences", "templates")
+
+    def __init__(
+        self,
+        doc_id: str,
+        text: str,
+        sections: Iterable[Sequence[int]],
+        sentences: Iterable[Sequence[int]],
+        templates: Iterable[Template],
+    ):
+        self.doc_id = doc_id
+        self.text = text
+        self._sections = _pack_spans(sections)
+        self._sentences = _pack_spans(sentences)
+        self.templates = tuple(templates)
+
+    @classmethod
+    def from_json(cls, doc_id: str, data: Dict[str, Any]) -> "Document":
+        return cls(
+            doc_id,
+            data["text"],
+            data["sections"],
+            data["sentences"],
+            [Template.from_json(t) for t in data["templates"]],
+        )
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "text": self.text,
+            "sections": [list(span) for span in self.sections],
+            "sentences": [list(span) for span in self.sentences],
+            "templates": [t.to_json() for t in self.templates],
+        }
+
+    @property
+    def sections(self) -> Tuple[MentionSpan, ...]:
+        return _unpack_spans(self._sections)
+
+    @property
+    def sentences(self) -> Tuple[MentionSpan, ...]:
+        return _unpack_spans(self._sentences)
+
+    @property
+    def num_sentences(self) -> int:
+        return len(self._sentences) // 2
+
+    def sentence_text(self, i: int) -> str:
+        return self.text[self._sentences[2 * i] : self._sentences[2 * i + 1]]
+
+    def __repr__(self) -> str:
+        return f"Document(doc_id={self.doc_id!r}, num_templates={len(self.templates)})"
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Document):
+            return NotImplemented
+        return all(
+            getattr(self, attr) == getattr(other, attr) for attr in self.__slots__
+        )
+
+    __hash__ = None
+
+
+def json_default(obj: Any) -> Any:
+    """For json.dump(s)'s `default` argument, so that model objects can be serialized"""
+    if isinstance(obj, (Document, Template, Filler)):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def split_path(split: str, data_root: str = PROCESSED_DATA_ROOT) -> str:
+    return os.path.join(data_root, split, f"{split}.json")
+
+
+def iter_documents(path: str) -> Iterator[Document]:
+    """Yields the documents of a processed split file, in file order"""
+    for doc_id, data in iter_json_items(path, CHUNK_SIZE):
+        yield Document.from_json(doc_id, data)
+
+
+def load_documents(path: str) -> Dict[str, Document]:
+    """Loads a processed split file (e.g. data/processed/dev/dev.json)"""
+    return {doc.doc_id: doc for doc in iter_documents(path)}
+
+
+def load_templates(path: str) -> Dict[str, List[Template]]:
+    """
+    Loads a file mapping document IDs to lists of templates, such as
+    data/semiprocessed/{split}/{split}_keys.json
+    """
+    return {
+        doc_id: [Template.from_json(t) for t in templates]
+        for doc_id, templates in iter_json_items(path, CHUNK_SIZE)
+    }
+
+
+def _measure(load: Callable[[], Any]) -> Tuple[Any, float, int, int]:
+    """
+    Returns the result of `load`, the time it took, the memory the result
+    takes and the peak memory use while loading
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    seconds = time.perf_counter() - start
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, size, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        choices=SPLITS,
+        default=SPLITS,
+        help="the splits to load",
+    )
+    parser.add_argument(
+        "--data-root",
+        type=str,
+        default=PROCESSED_DATA_ROOT,
+        help="directory containing the processed {split}/{split}.json files",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="verify that each split converts back to exactly its JSON",
+    )
+    args = parser.parse_args()
+    for split in args.splits:
+        path = split_path(split, args.data_root)
+        if not os.path.exists(path):
+            print(f"WARNING: {path} not found; skipping split {split}")
+            continue
+        with open(path) as f:
+            data, *json_stats = _measure(lambda: json.load(f))
+        docs, *model_stats = _measure(lambda: load_documents(path))
+        print(f"{split}: {len(docs)} documents")
+        for name, (seconds, size, peak) in [
+            ("json.load", json_stats),
+            ("data model", model_stats),
+        ]:
+            print(
+                f"    {name:<12} {size / 2**20:6.2f} MiB loaded, {peak / 2**20:6.2f} MiB peak, {seconds:.2f} s"
+            )
+        # compare serializations so that key order is checked too
+        if args.check and json.dumps(
+            {doc_id: doc.to_json() for doc_id, doc in docs.items()}
+        ) != json.dumps(data):
+            raise ValueError(f"{path} does not round-trip through the data model")
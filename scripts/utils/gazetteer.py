@@ -0,0 +1,561 @@
+"""
+Gazetteer of the place names in the MUC documentation (data/documentation):
+the LOCATION and FOREIGN NATION set lists in templ-doc-basic, and the
+containing areas, buildings, streets, international regions and synonyms
+in templ-doc-more. Every distinct (normalized) name gets an ID, with
+
+- its types (CITY, DEPARTMENT, ...) and kinds, i.e. the lists it is on
+  ("location", "nation", "place", "building", "street", "international")
+- its synonym class, from places-synonyms and the nation synonyms, whose
+  canonical name is the one on a set list where there is one
+- the areas that directly contain it, from the "COUNTRY: AREA (TYPE):
+  PLACE (TYPE)" paths of the lists
+
+Names are indexed both in a dict and in a character trie, which serves
+prefix completion (e.g. of truncated fillers like "WASHINGTON D") and
+finding every name a text mentions in a single pass over it. Since
+parsing the lists takes longer than loading the result, load_gazetteer
+caches the compiled index as a pickle, keyed by a hash of the list files
+and of this module, and rebuilds it whenever either changes. To look names up, run from the
+project root:
+
+    python scripts/utils/gazetteer.py --lookup "SAN SALVADOR" "WASHINGTON D"
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import pickle
+import re
+import sys
+
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.profiling import PROFILER, add_profiling_args, profiling
+
+DOCUMENTATION_DIR = "data/documentation/"
+# (pattern relative to DOCUMENTATION_DIR, kind of the names listed)
+SOURCES = [
+    ("templ-doc-basic/set-list-location*", "location"),
+    ("templ-doc-basic/set-list-foreign-nation*", "nation"),
+    ("templ-doc-more/containing-areas-*", "place"),
+    ("templ-doc-more/places-buildings-etc*", "building"),
+    ("templ-doc-more/places-streets-etc*", "street"),
+    ("templ-doc-more/places-international*", "international"),
+    ("templ-doc-more/places-synonyms*", "place"),
+]
+# outside DOCUMENTATION_DIR, which is an input of the pipeline stages using it
+CACHE_PATH = "data/.gazetteer.pickle"
+# names on these lists are valid LOCATION fillers
+SET_LIST_KINDS = ("location", "nation")
+
+# the lists start after a line of dashes under their title
+RULE_RE = re.compile(r"^-{5,}\s*$")
+NEW_MARKER_RE = re.compile(r"\s*<-NEW(?: ENTRY)?\s*$")
+# "COUNTRY: AREA (TYPE): PLACE (TYPE) notes *site* VALIDATED"
+SITE_RE = re.compile(r"\s\*[^*]+\*")
+# an entry without a site: "NAME", "NAME (TYPE)" or a path, in upper case
+ENTRY_RE = re.compile(r"^[A-Z0-9\"?][^a-z<=>*]*$")
+# "NAME = CANONICAL NAME" or "NAME -> CANONICAL NAME"
+SYNONYM_RE = re.compile(r"^(?P<lhs>[^a-z=>]+?)\s*(?:=|->)\s*(?P<rhs>[^a-z=>]+)$")
+# "NAME (TYPE) notes", or "NAME (ALIAS) [TYPE]" on the buildings list
+SEGMENT_RE = re.compile(r"^(?P<name>[^(\[]*[^(\[\s])\s*(?P<groups>.*)$")
+BRACKET_TYPE_RE = re.compile(r"\[([^\[\]]*)\]")
+PAREN_TYPE_RE = re.compile(r"\(([^()]*)\)")
+LOWER_RE = re.compile(r"[a-z]")
+# "The following multilevel entries were provided by *sri*:"
+OUTLINE_RE = re.compile(r"entries were provided by \*[^*]+\*:\s*$")
+# "?" stands for an unknown country
+UNKNOWN = "?"
+
+
+def normalize(name: str) -> str:
+    """Upper-cases `name`, drops quotes and collapses whitespace"""
+    return " ".join(name.upper().replace('"', " ").split())
+
+
+def _is_boundary(text: str, i: int) -> bool:
+    return i < 0 or i >= len(text) or not text[i].isalnum()
+
+
+class NameTrie:
+    """
+    Character trie over names, as nested dicts. The ID of the name ending
+    at a node is stored under the key "", which is never a character.
+    """
+
+    __slots__ = ("root",)
+
+    def __init__(self, root: Optional[Dict[str, Any]] = None):
+        self.root = {} if root is None else root
+
+    def add(self, name: str, id: int) -> None:
+        node = self.root
+        for c in name:
+            node = node.setdefault(c, {})
+        node[""] = id
+
+    def _node(self, prefix: str) -> Optional[Dict[str, Any]]:
+        node = self.root
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return None
+        return node
+
+    def get(self, name: str) -> Optional[int]:
+        node = self._node(name)
+        return None if node is None else node.get("")
+
+    def complete(self, prefix: str) -> List[int]:
+        """Returns the IDs of all names starting with `prefix`, shortest first"""
+        node = self._node(prefix)
+        if node is None:
+            return []
+        ids, level = [], [node]
+        while level:
+            ids.extend(n[""] for n in level if "" in n)
+            level = [child for n in level for c, child in n.items() if c]
+        return ids
+
+    def scan(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """
+        Yields the (start, end, ID) of the names mentioned in `text`, which
+        should be normalized like them. At each word start, the longest
+        name ending at a word boundary is taken, and the scan resumes after
+        it, so mentions do not overlap.
+        """
+        i, n = 0, len(text)
+        while i < n:
+            if not text[i].isalnum() or not _is_boundary(text, i - 1):
+                i += 1
+                continue
+            node, match, j = self.root, None, i
+            while j < n:
+                node = node.get(text[j])
+                if node is None:
+                    break
+                j += 1
+                if "" in node and _is_boundary(text, j):
+                    match = (i, j, node[""])
+            if match is None:
+                i += 1
+            else:
+                yield match
+                i = match[1]
+
+
+class Gazetteer:
+    """
+    The compiled index. Names are referred to by their IDs, i.e. their
+    positions in `names`; `canonical` maps each ID to the ID of its
+    synonym class's canonical name, and `members` each canonical ID to
+    the IDs of its class.
+    """
+
+    __slots__ = (
+        "names",
+        "ids",
+        "types",
+        "kinds",
+        "canonical",
+        "members",
+        "parents",
+        "trie",
+    )
+
+    def __init__(
+        self,
+        names: List[str],
+        types: List[Tuple[str, ...]],
+        kinds: List[Tuple[str, ...]],
+        canonical: List[int],
+        parents: List[Tuple[int, ...]],
+        trie: Optional[NameTrie] = None,
+    ):
+        self.names = names
+        self.ids = {name: id for id, name in enumerate(names)}
+        self.types = types
+        self.kinds = kinds
+        self.canonical = canonical
+        self.members = {}
+        for id, c in enumerate(canonical):
+            self.members.setdefault(c, []).append(id)
+        self.parents = parents
+        if trie is None:
+            trie = NameTrie()
+            for id, name in enumerate(names):
+                trie.add(name, id)
+        self.trie = trie
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def lookup(self, name: str) -> Optional[int]:
+        return self.ids.get(normalize(name))
+
+    def complete(self, prefix: str) -> List[int]:
+        return self.trie.complete(normalize(prefix))
+
+    def synonyms(self, id: int) -> List[int]:
+        """The IDs of the names in the synonym class of `id`, itself included"""
+        return self.members[self.canonical[id]]
+
+    def is_set_list_name(self, id: int) -> bool:
+        return any(kind in SET_LIST_KINDS for kind in self.kinds[id])
+
+    def ancestors(self, id: int) -> List[int]:
+        """
+        The canonical IDs of all areas containing `id` or any of its
+        synonyms, innermost first. Nations contain everything else, so the
+        areas listed for names that are also nations (e.g. AMERICA, a
+        neighborhood in Colombia) are homonyms and are left out.
+        """
+        own = self.canonical[id]
+        seen, result, level = {own}, [], [own]
+        while level:
+            next_level = []
+            for c in level:
+                if "nation" in self.kinds[c]:
+                    continue
+                for member in self.members[c]:
+                    for parent in self.parents[member]:
+                        parent = self.canonical[parent]
+                        if parent not in seen:
+                            seen.add(parent)
+                            result.append(parent)
+                            next_level.append(parent)
+            level = next_level
+        return result
+
+    def contains(self, outer: int, inner: int) -> bool:
+        return self.canonical[outer] in self.ancestors(inner)
+
+    def find_mentions(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        The (start, end, ID) of every name mentioned in `text`. MUC texts
+        are ASCII, so offsets into the upper-cased text are offsets into
+        `text`.
+        """
+        with PROFILER.section("gazetteer_scan"):
+            return list(self.trie.scan(text.upper()))
+
+    def describe(self, id: int) -> Dict[str, Any]:
+        return {
+            "name": self.names[id],
+            "canonical": self.names[self.canonical[id]],
+            "types": list(self.types[id]),
+            "kinds": list(self.kinds[id]),
+            "synonyms": [self.names[i] for i in self.synonyms(id) if i != id],
+            "containing_areas": [self.names[i] for i in self.ancestors(id)],
+        }
+
+    def to_state(self) -> Dict[str, Any]:
+        """Plain data to pickle, so that caches do not depend on this module's path"""
+        return {
+            "names": self.names,
+            "types": self.types,
+            "kinds": self.kinds,
+            "canonical": self.canonical,
+            "parents": self.parents,
+            "trie": self.trie.root,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "Gazetteer":
+        return cls(
+            state["names"],
+            state["types"],
+            state["kinds"],
+            state["canonical"],
+            state["parents"],
+            NameTrie(state["trie"]),
+        )
+
+
+def parse_segment(
+    segment: str, outline: bool = False
+) -> Optional[Tuple[str, Tuple[str, ...], Tuple[str, ...]]]:
+    """
+    Parses "NAME (TYPE)" into the normalized name, its types and aliases:
+    "TOWN?" gives TOWN, "MUNICIPALITY/CITY?" both, and "?" none. On the
+    buildings list, types may be given in brackets instead, and in
+    outlines they always are, with aliases in parentheses. Outside
+    outlines, names are in upper case, so lower case segments are prose.
+    """
+    match = SEGMENT_RE.match(segment.strip())
+    if match is None or (not outline and LOWER_RE.search(match.group("name"))):
+        return None
+    name = normalize(match.group("name"))
+    groups = match.group("groups")
+    type_match = BRACKET_TYPE_RE.search(groups)
+    if type_match is None and not outline:
+        type_match = PAREN_TYPE_RE.match(groups)
+    types, aliases = (), ()
+    if type_match is not None:
+        types = tuple(
+            t
+            for t in (normalize(t.strip("? ")) for t in type_match.group(1).split("/"))
+            if t
+        )
+    if outline:
+        aliases = tuple(normalize(a) for a in PAREN_TYPE_RE.findall(groups))
+    return name, types, aliases
+
+
+def _parse_outline(lines: Iterable[str]) -> Iterator[List[Tuple[str, Tuple[str, ...]]]]:
+    """
+    Yields the path of every place in an outline, where places are
+    indented under the areas containing them:
+
+        Colombia [nation]:
+         Political:
+              Bogota [city]:
+                Barrio Gustavo Restrepo [neighborhood]
+    """
+    # (indentation, parsed segment) of the areas containing the next line
+    stack = []
+    for line in lines:
+        line = line.rstrip().expandtabs()
+        text = line.strip()
+        if not text or (text.endswith(":") and "[" not in text):
+            # blank lines and headings such as "Political:"
+            continue
+        indent = len(line) - len(text)
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        segment = parse_segment(text, outline=True)
+        if segment is None:
+            continue
+        stack.append((indent, segment))
+        yield [s for _, s in stack]
+
+
+def parse_list(
+    lines: Iterable[str],
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Yields ("path", [(name, types, aliases), ...]) for the entries of a
+    list, outermost area first, and ("synonym", (name, canonical name))
+    for its synonyms. Lines before the rule under the title, prose and
+    notes are skipped. containing-areas-part2 ends with an outline of
+    places in mixed case, which is parsed by _parse_outline.
+    """
+    lines = iter(lines)
+    for line in lines:
+        if RULE_RE.match(line):
+            break
+    for line in lines:
+        if OUTLINE_RE.search(line):
+            for path in _parse_outline(lines):
+                yield "path", path
+            return
+        line = NEW_MARKER_RE.sub("", line.rstrip())
+        if not line or line[0].isspace():
+            continue
+        synonym = SYNONYM_RE.match(line)
+        site = SITE_RE.search(line)
+        if synonym is not None:
+            yield "synonym", (
+                normalize(synonym.group("lhs")),
+                normalize(synonym.group("rhs")),
+            )
+        elif site is not None or ENTRY_RE.match(line):
+            if site is not None:
+                line = line[: site.start()]
+            segments = [parse_segment(s) for s in line.split(": ")]
+            if all(s is not None for s in segments):
+                yield "path", segments
+
+
+def source_files(documentation_dir: str = DOCUMENTATION_DIR) -> List[Tuple[str, str]]:
+    """The (path, kind) of every list the gazetteer is compiled from"""
+    files = []
+    for pattern, kind in SOURCES:
+        files.extend(
+            (path, kind)
+            for path in sorted(glob.glob(os.path.join(documentation_dir, pattern)))
+        )
+    if not files:
+        raise FileNotFoundError(f"No place name lists found in {documentation_dir}")
+    return files
+
+
+def sources_key(files: List[Tuple[str, str]]) -> str:
+    """
+    Hash of the lists' names and contents, and of the code that parses
+    them, under which the index is cached
+    """
+    h = hashlib.sha256(b"gazetteer")
+    # so that indexes built by older versions of build_gazetteer are rebuilt
+    with open(__file__, "rb") as f:
+        h.update(f.read())
+    for path, kind in files:
+        h.update(f"\0{os.path.basename(path)}\0{kind}\0".encode("utf-8"))
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def build_gazetteer(files: List[Tuple[str, str]]) -> Gazetteer:
+    names, ids, types, kinds, parents = [], {}, [], [], []
+    synonym_pairs = []
+
+    def add(name: str, kind: str, name_types: Tuple[str, ...] = ()) -> int:
+        id = ids.get(name)
+        if id is None:
+            id = ids[name] = len(names)
+            names.append(name)
+            types.append({})
+            kinds.append({})
+            parents.append({})
+        types[id].update(dict.fromkeys(name_types))
+        kinds[id][kind] = None
+        return id
+
+    for path, kind in files:
+        with open(path, encoding="latin-1") as f:
+            for entry_type, entry in parse_list(f):
+                if entry_type == "synonym":
+                    synonym_pairs.append(tuple(add(name, kind) for name in entry))
+                    continue
+                parent = None
+                for depth, (name, name_types, aliases) in enumerate(entry):
+                    if name == UNKNOWN:
+                        parent = None
+                        continue
+                    # enclosing areas are places, whichever list they are on
+                    id = add(
+                        name, kind if depth == len(entry) - 1 else "place", name_types
+                    )
+                    if parent is not None and parent != id:
+                        parents[id][parent] = None
+                    parent = id
+                    for alias in aliases:
+                        synonym_pairs.append((add(alias, kind), id))
+
+    # union-find over the synonym pairs, keeping the right-hand (canonical)
+    # side as the root unless the left-hand one is on a set list
+    roots = list(range(len(names)))
+
+    def find(id: int) -> int:
+        while roots[id] != id:
+            roots[id] = roots[roots[id]]
+            id = roots[id]
+        return id
+
+    def on_set_list(id: int) -> bool:
+        return any(kind in SET_LIST_KINDS for kind in kinds[id])
+
+    for lhs, rhs in synonym_pairs:
+        lhs, rhs = find(lhs), find(rhs)
+        if lhs == rhs:
+            continue
+        if on_set_list(lhs) and not on_set_list(rhs):
+            lhs, rhs = rhs, lhs
+        roots[lhs] = rhs
+
+    return Gazetteer(
+        names,
+        [tuple(t) for t in types],
+        [tuple(k) for k in kinds],
+        [find(id) for id in range(len(names))],
+        [tuple(p) for p in parents],
+    )
+
+
+def load_gazetteer(
+    documentation_dir: str = DOCUMENTATION_DIR,
+    cache_path: Optional[str] = CACHE_PATH,
+    rebuild: bool = False,
+) -> Gazetteer:
+    """
+    Loads the gazetteer from `cache_path` if it was compiled from the
+    current lists by the current code, and otherwise compiles it and writes the cache (unless
+    `cache_path` is None)
+    """
+    files = source_files(documentation_dir)
+    key = sources_key(files)
+    if cache_path is not None and not rebuild and os.path.exists(cache_path):
+        with PROFILER.section("gazetteer_load"):
+            try:
+                with open(cache_path, "rb") as f:
+                    cached = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                print(f"WARNING: ignoring unreadable gazetteer cache {cache_path}: {e}")
+                cached = None
+            if isinstance(cached, dict) and cached.get("key") == key:
+                return Gazetteer.from_state(cached["gazetteer"])
+    with PROFILER.section("gazetteer_build"):
+        gazetteer = build_gazetteer(files)
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                {"key": key, "gazetteer": gazetteer.to_state()},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, cache_path)
+    return gazetteer
+
+
+def add_gazetteer_args(parser) -> None:
+    """Adds the options of the scripts that use the gazetteer"""
+    parser.add_argument(
+        "--documentation-dir",
+        type=str,
+        default=DOCUMENTATION_DIR,
+        help="directory containing templ-doc-basic and templ-doc-more",
+    )
+    parser.add_argument(
+        "--gazetteer-cache",
+        type=str,
+        default=CACHE_PATH,
+        help="where the compiled gazetteer is cached; pass an empty string to disable caching",
+    )
+    parser.add_argument(
+        "--rebuild-gazetteer",
+        action="store_true",
+        help="recompile the gazetteer even if the cache is up to date",
+    )
+
+
+def gazetteer_from_args(args) -> Gazetteer:
+    return load_gazetteer(
+        args.documentation_dir, args.gazetteer_cache or None, args.rebuild_gazetteer
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--lookup",
+        nargs="+",
+        default=[],
+        help="names to look up; names not in the gazetteer are completed as prefixes",
+    )
+    add_gazetteer_args(parser)
+    add_profiling_args(parser)
+    args = parser.parse_args()
+
+    with profiling(args):
+        gazetteer = gazetteer_from_args(args)
+    print(
+        f"{len(gazetteer)} names in {len(gazetteer.members)} synonym classes, "
+        f"{sum(1 for p in gazetteer.parents if p)} with containing areas"
+    )
+    for name in args.lookup:
+        id = gazetteer.lookup(name)
+        matches = [id] if id is not None else gazetteer.complete(name)
+        print(
+            json.dumps(
+                {"query": name, "matches": [gazetteer.describe(i) for i in matches]},
+                indent=2,
+            )
+        )
@@ -0,0 +1,126 @@
+"""
+Incremental reader and writer for the large top-level JSON objects used
+throughout this repo (e.g. data/processed/{split}/{split}.json, which
+maps document IDs to documents). Rather than json.load-ing the whole
+file, items are decoded one at a time from a buffered stream, so only a
+single document needs to be held in memory at once. Likewise,
+tee_json_items writes items as they are consumed, in exactly the format
+json.dump(dict(items), f, indent=indent) would produce.
+"""
+import json
+
+from typing import *
+
+CHUNK_SIZE = 1 << 20
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Buffer:
+    """Growable text buffer over a file object"""
+
+    def __init__(self, f: TextIO, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # drop already consumed text so the buffer stays small
+        self.text = self.text[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self) -> None:
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text) or not self.fill():
+                return
+
+    def expect(self, chars: str) -> str:
+        self.skip_whitespace()
+        if self.pos >= len(self.text) or self.text[self.pos] not in chars:
+            found = self.text[self.pos : self.pos + 20] or "end of file"
+            raise ValueError(f"Expected one of {chars!r} but found {found!r}")
+        c = self.text[self.pos]
+        self.pos += 1
+        return c
+
+    def decode(self) -> Any:
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # the value may just be cut off at the end of the buffer
+                if self.fill():
+                    continue
+                raise
+            if end == len(self.text) and self.fill():
+                # a scalar (e.g. a number) may continue in the next chunk
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_items(
+    path: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Yields (key, value) pairs from a file containing a single top-level
+    JSON object, in file order, without loading the whole file.
+    """
+    with open(path) as f:
+        buf = _Buffer(f, chunk_size)
+        buf.expect("{")
+        buf.skip_whitespace()
+        if buf.text[buf.pos : buf.pos + 1] == "}":
+            return
+        while True:
+            key = buf.decode()
+            buf.expect(":")
+            yield key, buf.decode()
+            if buf.expect(",}") == "}":
+                return
+
+
+def tee_json_items(
+    items: Iterable[Tuple[str, Any]], path: str, indent: Optional[int] = None
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Yields the given (key, value) pairs unchanged, writing each one to a
+    JSON object in `path` before it is yielded. The file is complete once
+    the iterator is exhausted. Keys are assumed to be distinct.
+    """
+    newline = "\n" + " " * indent if indent is not None else ""
+    separator = "," + newline if indent is not None else ", "
+    with open(path, "w") as f:
+        f.write("{")
+        first = True
+        for key, value in items:
+            f.write(newline if first else separator)
+            f.write(json.dumps(key))
+            f.write(": ")
+            # indent nested lines by one more level, as json.dump does
+            f.write(json.dumps(value, indent=indent).replace("\n", newline))
+            first = False
+            yield key, value
+        if not first and indent is not None:
+            f.write("\n")
+        f.write("}")
+
+
+def write_json_items(
+    items: Iterable[Tuple[str, Any]], path: str, indent: Optional[int] = None
+) -> None:
+    for _ in tee_json_items(items, path, indent):
+        pass
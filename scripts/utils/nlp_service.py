@@ -0,0 +1,310 @@
+"""
+A local service that keeps spaCy pipelines loaded between runs of the
+scripts that tokenize or split text into sentences (preprocess.py,
+processed_to_concrete.py and the template anchor MTurk generator), so
+that a run on a handful of documents does not spend most of its time
+loading en_core_web_sm. Start it once, from the project root:
+
+    python scripts/utils/nlp_service.py serve --preload en_core_web_sm &
+
+tokenize and split_sentences send their texts to the service when it is
+running, and otherwise load the pipeline in-process on first use, with
+the same results either way. Both take a batch of texts and return
+(start, end) character offsets into each text, of its tokens or
+sentences.
+
+The service listens on a Unix socket, $MUCD_NLP_SOCKET if set and
+otherwise mucd-nlp-{uid}.sock in the temporary directory. Each message
+is a 4-byte big-endian length followed by a JSON object. Set
+MUCD_NLP_SOCKET to an empty string to never use the service.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from functools import lru_cache
+from typing import *
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+from utils.profiling import PROFILER
+
+Span = Tuple[int, int]
+
+SOCKET_ENV = "MUCD_NLP_SOCKET"
+OPERATIONS = ["tokenize", "split"]
+HEADER = struct.Struct(">I")
+
+
+def _load_parser():
+    import spacy
+
+    # the same components allennlp's SpacySentenceSplitter enables
+    return spacy.load("en_core_web_sm", disable=["vectors", "textcat", "ner"])
+
+
+def _load_full():
+    import spacy
+
+    return spacy.load("en_core_web_sm")
+
+
+def _load_sentencizer():
+    import spacy
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+
+PIPELINES = {
+    "en_core_web_sm": _load_full,
+    "en_core_web_sm_parser": _load_parser,
+    "sentencizer": _load_sentencizer,
+}
+
+
+def socket_path() -> Optional[str]:
+    path = os.environ.get(SOCKET_ENV)
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), f"mucd-nlp-{os.getuid()}.sock")
+    return path or None
+
+
+@lru_cache(maxsize=None)
+def load_pipeline(name: str):
+    if name not in PIPELINES:
+        raise ValueError(
+            f"Unknown pipeline {name!r}; choose from {', '.join(PIPELINES)}"
+        )
+    with PROFILER.section("model_load"):
+        return PIPELINES[name]()
+
+
+def process(name: str, op: str, texts: List[str]) -> List[List[Span]]:
+    """Runs an operation over a batch of texts in this process"""
+    nlp = load_pipeline(name)
+    if op == "tokenize":
+        # the later components of a pipeline do not change its tokens
+        return [[(t.idx, t.idx + len(t)) for t in nlp.make_doc(text)] for text in texts]
+    if op == "split":
+        return [
+            [(s.start_char, s.end_char) for s in doc.sents] for doc in nlp.pipe(texts)
+        ]
+    raise ValueError(f"Unknown operation {op!r}; choose from {', '.join(OPERATIONS)}")
+
+
+def send_message(sock: socket.socket, message: Dict[str, Any]) -> None:
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> Optional[bytes]:
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """The next message, or None if the other end closed the connection"""
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data)
+
+
+class NLPClient:
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+
+    def request(self, **message) -> Dict[str, Any]:
+        send_message(self.sock, message)
+        response = recv_message(self.sock)
+        if response is None:
+            raise ConnectionError("the NLP service closed the connection")
+        if "error" in response:
+            raise ValueError(f"NLP service: {response['error']}")
+        return response
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+# (process ID, client), so that forked workers open their own connection
+_client = (None, None)
+
+
+def get_client() -> Optional[NLPClient]:
+    """A connection to the service, or None if it is not running"""
+    global _client
+    pid, client = _client
+    if pid != os.getpid():
+        client = None
+        path = socket_path()
+        if path is not None and os.path.exists(path):
+            try:
+                client = NLPClient(path)
+            except OSError:
+                pass
+        _client = (os.getpid(), client)
+    return client
+
+
+def _run(name: str, op: str, texts: List[str]) -> List[List[Span]]:
+    global _client
+    client = get_client()
+    if client is not None:
+        try:
+            spans = client.request(op=op, pipeline=name, texts=texts)["spans"]
+            return [[tuple(span) for span in text_spans] for text_spans in spans]
+        except (OSError, ConnectionError) as e:
+            print(
+                f"WARNING: NLP service failed ({e}); falling back to {name} in-process"
+            )
+            client.close()
+            _client = (os.getpid(), None)
+    return process(name, op, texts)
+
+
+def tokenize(texts: List[str], pipeline: str = "en_core_web_sm") -> List[List[Span]]:
+    """The spans of the tokens of each text"""
+    return _run(pipeline, "tokenize", texts)
+
+
+def split_sentences(
+    texts: List[str], pipeline: str = "en_core_web_sm_parser"
+) -> List[List[Span]]:
+    """The spans of the sentences of each text, as spaCy's Doc.sents gives them"""
+    return _run(pipeline, "split", texts)
+
+
+def prepare_pipeline(name: str) -> None:
+    """Loads a pipeline up front, unless the service will be used"""
+    if get_client() is None:
+        load_pipeline(name)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+            try:
+                if request.get("op") == "ping":
+                    response = {"pid": os.getpid(), "loaded": list(self.server.loaded)}
+                else:
+                    # spaCy pipelines are not safe to share between threads
+                    with self.server.lock:
+                        spans = process(
+                            request["pipeline"], request["op"], request["texts"]
+                        )
+                        self.server.loaded[request["pipeline"]] = None
+                    response = {"spans": spans}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            try:
+                send_message(self.request, response)
+            except OSError:
+                return
+
+
+class NLPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str):
+        super().__init__(path, _Handler)
+        self.lock = threading.Lock()
+        self.loaded = {}
+
+
+def serve(path: str, preload: List[str] = ()) -> None:
+    if os.path.exists(path):
+        try:
+            NLPClient(path).close()
+        except OSError:
+            # left behind by a service that did not shut down cleanly
+            os.remove(path)
+        else:
+            raise SystemExit(f"An NLP service is already listening on {path}")
+    for name in preload:
+        start = time.perf_counter()
+        load_pipeline(name)
+        print(f"Loaded {name} in {time.perf_counter() - start:.1f}s")
+    server = NLPServer(path)
+    server.loaded.update(dict.fromkeys(preload))
+    print(f"Listening on {path}")
+    # clean up the socket when killed, too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command",
+        choices=["serve", "status"],
+        help="start the service, or report whether it is running",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=socket_path(),
+        help=f"path of the Unix socket (by default ${SOCKET_ENV} or one in the temporary directory)",
+    )
+    parser.add_argument(
+        "--preload",
+        nargs="*",
+        choices=list(PIPELINES),
+        default=[],
+        help="pipelines to load before listening; others are loaded on first use",
+    )
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("no socket path given")
+
+    if args.command == "serve":
+        serve(args.socket, args.preload)
+    else:
+        try:
+            client = NLPClient(args.socket)
+            status = client.request(op="ping")
+            client.close()
+        except OSError:
+            print(f"No NLP service is listening on {args.socket}")
+            sys.exit(1)
+        print(
+            f"NLP service {status['pid']} is listening on {args.socket} "
+            f"with {', '.join(status['loaded']) or 'no pipelines'} loaded"
+        )
@@ -0,0 +1,188 @@
+"""
+Lightweight instrumentation shared by the pipeline scripts.
+
+Code marks its hot sections with
+
+    with PROFILER.section("sentence_splitting"):
+        ...
+
+which costs next to nothing unless profiling has been switched on with
+the --profile option (see add_profiling_args). When it is, the number of
+calls and total time of every section are written to a JSON trace along
+with counts of the WARNING messages printed during the run, grouped by
+category. A cProfile or pyinstrument profile can be written as well.
+"""
+import cProfile
+import json
+import re
+import sys
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import *
+
+PROFILE_BACKENDS = ["none", "cprofile", "pyinstrument"]
+
+
+class _NullSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class _Section:
+    __slots__ = ("stats", "start")
+
+    def __init__(self, stats: List[float]):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats[0] += 1
+        self.stats[1] += time.perf_counter() - self.start
+        return False
+
+
+def warning_category(line: str) -> str:
+    """
+    Reduces a WARNING message to its category by dropping document IDs and
+    replacing quoted strings and numbers with placeholders, e.g.
+        WARNING docid=DEV-MUC3-0036 | apparent data error, missing quotes. ... ||| 2
+    becomes "apparent data error, missing quotes. adding back in. value was".
+    """
+    message = re.sub(r"^WARNING(\s+docid=\S+\s*\||\s*\([^)]*\))?:?\s*", "", line)
+    message = message.split("|||")[0]
+    message = re.sub(r"'[^']*'|\"[^\"]*\"", "<str>", message)
+    message = re.sub(r"\b\d+\b", "<n>", message)
+    return message.strip()
+
+
+class _WarningCounter:
+    """Wraps a text stream, counting lines that start with WARNING"""
+
+    def __init__(self, stream: TextIO, counts: Counter):
+        self.stream = stream
+        self.counts = counts
+        self.partial = ""
+
+    def write(self, s: str) -> int:
+        lines = (self.partial + s).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            if line.startswith("WARNING"):
+                self.counts[warning_category(line)] += 1
+        return self.stream.write(s)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.sections: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self.warnings = Counter()
+
+    def section(self, name: str):
+        """Context manager that times one execution of a named section"""
+        if not self.enabled:
+            return _NULL_SECTION
+        return _Section(self.sections[name])
+
+    def trace(self, total_seconds: float) -> Dict[str, Any]:
+        return {
+            "argv": sys.argv,
+            "total_seconds": total_seconds,
+            "sections": {
+                name: {
+                    "count": int(count),
+                    "total_seconds": seconds,
+                    "mean_ms": 1000 * seconds / count if count else 0.0,
+                    "fraction_of_total": seconds / (total_seconds or 1.0),
+                }
+                for name, (count, seconds) in sorted(
+                    self.sections.items(), key=lambda kv: -kv[1][1]
+                )
+            },
+            "warnings": dict(self.warnings.most_common()),
+        }
+
+
+PROFILER = Profiler()
+
+
+def add_profiling_args(parser) -> None:
+    """Adds the --profile options shared by all pipeline scripts"""
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar="TRACE_JSON",
+        help="record timings of hot sections and warning counts to this JSON file",
+    )
+    parser.add_argument(
+        "--profile-backend",
+        choices=PROFILE_BACKENDS,
+        default="none",
+        help="also write a cProfile (<trace>.prof) or pyinstrument (<trace>.html) profile",
+    )
+
+
+@contextmanager
+def profiling(args) -> Iterator[Profiler]:
+    """
+    Enables the profiler for the duration of the block if --profile was
+    given, and writes the trace (and any backend profile) at the end.
+    """
+    trace_file = getattr(args, "profile", None)
+    if trace_file is None:
+        yield PROFILER
+        return
+
+    backend = getattr(args, "profile_backend", "none")
+    stem = re.sub(r"\.json$", "", trace_file)
+    profiler = None
+    if backend == "cprofile":
+        profiler = cProfile.Profile()
+    elif backend == "pyinstrument":
+        from pyinstrument import Profiler as Pyinstrument
+
+        profiler = Pyinstrument()
+
+    PROFILER.enabled = True
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = _WarningCounter(stdout, PROFILER.warnings)
+    sys.stderr = _WarningCounter(stderr, PROFILER.warnings)
+    if backend == "cprofile":
+        profiler.enable()
+    elif backend == "pyinstrument":
+        profiler.start()
+    start = time.perf_counter()
+    try:
+        yield PROFILER
+    finally:
+        total_seconds = time.perf_counter() - start
+        sys.stdout, sys.stderr = stdout, stderr
+        PROFILER.enabled = False
+        if backend == "cprofile":
+            profiler.disable()
+            profiler.dump_stats(stem + ".prof")
+        elif backend == "pyinstrument":
+            profiler.stop()
+            with open(stem + ".html", "w") as f:
+                f.write(profiler.output_html())
+        with open(trace_file, "w") as f:
+            json.dump(PROFILER.trace(total_seconds), f, indent=2)
+        print(f"Wrote profiling trace to {trace_file}", file=sys.stderr)
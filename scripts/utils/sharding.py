@@ -0,0 +1,128 @@
+"""
+Hash sharding of the pipeline scripts across processes or machines.
+
+With --shard i/N (see add_shard_args), a script processes only the
+documents whose ID hashes to shard i of N, and writes each of its
+outputs to shard_path(path, shard) instead of `path`, e.g.
+
+    data/processed/dev/dev.json -> data/processed/dev/dev.shard-0-of-4.json
+
+Next to every shard output, a small positions file records where each
+of its items (documents, archive members or HITs) falls in the output
+of a single, unsharded run. scripts/pipeline/merge_shards.py uses these
+to interleave the shards back into that exact order. Document IDs are
+hashed with BLAKE2 rather than hash(), so that every process agrees on
+the assignment regardless of PYTHONHASHSEED.
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+
+from typing import *
+
+Item = TypeVar("Item")
+
+
+class Shard(NamedTuple):
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls, value: str) -> "Shard":
+        """Parses "i/N" (0 <= i < N), for use as an argparse type"""
+        try:
+            index, count = (int(x) for x in value.split("/"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+        if not 0 <= index < count:
+            raise argparse.ArgumentTypeError(f"shard {value} is out of range")
+        return cls(index, count)
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    def contains(self, doc_id: str) -> bool:
+        return shard_of(doc_id, self.count) == self.index
+
+
+def shard_of(doc_id: str, num_shards: int) -> int:
+    digest = hashlib.blake2b(doc_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+def shard_path(path: str, shard: Optional[Shard]) -> str:
+    """e.g. data/concrete/lowercase/dev.zip -> data/concrete/lowercase/dev.shard-0-of-4.zip"""
+    if shard is None:
+        return path
+    path = path.rstrip(os.sep)
+    stem, ext = os.path.splitext(path)
+    if stem.endswith(".tar"):
+        stem, ext = stem[: -len(".tar")], ".tar" + ext
+    return f"{stem}.shard-{shard.index}-of-{shard.count}{ext}"
+
+
+def positions_path(path: str) -> str:
+    return path.rstrip(os.sep) + ".positions.json"
+
+
+def write_positions(
+    path: str, positions: List[int], names: Optional[List[str]] = None
+) -> None:
+    """
+    Records the positions in the unsharded output of the items of the
+    shard output at `path`, in the order in which they were written. For
+    archives, the member names are recorded too, since a directory does
+    not keep the order in which its files were written.
+    """
+    with open(positions_path(path), "w") as f:
+        json.dump({"positions": positions, "names": names}, f)
+
+
+def read_positions(path: str) -> Tuple[List[int], Optional[List[str]]]:
+    with open(positions_path(path)) as f:
+        data = json.load(f)
+    return data["positions"], data["names"]
+
+
+def select_shard(
+    items: Iterable[Tuple[str, Item]],
+    shard: Optional[Shard],
+    positions: Optional[List[int]] = None,
+) -> Iterator[Tuple[str, Item]]:
+    """
+    Yields the (document ID, item) pairs that belong to `shard` (all of
+    them if it is None), appending the position of each among all items
+    to `positions`
+    """
+    for position, (doc_id, item) in enumerate(items):
+        if shard is None or shard.contains(doc_id):
+            if positions is not None:
+                positions.append(position)
+            yield doc_id, item
+
+
+def merge_shards(shards: List[Tuple[List[int], Iterable[Item]]]) -> Iterator[Item]:
+    """
+    Interleaves the items of each shard, given with their positions, into
+    the order of the unsharded output
+    """
+    return (
+        item
+        for _, item in heapq.merge(
+            *(zip(positions, items) for positions, items in shards),
+            key=lambda x: x[0],
+        )
+    )
+
+
+def add_shard_args(parser) -> None:
+    """Adds the --shard option shared by the pipeline scripts"""
+    parser.add_argument(
+        "--shard",
+        type=Shard.parse,
+        default=None,
+        metavar="I/N",
+        help="only process the documents in shard I of N, writing *.shard-I-of-N.* outputs to be combined with scripts/pipeline/merge_shards.py",
+    )
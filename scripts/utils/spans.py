@@ -0,0 +1,108 @@
+"""
+Index over the (start, end) character spans of a document's sections,
+sentences, tokens or mentions. Spans are half-open and stored as sorted
+NumPy arrays, so that point, containment and overlap lookups are binary
+searches rather than scans, and can be done for many queries at once:
+
+    sentences = SpanIndex(doc.sentences)
+    sentences.find(char)                     # sentence containing a character
+    sentences.containing(mention_starts, mention_ends)
+    sections.containing(sentences.starts, sentences.ends)
+    tokens.overlapping(start, end)           # tokens overlapping a span
+
+All lookups return indices into the spans as they were given (not as
+sorted), with -1 where there is no match. find and containing require
+the spans to be disjoint, as sections, sentences and tokens are;
+overlapping and within also work for overlapping spans such as
+mentions.
+"""
+import numpy as np
+
+from typing import *
+
+Spans = Union[Sequence[Sequence[int]], np.ndarray]
+
+
+class SpanIndex:
+    __slots__ = ("starts", "ends", "order", "disjoint")
+
+    def __init__(self, spans: Spans):
+        spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+        if np.any(spans[:, 0] > spans[:, 1]):
+            raise ValueError("Span ends must not precede their starts")
+        # sorted by start, then end; `order` maps back to the given order
+        order = np.lexsort((spans[:, 1], spans[:, 0]))
+        self.order = order
+        self.starts = spans[order, 0]
+        self.ends = spans[order, 1]
+        self.disjoint = bool(np.all(self.starts[1:] >= self.ends[:-1]))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> Tuple[int, int]:
+        j = np.flatnonzero(self.order == i)[0]
+        return int(self.starts[j]), int(self.ends[j])
+
+    def spans(self) -> np.ndarray:
+        """The spans in the order they were given, as an (n, 2) array"""
+        spans = np.empty((len(self), 2), dtype=np.int64)
+        spans[self.order, 0] = self.starts
+        spans[self.order, 1] = self.ends
+        return spans
+
+    def _check_disjoint(self) -> None:
+        if not self.disjoint:
+            raise ValueError("Lookup requires disjoint spans")
+
+    def _original(self, i: np.ndarray, found: np.ndarray) -> np.ndarray:
+        if not len(self):
+            return np.full(i.shape, -1, dtype=np.int64)
+        return np.where(found, self.order[np.clip(i, 0, None)], -1)
+
+    def find(self, positions: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        """
+        The index of the span containing each character position, or -1
+        """
+        self._check_disjoint()
+        positions = np.asarray(positions, dtype=np.int64)
+        i = np.searchsorted(self.starts, positions, side="right") - 1
+        found = (i >= 0) & (positions < self.ends[i]) if len(self) else None
+        result = self._original(i, found)
+        return int(result) if result.ndim == 0 else result
+
+    def containing(
+        self, starts: Union[int, np.ndarray], ends: Union[int, np.ndarray]
+    ) -> Union[int, np.ndarray]:
+        """
+        The index of the span that contains each [start, end) span, or -1
+        """
+        self._check_disjoint()
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        i = np.searchsorted(self.starts, starts, side="right") - 1
+        found = None
+        if len(self):
+            found = (i >= 0) & (ends <= self.ends[i]) & (starts < self.ends[i])
+            # an empty span at the end of a span is still inside it
+            found |= (i >= 0) & (starts == ends) & (ends == self.ends[i])
+        result = self._original(i, found)
+        return int(result) if result.ndim == 0 else result
+
+    def overlapping(self, start: int, end: int) -> np.ndarray:
+        """The indices of the spans overlapping [start, end), in sorted order"""
+        if self.disjoint:
+            # both starts and ends are sorted
+            lo = np.searchsorted(self.ends, start, side="right")
+            hi = np.searchsorted(self.starts, end, side="left")
+            return self.order[lo:hi]
+        hi = np.searchsorted(self.starts, end, side="left")
+        candidates = np.flatnonzero(self.ends[:hi] > start)
+        return self.order[candidates]
+
+    def within(self, start: int, end: int) -> np.ndarray:
+        """The indices of the spans contained in [start, end), in sorted order"""
+        lo = np.searchsorted(self.starts, start, side="left")
+        hi = np.searchsorted(self.starts, end, side="right")
+        candidates = lo + np.flatnonzero(self.ends[lo:hi] <= end)
+        return self.order[candidates]
@@ -8,6 +8,7 @@ from collections import Counter
 from typing import *
 
 from preprocessing.proc_keys import SELECTED_KEYS, NON_LIST_VALUED_KEYS
+from utils.data_model import Filler, Template, load_templates
 
 DATA_DIR = "data/semiprocessed/"
 
@@ -30,7 +31,7 @@ def fprint(text: str = ""):
     print(text, file=outfile)
 
 
-def pretty_print_entities(template: Dict[str, Any], slot: str) -> None:
+def pretty_print_entities(template: Template, slot: str) -> None:
     fprint(f"{slot}:")
     if template.get(slot) is not None:
         for item in template[slot]:
@@ -43,7 +44,7 @@ def pretty_print_entities(template: Dict[str, Any], slot: str) -> None:
 
 
 def pretty_print_effect_of_incident(
-    template: Dict[str, Any], is_human: bool = True
+    template: Template, is_human: bool = True
 ) -> None:
     slot = "hum_tgt_effect_of_incident" if is_human else "phys_tgt_effect_of_incident"
     fprint(f"{slot}:")
@@ -54,7 +55,7 @@ def pretty_print_effect_of_incident(
             )
 
 
-def pretty_print_organization_confidence(template: Dict[str, Any]) -> None:
+def pretty_print_organization_confidence(template: Template) -> None:
     fprint(f"perp_organization_confidence:")
     if template.get("perp_organization_confidence") is not None:
         for item in template["perp_organization_confidence"]:
@@ -63,7 +64,7 @@ def pretty_print_organization_confidence(template: Dict[str, Any]) -> None:
             )
 
 
-def pretty_print_date(template: Dict[str, Any]) -> None:
+def pretty_print_date(template: Template) -> None:
     fprint("incident_date:")
     incident_date = template.get("incident_date")
     if incident_date is not None:
@@ -72,7 +73,7 @@ def pretty_print_date(template: Dict[str, Any]) -> None:
         fprint(f"{OFFSET_STR + ', '.join(incident_dates)}")
 
 
-def pretty_print_location(template: Dict[str, Any]) -> None:
+def pretty_print_location(template: Template) -> None:
     to_print = []
     fprint(f"incident_location:")
     if template.get("incident_location") is not None:
@@ -92,7 +93,7 @@ def pretty_print_location(template: Dict[str, Any]) -> None:
         )
 
 
-def pretty_print_template(template: Dict[str, Any]) -> None:
+def pretty_print_template(template: Template) -> None:
     for k in NON_LIST_VALUED_KEYS:
         if k in {"message_id", "message_template_optional"}:
             continue
@@ -103,11 +104,11 @@ def pretty_print_template(template: Dict[str, Any]) -> None:
             )
             continue
         value = template[k]
-        if isinstance(value, dict):
+        if isinstance(value, Filler):
             value = value["strings"]
             if not len(value) == 1:
                 print(
-                    f"WARNING ({template['message_id']}): slot {k} in template {template['message_template']} had multiple values: {value}",
+                    f"WARNING ({template['message_id']}): slot {k} in template {template['message_template']} had multiple values: {list(value)}",
                     file=sys.stderr,
                 )
             value = value[0]
@@ -164,14 +165,13 @@ def view_annotations(
     template_type: Optional[str] = None,
     multi_same_type_template_only: bool = False,
 ) -> None:
-    with open(os.path.join(DATA_DIR, split, f"{split}_keys.json")) as f:
-        keys = json.load(f)
-        if template_type:
-            keys = get_annotated_documents_for_template_type(
-                keys, template_type, multi_same_type_template_only
-            )
-        if not keep_irrelevant:
-            keys = get_annotated_documents(keys, multi_same_type_template_only)
+    keys = load_templates(os.path.join(DATA_DIR, split, f"{split}_keys.json"))
+    if template_type:
+        keys = get_annotated_documents_for_template_type(
+            keys, template_type, multi_same_type_template_only
+        )
+    if not keep_irrelevant:
+        keys = get_annotated_documents(keys, multi_same_type_template_only)
     with open(os.path.join(DATA_DIR, split, f"{split}_docs.json")) as f:
         docs = json.load(f)
         if not keep_irrelevant: